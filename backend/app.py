@@ -2,6 +2,9 @@ import os
 from app import create_app
 from app.extensions import db
 from app.scheduler import scheduler
+from app.image_watcher import image_watcher
+from app.image_jobs import schedule_metadata_backfill, schedule_cold_image_archive
+from app.generation_jobs import generation_queue
 from conf import DATABASE_URI
 
 # --- Database Initialization for SQLite ---
@@ -32,6 +35,18 @@ with app.app_context():
 # Initialize scheduler with app
 scheduler.init_app(app)
 
+# Start live sync of ImageDefaultLocation directories
+image_watcher.init_app(app)
+
+# Fill size/dimension metadata for images created before those columns existed
+schedule_metadata_backfill(app)
+
+# Periodically move generated images that have not been viewed for a while to cold storage
+schedule_cold_image_archive(app)
+
+# Run /images/generate jobs in a bounded worker pool; requeue jobs left over from the last run
+generation_queue.init_app(app)
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', '5001'))
     app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
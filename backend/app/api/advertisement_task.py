@@ -1,5 +1,5 @@
 """API endpoints for managing advertisement tasks"""
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify
 from app.extensions import db
 from app.models.advertisement_task import AdvertisementTask, TaskStatus, TaskType
 from app.models.buyer_task import BuyerTask, BuyerTaskStatus
@@ -11,6 +11,7 @@ from datetime import datetime
 import os
 import requests
 from app.utils.logger import logger
+from app.utils.file_response import send_image_file
 
 bp = Blueprint('advertisement_task', __name__, url_prefix='/api/advertisement-tasks')
 
@@ -418,7 +419,7 @@ def serve_image(task_id):
             }), 404
         
         # Serve the file
-        return send_file(full_path, mimetype='image/jpeg')
+        return send_image_file(full_path)
         
     except Exception as e:
         return jsonify({
@@ -796,7 +797,7 @@ def serve_rule_card_image(rule_card_id):
             mimetype = 'image/webp'
         
         # Serve the file
-        return send_file(full_path, mimetype=mimetype)
+        return send_image_file(full_path, mimetype=mimetype)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -1,28 +1,27 @@
 from flask import Blueprint
 from app.utils.response import success_response
-import websocket
-from conf import COMFYUI_SERVER_ADDRESS
+from comfyui_api.api.router import comfyui_router
 
 bp = Blueprint('health', __name__, url_prefix='/api')
 
 def check_comfyui_status():
-    try:
-        ws = websocket.WebSocket()
-        ws.connect("ws://{}/ws?clientId=health_check".format(COMFYUI_SERVER_ADDRESS))
-        ws.close()
-        return True, "ComfyUI is running"
-    except Exception as e:
-        return False, "ComfyUI is not running. Please start ComfyUI first."
+    # 经由路由器探测所有 ComfyUI 后端（/queue 与 /system_stats，结果短时缓存），任一可用即视为运行中
+    backends = comfyui_router.status()
+    healthy = sum(1 for backend in backends if backend['healthy'])
+    if healthy:
+        return True, f"ComfyUI is running ({healthy}/{len(backends)} backends available)", backends
+    return False, "ComfyUI is not running. Please start ComfyUI first.", backends
 
 @bp.route('/health', methods=['GET'])
 def health_check():
-    comfyui_running, comfyui_message = check_comfyui_status()
+    comfyui_running, comfyui_message, backends = check_comfyui_status()
     
     return success_response({
         'status': 'healthy' if comfyui_running else 'warning',
         'message': 'Service is running',
         'comfyui_status': {
             'running': comfyui_running,
-            'message': comfyui_message
+            'message': comfyui_message,
+            'backends': backends
         }
     }) 
\ No newline at end of file
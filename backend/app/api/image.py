@@ -1,19 +1,44 @@
-from flask import Blueprint, request, send_from_directory, send_file, jsonify, current_app, make_response
+from flask import Blueprint, Response, request, jsonify, current_app, make_response, stream_with_context
 from flask_cors import cross_origin
 from werkzeug.utils import secure_filename
 from pathlib import Path
 import os
-import shutil
+import math
 from datetime import datetime
 from typing import List, Dict, Optional
+from sqlalchemy import and_, or_, update
 
 from app.utils.response import success_response, error_response
-from conf import ALLOWED_EXTENSIONS, UPLOAD_FOLDER, OUTPUT_FOLDER, BASE_PATH
-from comfyui_api.utils.actions.prompt_to_image import prompt_to_image
-from comfyui_api.utils.actions.load_workflow import load_workflow
-from app.models.image import Image, ImageSource, ImageType, ImageDefaultLocation, DeletedImagePath
+from conf import (ALLOWED_EXTENSIONS, UPLOAD_FOLDER, OUTPUT_FOLDER, ARCHIVE_AFTER_DAYS, SPRITE_MAX_IMAGES,
+                  THUMBNAIL_WIDTHS)
+from app.models.image import (Image, ImageSource, ImageType, ImageDefaultLocation, DeletedImagePath,
+                              ImageDirectoryManifest)
+from app.models.generation_job import GenerationJob, GenerationJobStatus
 from app.extensions import db
 from app.utils.logger import logger
+from app.image_watcher import image_watcher
+from app.image_jobs import (schedule_metadata_backfill, schedule_thumbnail_prewarm, compute_perceptual_hashes,
+                            analyze_images, start_clear_all_images, start_orphan_cleanup,
+                            start_storage_shard_migration, start_cold_image_archive,
+                            touch_image_access)
+from app.generation_jobs import generation_queue, GenerationQueueFull, workflow_file_path, sse_message
+from app.utils.image_paths import candidate_paths, image_path_resolver
+from app.utils.thumbnails import thumbnail_service, snap_width
+from app.utils.sprites import sprite_service
+from app.utils.image_ingest import ImageIngestor, IngestIndex, group_upload_duplicates, sync_directory
+from app.utils.image_walker import iter_image_files
+from app.utils.perceptual_hash import phash_index, HASH_BITS, MAX_GROUP_DISTANCE
+from app.utils.color_index import color_index, histogram_from_colors, METRICS as COLOR_METRICS
+from app.utils.image_analysis import histogram_from_bytes
+from app.utils.count_cache import image_count_cache
+from app.utils.job_progress import job_registry
+from app.utils.storage_layout import STORAGE_ROOTS, migrated_file_path
+from app.utils.image_archive import image_archive
+from app.utils.file_response import send_image_file, send_image_from_directory
+from app.utils.blob_store import upload_blob_store, output_blob_store
+from app.utils.image_upload import (allowed_file, parse_image_type, pasted_filename, content_hash_in_use,
+                                    register_upload, finish_uploads)
+from app.utils.chunked_upload import chunked_upload_store, UploadSessionError
 from app.models.workflow import Workflow
 from app.models.variable_definitions import VariableDefinitions
 from app.models.workflow_variable import WorkflowVariable
@@ -21,10 +46,6 @@ from app.models.workflow_variable import WorkflowVariable
 # Create the blueprint with /api prefix to match frontend API calls
 bp = Blueprint('image', __name__, url_prefix='/api')
 
-def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 @bp.route('/images/scan-directory', methods=['POST'])
 def scan_image_directory():
     """扫描指定目录并添加图片到数据库，可选指定图片类型"""
@@ -44,86 +65,30 @@ def scan_image_directory():
             except ValueError:
                 image_type_enum = ImageType.general
 
-        image_files = []
-        for ext in ALLOWED_EXTENSIONS:
-            image_files.extend(list(Path(directory).rglob(f'*.{ext}')))
-        
-        logger.info(f'Scanning directory: {directory}, found {len(image_files)} image files, type: {image_type_enum}, force_rescan: {force_rescan}')
-
-        # Get all deleted paths to skip during scanning
-        deleted_paths = set(d.local_path for d in DeletedImagePath.query.all())
-        logger.info(f'Found {len(deleted_paths)} deleted paths to skip')
-
-        added_count = 0
-        updated_count = 0
-        skipped_count = 0
-        
-        for img_path in image_files:
-            # Skip if this path was previously deleted
-            if str(img_path) in deleted_paths:
-                skipped_count += 1
-                logger.debug(f'Skipping deleted path: {img_path}')
-                continue
-            
-            # 先尝试通过本地路径匹配
-            existing = Image.query.filter_by(local_path=str(img_path)).first()
-            if existing:
-                if image_type_enum and existing.image_type != image_type_enum:
-                    existing.image_type = image_type_enum
-                    updated_count += 1
-                    logger.debug(f'Updated type for existing image: {img_path.name}')
-                else:
-                    skipped_count += 1
-                continue
-
-            # 再尝试通过文件名匹配，检查是否已存在同名图片
-            filename = img_path.name
-            found_duplicate = False
-            possible_matches = Image.query.filter(Image.filename == filename).all()
-            for rec in possible_matches:
-                # 如果找到同名的local_dir记录，说明已存在，跳过
-                if rec.source == ImageSource.local_dir:
-                    found_duplicate = True
-                    if image_type_enum and rec.image_type != image_type_enum:
-                        rec.image_type = image_type_enum
-                        updated_count += 1
-                        logger.debug(f'Updated type for duplicate image: {filename}')
-                    else:
-                        skipped_count += 1
-                    break
-                # 如果是上传记录，更新其类型但不阻止创建local_dir记录
-                elif image_type_enum and rec.image_type != image_type_enum:
-                    p = (rec.file_path or '').replace('\\', '/').lower()
-                    if 'upload/images/' in p or p.endswith(filename.lower()):
-                        rec.image_type = image_type_enum
-                        logger.debug(f'Updated type for uploaded image: {filename}')
-            
-            # 如果找到重复的local_dir记录，跳过
-            if found_duplicate:
-                continue
+        if not os.path.isdir(directory):
+            return error_response('无效的目录路径')
 
-            img = Image(
-                filename=img_path.name,
-                file_path=str(img_path.relative_to(BASE_PATH)) if str(img_path).startswith(str(BASE_PATH)) else str(img_path),
-                source=ImageSource.local_dir,
-                local_path=str(img_path),
-                image_type=image_type_enum or ImageType.general,
-                created_at=datetime.fromtimestamp(img_path.stat().st_mtime)
-            )
-            db.session.add(img)
-            added_count += 1
-            logger.debug(f'Added new image: {img_path.name}')
+        # 基于目录清单增量扫描，只对新增/修改/删除的文件批量写库
+        scan, result = sync_directory(directory, image_type_enum, force=force_rescan)
+        added_count = result.added
+        updated_count = result.updated
+        skipped_count = result.skipped
+        removed_count = result.removed
 
         db.session.commit()
+        # 新文件的尺寸/格式由后台任务读取，不阻塞扫描请求
+        if added_count or updated_count:
+            schedule_metadata_backfill(prewarm=True)
         
-        logger.info(f'Scan complete: added={added_count}, updated={updated_count}, skipped={skipped_count}, total_files={len(image_files)}')
+        logger.info(f'Scan complete: added={added_count}, updated={updated_count}, skipped={skipped_count}, removed={removed_count}, total_files={scan.total_files}')
 
         return success_response({
             'message': f'扫描完成: 新增 {added_count} 张，更新 {updated_count} 张，跳过 {skipped_count} 张',
             'added_count': added_count,
             'updated_count': updated_count,
             'skipped_count': skipped_count,
-            'total_files': len(image_files)
+            'removed_count': removed_count,
+            'total_files': scan.total_files
         })
 
     except Exception as e:
@@ -133,7 +98,7 @@ def scan_image_directory():
 
 @bp.route('/images/participate/<int:image_id>', methods=['POST'])
 def mark_image_participation(image_id: int):
-    """标记图片参与状态，使用 variables 中的 participated 字段进行存储"""
+    """标记图片参与状态"""
     try:
         payload = request.get_json() or {}
         participated = bool(payload.get('participated', True))
@@ -145,13 +110,11 @@ def mark_image_participation(image_id: int):
         image_type_value = vars_obj.get('image_type')
         # If no variables set, try to get from image.image_type
         if not image_type_value:
-            image_type_value = image.image_type if image.image_type else None
+            image_type_value = image.image_type.value if image.image_type else None
         if image_type_value != ImageType.advertising_rule.value:
             return error_response('仅广告规则图片可参与', 400)
 
-        vars_obj['participated'] = participated
-        image.variables = vars_obj
-        db.session.add(image)
+        image.set_participated(participated)
         db.session.commit()
         return success_response({'participated': participated}, message='参与状态已更新')
     except Exception as e:
@@ -164,11 +127,7 @@ def mark_image_as_participated(image_id: int):
     """Mark image as participated (used by advertisement participation flow)"""
     try:
         image = Image.query.get_or_404(image_id)
-        
-        # Set participated flag to true in variables JSON
-        variables = image.variables or {}
-        variables['participated'] = True
-        image.variables = variables
+        image.set_participated(True)
         db.session.commit()
         
         logger.info(f"✓ Marked image {image_id} as participated")
@@ -183,36 +142,25 @@ def bulk_mark_as_participated():
     """Bulk mark images as participated by image_type"""
     try:
         data = request.get_json() or {}
-        image_type = data.get('image_type', 'advertising_campaign')
-        
-        # Find all images of the specified type
-        images = Image.query.filter_by(image_type=image_type).all()
-        
-        # Filter out already participated images
-        images_to_update = []
-        for image in images:
-            variables = image.variables or {}
-            if not variables.get('participated', False):
-                images_to_update.append(image)
-        
-        count = len(images_to_update)
+        image_type = parse_image_type(data.get('image_type', 'advertising_campaign'))
+
+        # 单条 UPDATE ... WHERE，由 (image_type, participated, used) 索引定位
+        count = db.session.execute(
+            update(Image)
+            .where(Image.image_type == image_type, Image.participated == False)
+            .values(participated=True, participated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+
         if count == 0:
             return success_response({
                 'updated_count': 0,
-                'message': f'No unparticipated {image_type} images found'
+                'message': f'No unparticipated {image_type.value} images found'
             })
-        
-        # Update all images by setting participated in their variables JSON
-        for image in images_to_update:
-            variables = image.variables or {}
-            variables['participated'] = True
-            image.variables = variables
-            # Force SQLAlchemy to detect the change
-            db.session.add(image)
-        
-        db.session.commit()
-        
-        logger.info(f"✓ Bulk marked {count} {image_type} images as participated")
+
+        image_count_cache.clear()
+        logger.info(f"✓ Bulk marked {count} {image_type.value} images as participated")
         return success_response({
             'updated_count': count,
             'message': f'Successfully marked {count} images as participated'
@@ -259,6 +207,8 @@ def set_default_location():
             db.session.add(existing)
             logger.info(f'Created default location for {image_type_enum.value}: {directory}')
         db.session.commit()
+        # 重新订阅默认目录，新目录中的已有文件会在下一次同步时入库
+        image_watcher.refresh_locations()
 
         # After commit, the 'existing' object is persistent and can be converted to dict
         return success_response({'message': '默认目录已保存', 'location': existing.to_dict()})
@@ -289,99 +239,29 @@ def upload_image():
             
         file = request.files['file']
         if file.filename == '':
-            # Generate a filename for pasted images with microseconds for uniqueness
-            import uuid
-            import time
-            # Use full timestamp with milliseconds to avoid collisions
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')  # Includes microseconds
-            ext = file.mimetype.split('/')[-1] if '/' in file.mimetype else 'png'
-            # Use full UUID to ensure absolute uniqueness
-            unique_id = uuid.uuid4().hex
-            file.filename = f'pasted_{timestamp}_{unique_id}.{ext}'
+            # Generate a unique filename for pasted images
+            file.filename = pasted_filename(file.mimetype)
             logger.info(f"Generated unique filename for pasted image: {file.filename}")
             
         # Get image type from form data, default to 'general'
-        image_type = request.form.get('image_type', 'general')
-        try:
-            # First try by name
-            image_type_enum = ImageType(image_type)
-        except ValueError:
-            # Then try by value
-            for member in ImageType:
-                if member.value == image_type:
-                    image_type_enum = member
-                    break
-            else:
-                # If no match found, use default
-                image_type_enum = ImageType.general
+        image_type_enum = parse_image_type(request.form.get('image_type'))
             
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            
-            # Create upload directory if it doesn't exist
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            
-            # Save the file to upload folder
-            file.save(file_path)
-            logger.info(f"File saved to upload folder: {file_path}")
-            
-            # Check if there's a default location for this image type
-            default_location = ImageDefaultLocation.query.filter_by(
-                image_type=image_type_enum.value
-            ).first()
-            
-            local_path = None
-            if default_location and default_location.directory:
-                # Copy file to default directory
-                try:
-                    default_dir = default_location.directory
-                    os.makedirs(default_dir, exist_ok=True)
-                    
-                    dest_path = os.path.join(default_dir, filename)
-                    # If file already exists, add timestamp to make it unique
-                    if os.path.exists(dest_path):
-                        name, ext = os.path.splitext(filename)
-                        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                        filename_with_time = f"{name}_{timestamp}{ext}"
-                        dest_path = os.path.join(default_dir, filename_with_time)
-                    
-                    shutil.copy2(file_path, dest_path)
-                    local_path = dest_path
-                    logger.info(f"File copied to default location: {dest_path}")
-                except Exception as e:
-                    logger.error(f"Failed to copy file to default location: {str(e)}")
-                    # Continue even if copy fails
-            
-            # For pasted images (unique filenames), always create new records
-            # For uploaded files with duplicate names, update existing record
-            existing = Image.query.filter_by(source=ImageSource.upload, filename=filename).first()
-            if existing and not filename.startswith('pasted_'):
-                # Only update if it's a manually uploaded file (not pasted)
-                logger.info(f"Updating existing image record for {filename}")
-                existing.file_path = f'/uploads/{filename}'
-                existing.image_type = image_type_enum
-                existing.local_path = local_path
-                image = existing
-            else:
-                # Always create new record for pasted images
-                logger.info(f"Creating new image record for {filename} with type {image_type_enum}")
-                image = Image(
-                    filename=filename,
-                    file_path=f'/uploads/{filename}',
-                    source=ImageSource.upload,
-                    image_type=image_type_enum,
-                    local_path=local_path
-                )
-                db.session.add(image)
+            ext = os.path.splitext(filename)[1]
+
+            # 边接收边计算 SHA-256，相同内容只在 blob 存储中保留一份
+            content_hash, blob_path, created = upload_blob_store.put_stream(file.stream, ext)
+            logger.info(f"File stored as {blob_path} (new content: {created})")
+
+            outcome = register_upload(filename, content_hash, blob_path, image_type_enum)
             db.session.commit()
-            logger.info(f"Database committed. Image ID: {image.id}, Type: {image.image_type}, Local path: {local_path}")
-            
+            image = outcome.image
+            logger.info(f"Database committed. Image ID: {image.id}, Type: {image.image_type}, Local path: {outcome.local_path}")
+            schedule_thumbnail_prewarm(finish_uploads([outcome]))
+
             logger.info(f"Image uploaded successfully: {filename}")
-            return success_response({
-                'message': '图片上传成功' + (' (已保存到默认目录)' if local_path else ''),
-                'image': image.to_dict()
-            })
+            return success_response(outcome.to_dict())
         else:
             return error_response('File type not allowed')
             
@@ -390,8 +270,124 @@ def upload_image():
         logger.error(f"Error uploading image: {str(e)}", exc_info=True)
         return error_response(f'上传失败: {str(e)}')
 
+@bp.route('/images/upload/batch', methods=['POST'])
+def upload_images_batch():
+    """一次请求上传多张图片（表单字段 files），所有记录在同一个事务中提交"""
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return error_response('No file part')
+
+        image_type_enum = parse_image_type(request.form.get('image_type'))
+        default_locations = {}
+        outcomes = []
+        rejected = []
+        for file in files:
+            if file.filename == '':
+                file.filename = pasted_filename(file.mimetype)
+            if not allowed_file(file.filename):
+                rejected.append({'filename': file.filename, 'error': 'File type not allowed'})
+                continue
+            filename = secure_filename(file.filename)
+            content_hash, blob_path, _ = upload_blob_store.put_stream(
+                file.stream, os.path.splitext(filename)[1])
+            outcomes.append(register_upload(filename, content_hash, blob_path, image_type_enum,
+                                            default_locations))
+            # 让同一批次中后续的重复内容能查询到刚创建的记录
+            db.session.flush()
+
+        db.session.commit()
+        schedule_thumbnail_prewarm(finish_uploads(outcomes))
+        logger.info(f"Batch upload finished: {len(outcomes)} stored, {len(rejected)} rejected")
+        return success_response({
+            'message': f'成功上传 {len(outcomes)} 张图片',
+            'results': [outcome.to_dict() for outcome in outcomes],
+            'rejected': rejected
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error uploading images: {str(e)}", exc_info=True)
+        return error_response(f'上传失败: {str(e)}')
+
+def _upload_session_error(e: UploadSessionError):
+    data = {'offset': e.offset} if e.offset is not None else None
+    return error_response(str(e), e.status_code, data)
+
+@bp.route('/images/upload/sessions', methods=['POST'])
+def create_upload_session():
+    """创建分片上传会话
+
+    请求体: {filename, size, sha256?, image_type?}
+    之后按顺序 PUT /images/upload/sessions/<id>?offset=<已上传字节数> 上传分片（请求体为原始字节，
+    可通过 X-Chunk-Sha256 头校验分片），中断后 GET 会话取得 offset 继续上传，最后 POST .../complete。
+    """
+    try:
+        data = request.get_json() or {}
+        filename = secure_filename(data.get('filename') or '')
+        if not filename or not allowed_file(filename):
+            return error_response('File type not allowed')
+        try:
+            size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return error_response('文件大小无效')
+
+        session = chunked_upload_store.create(
+            filename, size, data.get('sha256'),
+            image_type=parse_image_type(data.get('image_type')).value
+        )
+        return success_response(session)
+    except UploadSessionError as e:
+        return _upload_session_error(e)
+    except Exception as e:
+        logger.error(f"Error creating upload session: {str(e)}", exc_info=True)
+        return error_response(f'创建上传会话失败: {str(e)}')
+
+@bp.route('/images/upload/sessions/<session_id>', methods=['GET', 'PUT', 'DELETE'])
+def upload_session(session_id):
+    """查询进度 / 上传分片 / 取消上传"""
+    try:
+        if request.method == 'GET':
+            return success_response(chunked_upload_store.get(session_id))
+        if request.method == 'DELETE':
+            chunked_upload_store.abort(session_id)
+            return success_response({'message': '上传已取消'})
+
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return error_response('缺少 offset 参数')
+        offset = chunked_upload_store.write_chunk(
+            session_id, offset, request.stream, request.content_length,
+            request.headers.get('X-Chunk-Sha256')
+        )
+        return success_response({'id': session_id, 'offset': offset})
+    except UploadSessionError as e:
+        return _upload_session_error(e)
+    except Exception as e:
+        logger.error(f"Error handling upload session {session_id}: {str(e)}", exc_info=True)
+        return error_response(f'上传失败: {str(e)}')
+
+@bp.route('/images/upload/sessions/<session_id>/complete', methods=['POST'])
+def complete_upload_session(session_id):
+    """校验完整文件后入库；分片文件直接重命名为 blob，不再复制"""
+    try:
+        meta, content_hash, blob_path, created = chunked_upload_store.complete(session_id)
+        logger.info(f"Chunked upload {session_id} stored as {blob_path} (new content: {created})")
+
+        outcome = register_upload(meta['filename'], content_hash, blob_path,
+                                  parse_image_type(meta.get('image_type')))
+        db.session.commit()
+        schedule_thumbnail_prewarm(finish_uploads([outcome]))
+        return success_response(outcome.to_dict())
+    except UploadSessionError as e:
+        return _upload_session_error(e)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error completing upload session {session_id}: {str(e)}", exc_info=True)
+        return error_response(f'上传失败: {str(e)}')
+
 @bp.route('/images/generate', methods=['POST'])
 def generate_image():
+    """提交生成任务后立即返回 job id，进度通过 /images/generate/jobs/<job_id>（轮询）或其 /events（SSE）获取"""
     try:
         logger.info("Starting image generation request")
         
@@ -407,17 +403,10 @@ def generate_image():
         # 获取工作流信息
         workflow = Workflow.query.get_or_404(workflow_id)
         
-        # 规范化路径处理
-        normalized_path = workflow.file_path.replace('\\', '/')
-        workflow_path = os.path.join(BASE_PATH, normalized_path)
-        
+        workflow_path = workflow_file_path(workflow)
         if not os.path.exists(workflow_path):
             logger.error(f"Workflow file not found: {workflow_path}")
             return error_response('Workflow file not found')
-            
-        # 加载工作流
-        logger.info(f"Loading workflow from: {workflow_path}")
-        workflow_data = load_workflow(workflow_path)
         
         # 构建变量映射
         variable_mapping = {}
@@ -451,56 +440,75 @@ def generate_image():
         logger.info(f"Variable mapping created: {variable_mapping}")
         logger.info(f"Output nodes: {output_nodes}")
         
-        # 调用生成方法
-        logger.info("Starting image generation process")
         try:
-            result = prompt_to_image(
-                workflow=workflow_data,
-                variable_values=variable_mapping,
-                output_node_ids=output_nodes,
-                save_previews=True
-            )
-        except ValueError as e:
-            logger.error("Invalid input parameters", exc_info=e)
-            return error_response(str(e), 400)
-        except RuntimeError as e:
-            logger.error("Image generation failed", exc_info=e)
-            return error_response(str(e), 500)
-            
-        logger.info(f"Image generation completed: {result}")
-        
-        # 保存图片信息到数据库
-        try:
-            image = Image(
-                filename=os.path.basename(result[0]),
-                workflow_id=workflow_id,
-                workflow_name=workflow.name,
-                file_path=os.path.join(OUTPUT_FOLDER, result[0]),
-                variables=variable_mapping,
-                source=ImageSource.generated
-            )
-            db.session.add(image)
-            db.session.commit()
-            logger.info(f"Image record saved to database with ID: {image.id}")
-        except Exception as e:
-            logger.error("Failed to save image record to database", exc_info=e)
-            # 即使数据库保存失败，仍然返回生成的图片
-            return success_response({
-                'message': 'Image generated but failed to save record',
-                'result': result,
-                'error': str(e)
-            })
+            job = generation_queue.create(workflow, variable_mapping, output_nodes)
+        except GenerationQueueFull as e:
+            logger.warning(f"Rejected generation request: {str(e)}")
+            return error_response('生成队列已满，请稍后再试', 429)
 
+        logger.info(f"Generation job {job.id} queued")
         return success_response({
-            'message': 'Image generated successfully',
-            'result': result,
-            'image_info': image.to_dict()
-        })
+            **job.to_dict(),
+            'status_url': f'/api/images/generate/jobs/{job.id}',
+            'events_url': f'/api/images/generate/jobs/{job.id}/events'
+        }, 'Image generation queued')
 
     except Exception as e:
+        db.session.rollback()
         logger.exception("Unexpected error during image generation")
         return error_response(f'Image generation failed: {str(e)}', 500)
 
+@bp.route('/images/generate/jobs', methods=['GET'])
+def list_generation_jobs():
+    """最近的生成任务，可按 status 过滤"""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    query = GenerationJob.query
+    status = request.args.get('status')
+    if status:
+        try:
+            query = query.filter(GenerationJob.status == GenerationJobStatus(status))
+        except ValueError:
+            return error_response(f'Invalid status: {status}')
+    jobs = query.order_by(GenerationJob.created_at.desc()).limit(limit).all()
+    return success_response({
+        'items': [generation_queue.snapshot(job.id) for job in jobs],
+        'pending': generation_queue.pending
+    })
+
+@bp.route('/images/generate/jobs/<job_id>', methods=['GET'])
+def get_generation_job(job_id):
+    state = generation_queue.snapshot(job_id)
+    if state is None:
+        return error_response('Job not found', 404)
+    return success_response(state)
+
+@bp.route('/images/generate/jobs/<job_id>/events', methods=['GET'])
+def stream_generation_job(job_id):
+    """以 Server-Sent Events 推送任务状态的每次变化（event: progress），任务结束后关闭连接"""
+    if generation_queue.snapshot(job_id) is None:
+        return error_response('Job not found', 404)
+    events = (sse_message(state) for state in generation_queue.stream(job_id))
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+_LIST_PAGING_PARAMS = {'page', 'per_page', 'after', 'sort_by', 'order', 'total'}
+
+def _encode_cursor(image: Image) -> str:
+    return f'{image.created_at.isoformat()},{image.id}'
+
+def _parse_cursor(value: str):
+    created_at, image_id = value.rsplit(',', 1)
+    return datetime.fromisoformat(created_at), int(image_id)
+
+def _list_total(query, mode: str) -> Optional[int]:
+    """exact 每次 COUNT(*)；cached 按过滤条件缓存一段时间；none 不计算总数"""
+    if mode == 'none':
+        return None
+    if mode == 'cached':
+        key = tuple(sorted((k, v) for k, v in request.args.items() if k not in _LIST_PAGING_PARAMS))
+        return image_count_cache.get_or_compute(key, query.order_by(None).count)
+    return query.order_by(None).count()
+
 @bp.route('/images', methods=['GET'])
 def list_images():
     try:
@@ -540,12 +548,86 @@ def list_images():
                 logger.error(f'Error converting image_type to enum: {e}')
                 query = query.filter(Image.image_type == image_type)
         
+        # Filter by file size (bytes) / dimensions (pixels) if provided
+        range_filters = [
+            ('min_size', Image.file_size, True), ('max_size', Image.file_size, False),
+            ('min_width', Image.width, True), ('max_width', Image.width, False),
+            ('min_height', Image.height, True), ('max_height', Image.height, False),
+        ]
+        for param, column, is_min in range_filters:
+            value = request.args.get(param, type=int)
+            if value is not None:
+                query = query.filter(column >= value if is_min else column <= value)
+
+        # Filter by participated / used flags (true/false)
+        for param, column in (('participated', Image.participated), ('used', Image.used)):
+            value = request.args.get(param)
+            if value is not None and value != '':
+                query = query.filter(column == (value.lower() in ('1', 'true', 'yes')))
+
+        # Sort, defaults to newest first
+        sort_columns = {
+            'created_at': Image.created_at,
+            'size': Image.file_size,
+            'width': Image.width,
+            'height': Image.height,
+            'file_mtime': Image.file_mtime,
+        }
+        sort_column = sort_columns.get(request.args.get('sort_by', 'created_at'), Image.created_at)
+        ascending = request.args.get('order', 'desc').lower() == 'asc'
+        if ascending:
+            ordering = [sort_column.asc(), Image.id.asc()]
+        else:
+            ordering = [sort_column.desc(), Image.id.desc()]
+
+        total_mode = request.args.get('total')
+        after = request.args.get('after')
+
+        # Cursor mode: ?after=<created_at>,<id> (empty for the first page). Backed by the
+        # (source, image_type, created_at, id) index, so deep pages cost the same as the first one.
+        if after is not None:
+            if sort_column is not Image.created_at:
+                return error_response('游标分页仅支持按 created_at 排序', 400)
+            filtered = query
+            if after:
+                try:
+                    cursor_created, cursor_id = _parse_cursor(after)
+                except ValueError:
+                    return error_response(f'无效的游标: {after}', 400)
+                if ascending:
+                    query = query.filter(or_(Image.created_at > cursor_created,
+                                             and_(Image.created_at == cursor_created, Image.id > cursor_id)))
+                else:
+                    query = query.filter(or_(Image.created_at < cursor_created,
+                                             and_(Image.created_at == cursor_created, Image.id < cursor_id)))
+
+            rows = query.order_by(*ordering).limit(per_page + 1).all()
+            has_more = len(rows) > per_page
+            rows = rows[:per_page]
+            data = {
+                'items': [img.to_dict() for img in rows],
+                'per_page': per_page,
+                'next_cursor': _encode_cursor(rows[-1]) if has_more and rows else None,
+                'has_more': has_more
+            }
+            total = _list_total(filtered, total_mode or 'cached')
+            if total is not None:
+                data['total'] = total
+            return success_response(data)
+
         # Paginate results
         logger.info('Executing query...')
-        pagination = query.order_by(Image.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False)
+        total_mode = total_mode or 'exact'
+        if total_mode == 'exact':
+            pagination = query.order_by(*ordering).paginate(
+                page=page, per_page=per_page, error_out=False)
+            total = pagination.total
+        else:
+            pagination = query.order_by(*ordering).paginate(
+                page=page, per_page=per_page, error_out=False, count=False)
+            total = _list_total(query, total_mode)
         
-        logger.info(f'Query returned {pagination.total} results')
+        logger.info(f'Query returned {total} results')
         
         logger.info('Converting results to dict...')
         images = [img.to_dict() for img in pagination.items]
@@ -554,10 +636,10 @@ def list_images():
         
         response = success_response({
             'items': images,
-            'total': pagination.total,
+            'total': total,
             'page': page,
             'per_page': per_page,
-            'pages': pagination.pages
+            'pages': math.ceil(total / per_page) if total is not None and per_page else None
         })
         logger.info(f'Returning response: {response}')
         return response
@@ -581,17 +663,11 @@ def get_or_update_image(image_id):
         # PATCH - update image properties
         data = request.get_json() or {}
         
-        # Update 'used' status (stored in variables)
+        # Update 'used' / 'participated' status
         if 'used' in data:
-            if image.variables is None:
-                image.variables = {}
-            image.variables = {**image.variables, 'used': data['used']}
-        
-        # Update 'participated' status (stored in variables)
+            image.set_used(data['used'])
         if 'participated' in data:
-            if image.variables is None:
-                image.variables = {}
-            image.variables = {**image.variables, 'participated': data['participated']}
+            image.set_participated(data['participated'])
         
         # Update image_type if provided
         if 'image_type' in data:
@@ -610,6 +686,161 @@ def get_or_update_image(image_id):
         return error_response(f'Failed to handle image: {str(e)}', 500)
 
 
+@bp.route('/images/<int:image_id>/similar', methods=['GET'])
+def find_similar_images(image_id):
+    """按感知哈希的汉明距离查找与指定图片近似的图片"""
+    try:
+        image = Image.query.get_or_404(image_id)
+        max_distance = min(max(request.args.get('max_distance', 10, type=int), 0), HASH_BITS)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+
+        if image.phash is None:
+            compute_perceptual_hashes([image.id])
+        if image.phash is None:
+            return error_response('无法计算该图片的感知哈希', 400)
+
+        hits = phash_index.search(image.phash, max_distance, limit=limit, exclude_id=image.id)
+        rows = {img.id: img for img in Image.query.filter(Image.id.in_([i for i, _ in hits])).all()}
+        results = [
+            {**rows[i].to_dict(), 'distance': d}
+            for i, d in hits if i in rows
+        ]
+        return success_response({
+            'image_id': image.id,
+            'max_distance': max_distance,
+            'results': results
+        })
+    except Exception as e:
+        logger.error(f'查找相似图片失败: {str(e)}', exc_info=True)
+        return error_response(f'查找相似图片失败: {str(e)}', 500)
+
+def _color_filter_ids():
+    """按请求参数（image_type / source / participated / used）筛选出的图片 id，没有筛选条件时返回 None"""
+    query = db.session.query(Image.id)
+    filtered = False
+    image_type = request.args.get('image_type')
+    if image_type:
+        query = query.filter(Image.image_type == ImageType(image_type))
+        filtered = True
+    source = request.args.get('source')
+    if source:
+        query = query.filter(Image.source == ImageSource(source))
+        filtered = True
+    for param, column in (('participated', Image.participated), ('used', Image.used)):
+        value = request.args.get(param)
+        if value is not None and value != '':
+            query = query.filter(column == (value.lower() in ('1', 'true', 'yes')))
+            filtered = True
+    return [image_id for image_id, in query] if filtered else None
+
+def _color_search_response(query_hist, exclude_ids=(), extra=None):
+    metric = request.args.get('metric', 'cosine')
+    if metric not in COLOR_METRICS:
+        return error_response(f'无效的 metric: {metric}', 400)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+
+    # 筛选条件先在数据库中求出允许的 id，在索引中屏蔽其余图片后一次取出最相近的 limit 个
+    hits = color_index.search(query_hist, metric, limit, exclude_ids=exclude_ids, only_ids=_color_filter_ids())
+    rows = {img.id: img for img in Image.query.filter(Image.id.in_([i for i, _ in hits])).all()}
+    matched = [(rows[i], score) for i, score in hits if i in rows]
+    return success_response({
+        **(extra or {}),
+        'metric': metric,
+        'results': [{**img.to_dict(), 'score': round(score, 6)} for img, score in matched]
+    })
+
+@bp.route('/images/<int:image_id>/similar-colors', methods=['GET'])
+def find_similar_color_images(image_id):
+    """按颜色直方图查找配色相近的图片（metric=cosine|chi2，可按 image_type/source/participated/used 过滤）"""
+    try:
+        image = Image.query.get_or_404(image_id)
+        if image.analyzed_at is None:
+            analyze_images([image.id])
+            db.session.refresh(image)
+        query_hist = histogram_from_bytes(image.color_histogram)
+        if query_hist is None:
+            return error_response('无法计算该图片的颜色直方图', 400)
+        return _color_search_response(query_hist, exclude_ids=[image.id], extra={
+            'image_id': image.id,
+            'dominant_colors': image.dominant_colors
+        })
+    except ValueError as e:
+        return error_response(f'无效的参数: {str(e)}', 400)
+    except Exception as e:
+        logger.error(f'按颜色查找相似图片失败: {str(e)}', exc_info=True)
+        return error_response(f'按颜色查找相似图片失败: {str(e)}', 500)
+
+@bp.route('/images/color-search', methods=['GET'])
+def search_images_by_colors():
+    """按调色板检索图片：colors=ff0000,00ff00:0.3（可选权重，缺省为 1）"""
+    try:
+        palette = []
+        for item in (request.args.get('colors') or '').split(','):
+            if not item.strip():
+                continue
+            color, _, weight = item.strip().partition(':')
+            palette.append((color, float(weight) if weight else 1.0))
+        query_hist = histogram_from_colors(palette)
+        if query_hist is None:
+            return error_response('请提供至少一个颜色', 400)
+        return _color_search_response(query_hist, extra={'colors': [c for c, _ in palette]})
+    except ValueError as e:
+        return error_response(f'无效的参数: {str(e)}', 400)
+    except Exception as e:
+        logger.error(f'按颜色检索图片失败: {str(e)}', exc_info=True)
+        return error_response(f'按颜色检索图片失败: {str(e)}', 500)
+
+@bp.route('/images/near-duplicates', methods=['GET'])
+def list_near_duplicate_groups():
+    """近似重复图片分组报告，可按 image_type / source 限定范围"""
+    try:
+        max_distance = min(max(request.args.get('max_distance', 6, type=int), 0), MAX_GROUP_DISTANCE)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        image_type = request.args.get('image_type')
+        source = request.args.get('source')
+
+        candidate_ids = None
+        if image_type or source:
+            query = db.session.query(Image.id).filter(Image.phash.isnot(None))
+            if image_type:
+                query = query.filter(Image.image_type == ImageType(image_type))
+            if source:
+                query = query.filter(Image.source == ImageSource(source))
+            candidate_ids = [i for (i,) in query]
+
+        groups = phash_index.groups(max_distance, candidate_ids)
+        page = groups[:limit]
+        ids = [i for g in page for i in g]
+        rows = {img.id: img for img in Image.query.filter(Image.id.in_(ids)).all()} if ids else {}
+
+        result_groups = []
+        for group in page:
+            members = [rows[i].to_dict() for i in group if i in rows]
+            if len(members) > 1:
+                result_groups.append({'size': len(members), 'images': members})
+        return success_response({
+            'max_distance': max_distance,
+            'total_groups': len(groups),
+            'groups': result_groups
+        })
+    except ValueError as e:
+        return error_response(f'无效的参数: {str(e)}', 400)
+    except Exception as e:
+        logger.error(f'获取近似重复图片失败: {str(e)}', exc_info=True)
+        return error_response(f'获取近似重复图片失败: {str(e)}', 500)
+
+
+def _send_image_record_file(image: Image, path: str, immutable: bool):
+    # 只有 blob 存储中的文件才保证与 content_hash 对应；?v=<content_hash 前缀> 的 URL 可长期缓存
+    in_blob_store = any(
+        os.path.abspath(path).startswith(os.path.abspath(store.root) + os.sep)
+        for store in (upload_blob_store, output_blob_store)
+    )
+    logger.info(f'Serving image file: {path} (ID: {image.id})')
+    return send_image_file(path, content_hash=image.content_hash if in_blob_store else None,
+                           immutable=immutable, negotiate=True)
+
+
 @bp.route('/images/<int:image_id>/file', methods=['GET'])
 @cross_origin()
 def serve_image_file(image_id):
@@ -620,68 +851,147 @@ def serve_image_file(image_id):
         if not image:
             return error_response(f'Image not found: {image_id}', 404)
         
-        # Try multiple path sources in order of preference
-        possible_paths = []
-        
-        # 1. Try local_path first (usually the most accurate for local_dir source)
-        if image.local_path:
-            possible_paths.append(image.local_path)
-        
-        # 2. Try file_path
-        if image.file_path:
-            file_path = image.file_path
-            
-            # If it's an absolute path, use it directly
-            if os.path.isabs(file_path):
-                possible_paths.append(file_path)
-            else:
-                # Relative path - try common directories
-                from conf import UPLOAD_FOLDER, OUTPUT_FOLDER, BASE_PATH
-                
-                # Try as-is first
-                possible_paths.append(file_path)
-                
-                # Try with base path
-                possible_paths.append(os.path.join(str(BASE_PATH), file_path))
-                
-                # Try upload folder
-                filename = os.path.basename(file_path)
-                possible_paths.append(os.path.join(UPLOAD_FOLDER, filename))
-                
-                # Try output folder
-                possible_paths.append(os.path.join(OUTPUT_FOLDER, filename))
-        
-        # Find the first path that exists
-        actual_path = None
-        for path in possible_paths:
-            if path and os.path.isfile(path):
-                actual_path = path
-                break
-        
+        # 缓存命中时不再探测候选路径，直接发送文件；冷存储中的图片先解压回热盘
+        actual_path = image_path_resolver.resolve(image, verify=False)
         if not actual_path:
-            logger.error(f'File not found for image ID {image_id}. Tried paths: {possible_paths}')
+            logger.error(f'File not found for image ID {image_id}. Tried paths: {candidate_paths(image.local_path, image.file_path)}')
             return error_response(f'Image file not found', 404)
-        
-        # Determine mimetype
-        mimetype = 'image/jpeg'
-        ext = os.path.splitext(actual_path)[1].lower()
-        if ext == '.png':
-            mimetype = 'image/png'
-        elif ext == '.gif':
-            mimetype = 'image/gif'
-        elif ext == '.webp':
-            mimetype = 'image/webp'
-        elif ext == '.bmp':
-            mimetype = 'image/bmp'
-        
-        logger.info(f'Serving image file: {actual_path} (ID: {image_id})')
-        return send_file(actual_path, mimetype=mimetype)
+
+        touch_image_access(image)
+        version = request.args.get('v')
+        immutable = bool(image.content_hash and version and len(version) >= 12
+                         and image.content_hash.startswith(version))
+        try:
+            return _send_image_record_file(image, actual_path, immutable)
+        except FileNotFoundError:
+            # 文件已被移动或删除：丢弃缓存后重新解析
+            image_path_resolver.invalidate(image.id)
+            actual_path = image_path_resolver.resolve(image)
+            if not actual_path:
+                return error_response(f'Image file not found', 404)
+            return _send_image_record_file(image, actual_path, immutable)
         
     except Exception as e:
         logger.exception(f'Error serving image file for ID {image_id}')
         return error_response(f'Failed to serve image file: {str(e)}', 500)
 
 
+def _archived_thumbnail(image_id: int, width: int, mtime_key: Optional[int], pack: str, offset: int,
+                        suffix: str) -> str:
+    """冷存储中的图片：缩略图未缓存时解压到临时文件生成，不提升回热盘"""
+    thumb_path = thumbnail_service.cached(image_id, width, mtime_key) if mtime_key is not None else None
+    if thumb_path:
+        return thumb_path
+    with image_archive.extracted(pack, offset, suffix) as tmp_path:
+        return thumbnail_service.get_or_create(image_id, tmp_path, width, mtime_key)
+
+
+@bp.route('/images/<int:image_id>/thumb', methods=['GET'])
+@cross_origin()
+def serve_image_thumbnail(image_id):
+    """Serve a cached, downscaled derivative of the image (?w=<width>)"""
+    try:
+        image = Image.query.get(image_id)
+        if not image:
+            return error_response(f'Image not found: {image_id}', 404)
+
+        width = snap_width(request.args.get('w', type=int))
+        mtime_key = int(image.file_mtime.timestamp()) if image.file_mtime else None
+        if image.archive_pack:
+            thumb_path = _archived_thumbnail(image.id, width, mtime_key, image.archive_pack, image.archive_offset,
+                                             os.path.splitext(image.filename)[1])
+            return send_image_file(thumb_path, mimetype=thumbnail_service.mimetype, max_age=86400)
+
+        source_path = image_path_resolver.resolve(image)
+        if not source_path:
+            return error_response('Image file not found', 404)
+
+        try:
+            thumb_path = thumbnail_service.get_or_create(image.id, source_path, width, mtime_key)
+        except Exception as e:
+            # 无法生成缩略图（如不支持的格式）时退回原图
+            logger.warning(f'Failed to build thumbnail for image {image_id}, serving original: {str(e)}')
+            return send_image_file(source_path)
+
+        return send_image_file(thumb_path, mimetype=thumbnail_service.mimetype, max_age=86400)
+    except Exception as e:
+        logger.exception(f'Error serving thumbnail for ID {image_id}')
+        return error_response(f'Failed to serve thumbnail: {str(e)}', 500)
+
+
+@bp.route('/images/sprite', methods=['GET'])
+@cross_origin()
+def get_image_sprite():
+    """把一页图片的缩略图拼成一张图（?ids=1,2,3&tile=128），返回拼图地址与 {id: {x, y, w, h}} 偏移表"""
+    try:
+        ids = list(dict.fromkeys(int(i) for i in (request.args.get('ids') or '').split(',') if i.strip()))
+        if not ids:
+            return error_response('请提供图片 id 列表', 400)
+        if len(ids) > SPRITE_MAX_IMAGES:
+            return error_response(f'一次最多 {SPRITE_MAX_IMAGES} 张图片', 400)
+        tile = request.args.get('tile', 128, type=int)
+        if tile < 16 or tile > max(THUMBNAIL_WIDTHS):
+            return error_response(f'tile 须在 16 到 {max(THUMBNAIL_WIDTHS)} 之间', 400)
+
+        rows = {img.id: img for img in Image.query.filter(Image.id.in_(ids)).all()}
+        width = snap_width(tile)
+        entries = []
+        sources = {}
+        for image_id in ids:
+            image = rows.get(image_id)
+            if image is None:
+                continue
+            mtime_key = int(image.file_mtime.timestamp()) if image.file_mtime else None
+            entries.append((image_id, image.content_hash or str(mtime_key or 0)))
+            # 先在请求线程中取出所需的值，拼图时在线程池中生成缩略图；原图路径只在缩略图未缓存时才解析
+            if image.archive_pack:
+                sources[image_id] = (mtime_key, None, (image.archive_pack, image.archive_offset,
+                                                       os.path.splitext(image.filename)[1]))
+            else:
+                sources[image_id] = (mtime_key, image, None)
+
+        app = current_app._get_current_object()
+
+        def load_tile(image_id):
+            mtime_key, image, archived = sources[image_id]
+            if archived:
+                return _archived_thumbnail(image_id, width, mtime_key, *archived)
+            cached = thumbnail_service.cached(image_id, width, mtime_key) if mtime_key is not None else None
+            if cached:
+                return cached
+            with app.app_context():
+                source_path = image_path_resolver.resolve(image)
+            if not source_path:
+                return None
+            return thumbnail_service.get_or_create(image_id, source_path, width, mtime_key)
+
+        key, layout = sprite_service.get_or_build(entries, tile, load_tile)
+        missing = layout['missing'] + [i for i in ids if i not in rows]
+        return success_response({
+            **layout,
+            'missing': missing,
+            'sheet_url': f'/api/images/sprite/{key}.{sprite_service.fmt}'
+        })
+    except ValueError as e:
+        return error_response(f'无效的参数: {str(e)}', 400)
+    except Exception as e:
+        logger.error(f'生成拼图失败: {str(e)}', exc_info=True)
+        return error_response(f'生成拼图失败: {str(e)}', 500)
+
+
+@bp.route('/images/sprite/<string:filename>', methods=['GET'])
+@cross_origin()
+def serve_image_sprite(filename):
+    """发送已生成的拼图；键包含图片版本（缺格子的拼图另含失败的 id），内容不会变化，可长期缓存"""
+    key, _, ext = filename.partition('.')
+    if ext != sprite_service.fmt or len(key) != 64 or any(c not in '0123456789abcdef' for c in key):
+        return error_response('Sprite not found', 404)
+    path = sprite_service.sheet_path(key)
+    if not sprite_service.cache.get(path):
+        return error_response('Sprite not found', 404)
+    return send_image_file(path, mimetype=sprite_service.mimetype, immutable=True)
+
+
 @bp.route('/images/uploads/<path:filename>')
 @cross_origin()
 def serve_uploaded_file(filename):
@@ -700,10 +1010,14 @@ def serve_uploaded_file(filename):
         logger.info(f'Serving file: {file_path}')
         
         if not os.path.exists(file_path):
-            logger.error(f'File not found: {file_path}')
-            return error_response(f'File not found: {filename}', 404)
+            # 平铺目录中的旧文件可能已迁移到日期分片目录
+            migrated_path = migrated_file_path(filename)
+            if not migrated_path:
+                logger.error(f'File not found: {file_path}')
+                return error_response(f'File not found: {filename}', 404)
+            uploads_dir, filename = os.path.split(migrated_path)
             
-        response = send_from_directory(uploads_dir, filename)
+        response = send_image_from_directory(uploads_dir, filename)
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
     except Exception as e:
@@ -728,10 +1042,14 @@ def serve_output_file(filename):
         logger.info(f'Serving output file: {file_path}')
         
         if not os.path.exists(file_path):
-            logger.error(f'Output file not found: {file_path}')
-            return error_response(f'Output file not found: {filename}', 404)
+            # 平铺目录中的旧文件可能已迁移到日期分片目录
+            migrated_path = migrated_file_path(filename)
+            if not migrated_path:
+                logger.error(f'Output file not found: {file_path}')
+                return error_response(f'Output file not found: {filename}', 404)
+            output_dir, filename = os.path.split(migrated_path)
             
-        response = send_from_directory(output_dir, filename)
+        response = send_image_from_directory(output_dir, filename)
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
     except Exception as e:
@@ -770,7 +1088,10 @@ def delete_image(image_id):
             if filename:
                 filepath = os.path.join(UPLOAD_FOLDER, filename)
                 logger.info(f"Attempting to delete file: {filepath}")
-                if os.path.exists(filepath):
+                if image.content_hash and content_hash_in_use(image.content_hash, image.id):
+                    # 同一内容仍被其他记录引用，保留 blob
+                    logger.info(f"Content {image.content_hash} still referenced, keeping {filepath}")
+                elif os.path.exists(filepath):
                     try:
                         os.remove(filepath)
                         logger.info(f"Successfully deleted file: {filepath}")
@@ -791,6 +1112,9 @@ def delete_image(image_id):
         # 删除数据库记录
         db.session.delete(image)
         db.session.commit()
+        thumbnail_service.invalidate(image_id)
+        image_path_resolver.invalidate(image_id)
+        color_index.discard([image_id])
         
         response = success_response({'message': '图片删除成功'})
         response.headers.add('Access-Control-Allow-Origin', '*')
@@ -818,58 +1142,16 @@ def clear_all_images():
 
     try:
         logger.info('Received request to clear all images')
-        images = Image.query.all()
-        deleted_count = 0
-
-        for image in images:
-            try:
-                p = str(image.file_path).replace('\\', '/') if image.file_path else ''
-                source_val = image.source.value if hasattr(image.source, 'value') else image.source
-                
-                # Record local_dir paths to prevent re-scanning
-                if source_val == ImageSource.local_dir.value and image.local_path:
-                    existing_deleted = DeletedImagePath.query.filter_by(local_path=image.local_path).first()
-                    if not existing_deleted:
-                        deleted_record = DeletedImagePath(local_path=image.local_path)
-                        db.session.add(deleted_record)
-                
-                if p:
-                    if p.startswith('/uploads/') or '/upload/images/' in p or p.startswith('upload/images/'):
-                        filename = None
-                        if p.startswith('/uploads/'):
-                            filename = p.split('/uploads/')[1]
-                        elif 'upload/images/' in p or p.startswith('upload/images/'):
-                            filename = p.split('upload/images/')[1]
-                        if filename:
-                            target = os.path.join(UPLOAD_FOLDER, filename)
-                            if os.path.exists(target):
-                                os.remove(target)
-                    elif 'output/images/' in p or p.startswith('/output/') or p.startswith('output/'):
-                        filename = None
-                        if 'output/images/' in p:
-                            filename = p.split('output/images/')[1]
-                        elif p.startswith('/output/'):
-                            filename = p.split('/output/')[1]
-                        elif p.startswith('output/'):
-                            filename = p.split('output/')[1]
-                        if filename:
-                            target = os.path.join(OUTPUT_FOLDER, filename)
-                            if os.path.exists(target):
-                                os.remove(target)
-            except Exception as fe:
-                logger.error(f'Failed to delete file for image {image.id}: {str(fe)}')
-
-            db.session.delete(image)
-            deleted_count += 1
-
-        db.session.commit()
-        response = success_response({'message': '已删除所有图片', 'count': deleted_count})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
+        job = start_clear_all_images()
+        if job is None:
+            resp = make_response(error_response('清空图片失败: 后台任务无法启动', 500))
+        else:
+            resp = make_response(success_response({'message': '正在删除所有图片', **job.to_dict()}))
+        resp.headers.add('Access-Control-Allow-Origin', '*')
+        resp.headers.add('Access-Control-Allow-Credentials', 'true')
+        return resp
     except Exception as e:
         logger.error(f'清空图片失败: {str(e)}', exc_info=True)
-        db.session.rollback()
         resp = make_response(error_response(f'清空图片失败: {str(e)}', 500))
         resp.headers.add('Access-Control-Allow-Origin', '*')
         resp.headers.add('Access-Control-Allow-Credentials', 'true')
@@ -880,6 +1162,8 @@ def clear_local_images():
     """清除所有本地目录图片记录（不删除实际文件）"""
     try:
         count = Image.query.filter_by(source=ImageSource.local_dir).delete()
+        # 目录清单一并清除，之后重新扫描时按新目录完整入库
+        ImageDirectoryManifest.query.delete()
         db.session.commit()
         return success_response({
             'message': f'已清除 {count} 条本地目录图片记录',
@@ -905,42 +1189,23 @@ def reclassify_images():
         except Exception:
             image_type_enum = ImageType.general
 
-        # 1) 纠正本地记录（local_dir）在该目录下的类型
-        count_local = 0
-        local_records = Image.query.filter(
-            Image.local_path.like(f"{directory}%")
-        ).all()
-        for rec in local_records:
-            if rec.image_type != image_type_enum:
-                rec.image_type = image_type_enum
-                count_local += 1
+        # 1) 纠正本地记录（local_dir）在该目录下的类型，单条 UPDATE 完成
+        count_local = Image.query.filter(
+            Image.local_path.like(f"{directory}%"),
+            Image.image_type != image_type_enum
+        ).update({Image.image_type: image_type_enum}, synchronize_session=False)
 
         # 2) 收集目录下文件名，纠正上传记录（upload）同名文件的类型
-        filenames = set(p.name for p in Path(directory).rglob('*') if p.is_file())
+        filenames = set(entry.name for entry in iter_image_files(directory, ALLOWED_EXTENSIONS))
         count_upload = 0
         if filenames:
-            upload_records = Image.query.filter(
-                Image.source == ImageSource.upload,
-                Image.filename.in_(list(filenames))
-            ).all()
-            # unify duplicates by filename, prefer non-general type
-            by_name: Dict[str, List[Image]] = {}
-            for rec in upload_records:
-                by_name.setdefault(rec.filename, []).append(rec)
-            for name, group in by_name.items():
-                target = None
-                for rec in group:
-                    if rec.image_type == image_type_enum:
-                        target = rec
-                        break
-                if target is None:
-                    target = max(group, key=lambda r: r.id)
-                for rec in group:
-                    if rec.id != target.id:
-                        db.session.delete(rec)
-                if target.image_type != image_type_enum.value:
-                    target.image_type = image_type_enum.value
-                count_upload += len(group)
+            # unify duplicates by filename, prefer records already of the target type
+            ingestor = ImageIngestor(IngestIndex.load_uploads(filenames))
+            delete_ids, targets, count_upload = group_upload_duplicates(
+                ingestor.index, filenames, image_type_enum)
+            ingestor.delete_rows(delete_ids)
+            ingestor.retype_rows([t for t in targets if t.image_type != image_type_enum], image_type_enum)
+            ingestor.flush()
 
         db.session.commit()
         return success_response({
@@ -956,79 +1221,72 @@ def reclassify_images():
 
 @bp.route('/images/cleanup-orphans', methods=['POST'])
 def cleanup_orphan_images():
-    """清理数据库中指向不存在文件的脏图片记录"""
+    """清理数据库中指向不存在文件的脏图片记录（后台任务，结果通过 /images/jobs/<job_id> 获取）"""
     try:
         data = request.get_json() or {}
         dry_run = data.get('dry_run', False)  # If true, only report without deleting
         image_type = data.get('image_type')   # Optional: filter by image type
-        
-        query = Image.query
-        
-        # Filter by image type if provided
+
+        image_type_enum = None
         if image_type:
             try:
                 image_type_enum = ImageType(image_type)
-                query = query.filter(Image.image_type == image_type_enum)
             except ValueError:
                 pass
-        
-        all_images = query.all()
-        orphan_ids = []
-        orphan_details = []
-        
-        for img in all_images:
-            file_exists = False
-            checked_path = None
-            
-            # Check local_path first (for local_dir source)
-            if img.local_path:
-                checked_path = img.local_path
-                file_exists = os.path.isfile(img.local_path)
-            
-            # If not found and has file_path, check file_path
-            if not file_exists and img.file_path:
-                # Try different possible locations
-                possible_paths = [
-                    img.file_path,
-                    os.path.join(UPLOAD_FOLDER, img.file_path),
-                    os.path.join(OUTPUT_FOLDER, img.file_path),
-                    os.path.join(BASE_PATH, img.file_path) if BASE_PATH else None,
-                ]
-                for path in possible_paths:
-                    if path and os.path.isfile(path):
-                        file_exists = True
-                        checked_path = path
-                        break
-                if not file_exists:
-                    checked_path = img.file_path
-            
-            if not file_exists:
-                orphan_ids.append(img.id)
-                orphan_details.append({
-                    'id': img.id,
-                    'filename': img.filename,
-                    'file_path': img.file_path,
-                    'local_path': img.local_path,
-                    'image_type': img.image_type.value if hasattr(img.image_type, 'value') else img.image_type,
-                    'source': img.source.value if hasattr(img.source, 'value') else img.source,
-                    'checked_path': checked_path
-                })
-        
-        deleted_count = 0
-        if not dry_run and orphan_ids:
-            # Delete orphan records
-            deleted_count = Image.query.filter(Image.id.in_(orphan_ids)).delete(synchronize_session=False)
-            db.session.commit()
-            logger.info(f'Cleaned up {deleted_count} orphan image records')
-        
-        return success_response({
-            'message': f'找到 {len(orphan_ids)} 条脏数据' + (f'，已删除 {deleted_count} 条' if not dry_run else ' (dry run模式，未删除)'),
-            'orphan_count': len(orphan_ids),
-            'deleted_count': deleted_count,
-            'dry_run': dry_run,
-            'orphans': orphan_details[:100]  # Limit to first 100 for response size
-        })
+
+        job = start_orphan_cleanup(dry_run, image_type_enum)
+        if job is None:
+            return error_response('清理脏数据失败: 后台任务无法启动', 500)
+        return success_response({'message': '正在扫描脏数据', 'dry_run': dry_run, **job.to_dict()})
     except Exception as e:
         logger.error(f'清理脏数据失败: {str(e)}', exc_info=True)
         db.session.rollback()
-        return error_response(f'清理脏数据失败: {str(e)}')
\ No newline at end of file
+        return error_response(f'清理脏数据失败: {str(e)}')
+
+@bp.route('/images/storage/shard', methods=['POST'])
+def shard_storage():
+    """把上传/输出目录根下平铺的历史文件迁移到 YYYY/MM/DD 分片目录（后台任务，可重复执行）"""
+    try:
+        data = request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dry_run', False))
+        roots = data.get('folders') or list(STORAGE_ROOTS)
+        unknown = [r for r in roots if r not in STORAGE_ROOTS]
+        if unknown:
+            return error_response(f'无效的目录: {", ".join(unknown)}', 400)
+
+        job = start_storage_shard_migration(roots, dry_run)
+        if job is None:
+            return error_response('迁移存储目录失败: 后台任务无法启动', 500)
+        return success_response({'message': '正在迁移存储目录', 'dry_run': dry_run, **job.to_dict()})
+    except Exception as e:
+        logger.error(f'迁移存储目录失败: {str(e)}', exc_info=True)
+        return error_response(f'迁移存储目录失败: {str(e)}')
+
+@bp.route('/images/archive', methods=['POST'])
+def archive_cold_images():
+    """把长期未访问的生成图片移入冷存储（后台任务）；归档的图片在请求原图时自动解压回热盘"""
+    try:
+        data = request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dry_run', False))
+        older_than_days = int(data.get('older_than_days', ARCHIVE_AFTER_DAYS))
+        if older_than_days < 1:
+            return error_response('older_than_days 必须大于 0', 400)
+
+        job = start_cold_image_archive(older_than_days, dry_run)
+        if job is None:
+            return error_response('归档图片失败: 后台任务无法启动', 500)
+        return success_response({'message': '正在归档图片', 'dry_run': dry_run,
+                                 'older_than_days': older_than_days, **job.to_dict()})
+    except (TypeError, ValueError) as e:
+        return error_response(f'无效的参数: {str(e)}', 400)
+    except Exception as e:
+        logger.error(f'归档图片失败: {str(e)}', exc_info=True)
+        return error_response(f'归档图片失败: {str(e)}')
+
+@bp.route('/images/jobs/<job_id>', methods=['GET'])
+def get_image_job(job_id):
+    """查询清空、清理脏数据、存储迁移、归档等后台任务的进度与结果"""
+    job = job_registry.get(job_id)
+    if job is None:
+        return error_response('任务不存在', 404)
+    return success_response(job.to_dict())
@@ -2,6 +2,7 @@
 from flask import Blueprint, request, jsonify
 from app.extensions import db
 from app.models.image import ImageDefaultLocation
+from app.image_watcher import image_watcher
 
 bp = Blueprint('image_locations', __name__, url_prefix='/api/image-locations')
 
@@ -73,6 +74,7 @@ def create_or_update_location():
             db.session.add(location)
         
         db.session.commit()
+        image_watcher.refresh_locations()
         
         return jsonify({
             'success': True,
@@ -101,6 +103,7 @@ def delete_location(location_id):
         
         db.session.delete(location)
         db.session.commit()
+        image_watcher.refresh_locations()
         
         return jsonify({
             'success': True,
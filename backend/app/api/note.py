@@ -9,6 +9,7 @@ from app.utils.logger import logger
 from app.models.user import User
 from app.models.note import Note
 from app.models.image import Image
+from app.utils.image_paths import image_path_resolver
 from app.extensions import db
 
 bp = Blueprint('note', __name__, url_prefix='/api')
@@ -93,11 +94,7 @@ def upload_note():
                 image_id = int(id_match.group(1))
                 image = Image.query.get(image_id)
                 if image:
-                    # Try local_path first, then file_path
-                    for path in [image.local_path, image.file_path]:
-                        if path and os.path.isfile(path):
-                            file_path = path
-                            break
+                    file_path = image_path_resolver.resolve(image)
                     if not file_path:
                         logger.error(f"Image file not found for ID {image_id}")
                         return error_response(f'Image file not found for ID: {image_id}')
@@ -116,11 +113,9 @@ def upload_note():
                 # For local_dir images, look up by filename in the database
                 filename = url.replace('/images/local_dir/', '', 1)
                 image = Image.query.filter(Image.filename == filename).first()
-                if image and image.local_path and os.path.isfile(image.local_path):
-                    file_path = image.local_path
-                elif image and image.file_path and os.path.isfile(image.file_path):
-                    file_path = image.file_path
-                else:
+                if image:
+                    file_path = image_path_resolver.resolve(image)
+                if not file_path:
                     # Try common locations
                     for base in [UPLOAD_FOLDER, OUTPUT_FOLDER, str(BASE_PATH)]:
                         test_path = os.path.join(base, filename)
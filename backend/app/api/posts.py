@@ -43,8 +43,7 @@ def create_post():
         
         # Mark images as participated
         for image in images:
-            if not image.participated:
-                image.participated = True
+            image.set_participated(True)
         
         db.session.commit()
         
@@ -257,7 +257,7 @@ def generate_participation_prompt():
             return error_response(error_msg, 400)
 
         from app.models.image import Image, ImageType
-        from conf import UPLOAD_FOLDER, OUTPUT_FOLDER
+        from app.utils.image_paths import image_path_resolver
         import base64
         import requests
         
@@ -294,30 +294,19 @@ def generate_participation_prompt():
         image_base64_list = []
         image_formats = []  # Track formats for each image
         
+        resolved_paths = {}
         for img in selected:
-            file_path = img.file_path
-            full_path = None
-
-            if file_path.startswith('/uploads/'):
-                filename = file_path.replace('/uploads/', '')
-                full_path = os.path.join(UPLOAD_FOLDER, filename)
-            elif file_path.startswith('/output/'):
-                filename = file_path.replace('/output/', '')
-                full_path = os.path.join(OUTPUT_FOLDER, filename)
-            elif os.path.isabs(file_path):
-                full_path = file_path
-            else:
-                full_path = os.path.join(UPLOAD_FOLDER, file_path)
+            full_path = image_path_resolver.resolve(img)
+            resolved_paths[img.id] = full_path
 
             logger.info(f" Processing: {img.filename}")
             logger.info(f"   DB path: {img.file_path}")
             logger.info(f"   Full path: {full_path}")
-            logger.info(f"   Exists: {os.path.exists(full_path)}")
-            
-            if os.path.exists(full_path):
+
+            if full_path:
                 encoded = encode_image_to_base64(full_path)
                 if encoded:
-                    # Detect image format from filename
+                    # Prefer the format stored at ingest time, fall back to the file extension
                     ext = os.path.splitext(full_path)[1].lower()
                     format_map = {
                         '.jpg': 'jpeg',
@@ -327,13 +316,13 @@ def generate_participation_prompt():
                         '.gif': 'gif',
                         '.bmp': 'bmp'
                     }
-                    img_format = format_map.get(ext, 'jpeg')  # Default to jpeg if unknown
+                    img_format = img.format or format_map.get(ext, 'jpeg')  # Default to jpeg if unknown
                     
                     image_base64_list.append(encoded)
                     image_formats.append(img_format)
                     logger.info(f" Encoded: {img.filename} ({len(encoded)} bytes, format: {img_format})")
             else:
-                logger.error(f" Not found: {full_path}")
+                logger.error(f" Not found: {img.filename} (db path: {img.file_path})")
         
         logger.info(f" Total encoded: {len(image_base64_list)}/{len(selected)}")
 
@@ -368,15 +357,10 @@ def generate_participation_prompt():
                 "id": getattr(img, "id", None),
                 "filename": img.filename,
                 "db_path": img.file_path,
-                "resolved_path": (
-                    os.path.join(UPLOAD_FOLDER, img.file_path.replace('/uploads/', ''))
-                    if img.file_path.startswith('/uploads/')
-                    else (
-                        os.path.join(OUTPUT_FOLDER, img.file_path.replace('/output/', ''))
-                        if img.file_path.startswith('/output/')
-                        else img.file_path
-                    )
-                ),
+                "resolved_path": resolved_paths.get(img.id),
+                "width": img.width,
+                "height": img.height,
+                "dominant_colors": img.dominant_colors,
                 "base64_length": len(image_base64_list[idx]) if idx < len(image_base64_list) else 0,
             }
             for idx, img in enumerate(selected)
@@ -1,8 +1,10 @@
-from flask import Blueprint, send_from_directory
+from flask import Blueprint
 import os
 from app.utils.response import error_response
 from conf import UPLOAD_FOLDER, OUTPUT_FOLDER
 from app.utils.logger import logger
+from app.utils.file_response import send_image_from_directory
+from app.utils.storage_layout import migrated_file_path
 
 bp = Blueprint('static', __name__, url_prefix='/api')
 
@@ -21,7 +23,7 @@ def serve_image(filename):
             # Try the direct path first
             if os.path.exists(upload_image_path):
                 logger.info(f"Serving direct upload image from: {upload_image_path}")
-                return send_from_directory(UPLOAD_FOLDER, actual_filename)
+                return send_image_from_directory(UPLOAD_FOLDER, actual_filename)
             
             # If not found, try with Online_AI_ prefix
             prefixed_filename = f"Online_AI_{actual_filename}"
@@ -30,7 +32,7 @@ def serve_image(filename):
             
             if os.path.exists(prefixed_image_path):
                 logger.info(f"Serving prefixed upload image from: {prefixed_image_path}")
-                return send_from_directory(UPLOAD_FOLDER, prefixed_filename)
+                return send_image_from_directory(UPLOAD_FOLDER, prefixed_filename)
     
         elif filename.startswith('output/'):
             # Frontend is asking for /images/output/filename, but the actual path is OUTPUT_FOLDER/filename
@@ -40,21 +42,26 @@ def serve_image(filename):
             
             if os.path.exists(output_image_path):
                 logger.info(f"Serving output image from: {output_image_path}")
-                return send_from_directory(os.path.dirname(output_image_path), os.path.basename(output_image_path))
+                return send_image_from_directory(OUTPUT_FOLDER, actual_filename)
         
         # Fallback: try to serve directly from the requested path
         for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER]:
             full_path = os.path.join(folder, filename)
             if os.path.exists(full_path):
                 logger.info(f"Serving image from direct path: {full_path}")
-                return send_from_directory(folder, filename)
+                return send_image_from_directory(folder, filename)
             
             # Try with Online_AI_ prefix as a last resort
             prefixed_path = os.path.join(folder, f"Online_AI_{filename}")
             if os.path.exists(prefixed_path):
                 logger.info(f"Serving image with Online_AI_ prefix: {prefixed_path}")
-                return send_from_directory(folder, f"Online_AI_{filename}")
+                return send_image_from_directory(folder, f"Online_AI_{filename}")
         
+        migrated_path = migrated_file_path(filename)
+        if migrated_path:
+            logger.info(f"Serving migrated image from: {migrated_path}")
+            return send_image_from_directory(os.path.dirname(migrated_path), os.path.basename(migrated_path))
+
         logger.warning(f"Image not found at any path: {filename}")
         return error_response('Image not found', 404)
     except Exception as e:
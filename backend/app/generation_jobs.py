@@ -0,0 +1,406 @@
+"""异步图片生成任务
+
+POST /images/generate 只校验参数、写入一条 GenerationJob（queued）后立即返回 job id，
+由有界的工作线程池（GENERATION_WORKERS 个线程，最多 GENERATION_QUEUE_MAX 个待执行任务）调用 ComfyUI 执行，
+Web 工作线程不再被整个采样过程占用。
+
+执行中收到的 ComfyUI 事件更新任务进度（正在执行的节点、已完成节点数、采样步数 step/max_steps），
+立即推送给 SSE 订阅者，并按 GENERATION_PROGRESS_FLUSH_SECONDS 节流写入数据库。
+
+多个进程可以共用同一数据库：任务执行前以 UPDATE ... WHERE status='queued' 领取，同一任务只会执行一次；
+执行中的任务每 GENERATION_HEARTBEAT_SECONDS 秒刷新心跳，心跳过期的 running 任务（所在进程已退出）
+标记为失败。服务启动时仍在排队的任务重新排队。
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from flask import current_app
+from sqlalchemy import or_, update
+
+from app.extensions import db
+from app.image_jobs import schedule_thumbnail_prewarm
+from app.models.generation_job import GenerationJob, GenerationJobStatus
+from app.models.image import Image, ImageSource
+from app.models.workflow import Workflow
+from app.utils.blob_store import output_blob_store
+from app.utils.image_metadata import apply_file_metadata
+from app.utils.logger import logger
+from comfyui_api.utils.actions.load_workflow import load_workflow
+from comfyui_api.utils.actions.prompt_to_image import prompt_to_image
+from conf import (BASE_PATH, OUTPUT_FOLDER, GENERATION_WORKERS, GENERATION_QUEUE_MAX,
+                  GENERATION_PROGRESS_FLUSH_SECONDS, GENERATION_HEARTBEAT_SECONDS)
+
+# 进程内保留最近多少个已结束任务的实时状态，更早的从数据库读取
+MAX_FINISHED_LIVE_JOBS = 100
+# SSE 连接空闲时发送注释行的间隔（秒），防止代理断开连接
+SSE_HEARTBEAT_SECONDS = 15
+# 心跳超过多少个间隔未刷新的 running 任务视为已中断
+_STALE_HEARTBEATS = 4
+
+
+class GenerationQueueFull(Exception):
+    pass
+
+
+def workflow_file_path(workflow: Workflow) -> str:
+    return os.path.join(BASE_PATH, workflow.file_path.replace('\\', '/'))
+
+
+def save_generated_images(files: List[str], workflow: Optional[Workflow], variables: dict,
+                          content_hashes: Optional[Dict[str, str]] = None) -> List[Image]:
+    """为生成的文件（相对 OUTPUT_FOLDER）创建图片记录，输出文件纳入内容寻址存储
+
+    content_hashes 为下载时已算好的 {文件: SHA-256}，有则不再重新读取文件计算哈希。
+    """
+    images = []
+    for name in files:
+        output_path = os.path.join(OUTPUT_FOLDER, name)
+        content_hash, _ = output_blob_store.adopt(output_path, (content_hashes or {}).get(name))
+        image = Image(
+            filename=os.path.basename(name),
+            workflow_id=workflow.id if workflow else None,
+            workflow_name=workflow.name if workflow else None,
+            file_path=output_path,
+            resolved_path=output_path,
+            variables=variables,
+            source=ImageSource.generated,
+            content_hash=content_hash
+        )
+        apply_file_metadata(image, output_path)
+        db.session.add(image)
+        images.append(image)
+    db.session.commit()
+    schedule_thumbnail_prewarm([image.id for image in images])
+    return images
+
+
+class _LiveJob:
+    """任务的实时状态（GenerationJob.to_dict() 的副本），每次变化递增 version 并唤醒 SSE 订阅者"""
+
+    def __init__(self, state: dict):
+        self.state = state
+        self.version = 0
+        self.condition = threading.Condition()
+        self.seen_nodes = set()
+        self.flushed_at = 0.0
+
+    def update(self, **changes):
+        with self.condition:
+            self.state = {**self.state, **changes}
+            self.version += 1
+            self.condition.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.state['status'] in (GenerationJobStatus.done.value, GenerationJobStatus.failed.value)
+
+
+class GenerationQueue:
+    def __init__(self, workers: int = GENERATION_WORKERS, max_pending: int = GENERATION_QUEUE_MAX):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.app = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._heartbeat: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = set()
+        self._live: 'OrderedDict[str, _LiveJob]' = OrderedDict()
+
+    def init_app(self, app):
+        """记录 app，把心跳已过期的 running 任务标记为失败，并让仍在排队的任务重新排队"""
+        self.app = app
+        with app.app_context():
+            interrupted = self._fail_stale_jobs()
+            queued = (GenerationJob.query.filter_by(status=GenerationJobStatus.queued)
+                      .order_by(GenerationJob.created_at).all())
+            db.session.commit()
+            for job in queued:
+                self._enqueue(job)
+        self._start_heartbeat()
+        if interrupted or queued:
+            logger.info(f'Generation queue recovered: {len(queued)} requeued, {interrupted} marked failed')
+
+    def _fail_stale_jobs(self) -> int:
+        """把心跳过期的 running 任务标记为失败（需在 app context 中调用），返回标记的任务数"""
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=GENERATION_HEARTBEAT_SECONDS * _STALE_HEARTBEATS)
+        result = db.session.execute(
+            update(GenerationJob)
+            .where(GenerationJob.status == GenerationJobStatus.running,
+                   or_(GenerationJob.heartbeat_at.is_(None), GenerationJob.heartbeat_at < cutoff))
+            .values(status=GenerationJobStatus.failed, error='Interrupted: the worker process stopped',
+                    finished_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is not None and self._heartbeat.is_alive():
+                return
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='generation-heartbeat',
+                                               daemon=True)
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(GENERATION_HEARTBEAT_SECONDS)
+            with self._lock:
+                running = list(self._running)
+            try:
+                with self.app.app_context():
+                    if running:
+                        db.session.execute(
+                            update(GenerationJob)
+                            .where(GenerationJob.id.in_(running),
+                                   GenerationJob.status == GenerationJobStatus.running)
+                            .values(heartbeat_at=datetime.utcnow())
+                            .execution_options(synchronize_session=False)
+                        )
+                        db.session.commit()
+                    interrupted = self._fail_stale_jobs()
+                    if interrupted:
+                        logger.warning(f'Marked {interrupted} generation jobs with a stale heartbeat as failed')
+            except Exception as e:
+                logger.warning(f'Generation job heartbeat failed: {str(e)}')
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def create(self, workflow: Workflow, variables: dict, output_nodes: List[str]) -> GenerationJob:
+        """写入一条 queued 任务并提交到工作线程池
+
+        Raises:
+            GenerationQueueFull: 待执行任务数已达 GENERATION_QUEUE_MAX
+        """
+        if self._pending >= self.max_pending:
+            raise GenerationQueueFull(f'{self._pending} generation jobs are already waiting')
+        if self.app is None:
+            self.app = current_app._get_current_object()
+        job = GenerationJob(
+            id=uuid.uuid4().hex,
+            workflow_id=workflow.id,
+            workflow_name=workflow.name,
+            variables=variables,
+            output_nodes=output_nodes,
+            status=GenerationJobStatus.queued,
+            created_at=datetime.utcnow()
+        )
+        db.session.add(job)
+        db.session.commit()
+        self._enqueue(job)
+        return job
+
+    def _enqueue(self, job: GenerationJob):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='generation')
+            self._pending += 1
+            self._track(job.id, _LiveJob(job.to_dict()))
+        self._start_heartbeat()
+        self._executor.submit(self._run, job.id)
+
+    def _track(self, job_id: str, live: _LiveJob):
+        self._live[job_id] = live
+        finished = [key for key, item in self._live.items() if item.finished]
+        for key in finished[:max(0, len(finished) - MAX_FINISHED_LIVE_JOBS)]:
+            del self._live[key]
+
+    # ---- 执行 ----
+
+    def _flush(self, job: GenerationJob, live: _LiveJob, force: bool = False):
+        now = time.monotonic()
+        if not force and now - live.flushed_at < GENERATION_PROGRESS_FLUSH_SECONDS:
+            return
+        state = live.state
+        job.prompt_id = state['prompt_id']
+        job.current_node = state['current_node']
+        job.nodes_done = state['nodes_done']
+        job.step = state['step']
+        job.max_steps = state['max_steps']
+        db.session.commit()
+        live.flushed_at = now
+
+    def _on_event(self, job: GenerationJob, live: _LiveJob, message: dict):
+        data = message.get('data') or {}
+        kind = message.get('type')
+        changes = {}
+        if data.get('prompt_id') and live.state['prompt_id'] != data['prompt_id']:
+            changes['prompt_id'] = data['prompt_id']
+        if kind == 'execution_cached':
+            live.seen_nodes.update(data.get('nodes') or [])
+            changes['nodes_done'] = len(live.seen_nodes)
+        elif kind == 'executing':
+            # 开始执行下一个节点即表示上一个节点已完成
+            previous = live.state['current_node']
+            if previous is not None:
+                live.seen_nodes.add(previous)
+            changes['current_node'] = data.get('node')
+            changes['nodes_done'] = len(live.seen_nodes)
+        elif kind == 'progress':
+            changes['step'] = data.get('value')
+            changes['max_steps'] = data.get('max')
+        if not changes:
+            return
+        node_changed = 'current_node' in changes
+        live.update(**changes)
+        self._flush(job, live, force=node_changed)
+
+    def _claim(self, job_id: str) -> bool:
+        """把 queued 任务原子地改为 running；已被其他进程或线程领取（或任务不存在）时返回 False"""
+        now = datetime.utcnow()
+        result = db.session.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id == job_id, GenerationJob.status == GenerationJobStatus.queued)
+            .values(status=GenerationJobStatus.running, started_at=now, heartbeat_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _run(self, job_id: str):
+        with self._lock:
+            self._pending -= 1
+            live = self._live.get(job_id)
+        with self.app.app_context():
+            if not self._claim(job_id):
+                # 由其他进程执行：不保留本进程的实时状态，查询与订阅改为读取数据库
+                with self._lock:
+                    if live is not None and self._live.get(job_id) is live:
+                        del self._live[job_id]
+                return
+            with self._lock:
+                self._running.add(job_id)
+            job = db.session.get(GenerationJob, job_id)
+            if live is None:
+                live = _LiveJob(job.to_dict())
+                with self._lock:
+                    self._track(job_id, live)
+            try:
+                live.update(**job.to_dict())
+                workflow = db.session.get(Workflow, job.workflow_id) if job.workflow_id else None
+                if workflow is None:
+                    raise ValueError(f'Workflow {job.workflow_id} not found')
+                workflow_path = workflow_file_path(workflow)
+                if not os.path.exists(workflow_path):
+                    raise ValueError('Workflow file not found')
+                workflow_json = load_workflow(workflow_path)
+                if workflow_json is None:
+                    raise ValueError('Invalid workflow file')
+                workflow_data = json.loads(workflow_json)
+
+                job.nodes_total = len(workflow_data)
+                db.session.commit()
+                live.update(**job.to_dict())
+                logger.info(f'Generation job {job_id} started (workflow {workflow.name})')
+
+                content_hashes = {}
+                result = prompt_to_image(
+                    workflow=workflow_data,
+                    variable_values=job.variables or {},
+                    output_node_ids=job.output_nodes or [],
+                    save_previews=True,
+                    on_event=lambda message: self._on_event(job, live, message),
+                    content_hashes=content_hashes
+                )
+                if not result:
+                    raise RuntimeError('No images were generated, check the selected output nodes')
+                images = save_generated_images(result, workflow, job.variables, content_hashes)
+                job.result = result
+                job.image_ids = [image.id for image in images]
+                job.status = GenerationJobStatus.done
+                job.current_node = None
+                job.nodes_done = job.nodes_total
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                logger.info(f'Generation job {job_id} finished: {result}')
+            except Exception as e:
+                logger.error(f'Generation job {job_id} failed: {str(e)}', exc_info=True)
+                db.session.rollback()
+                job = db.session.get(GenerationJob, job_id)
+                job.status = GenerationJobStatus.failed
+                job.error = str(e)
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+            finally:
+                with self._lock:
+                    self._running.discard(job_id)
+            live.update(**job.to_dict())
+
+    # ---- 查询 ----
+
+    def snapshot(self, job_id: str) -> Optional[dict]:
+        """任务当前状态：进程内有实时状态时直接返回，否则读取数据库（需在 app context 中调用）"""
+        live = self._live.get(job_id)
+        if live is not None:
+            return dict(live.state)
+        job = db.session.get(GenerationJob, job_id)
+        return job.to_dict() if job else None
+
+    def stream(self, job_id: str, heartbeat: float = SSE_HEARTBEAT_SECONDS) -> Iterator[Optional[dict]]:
+        """依次产出任务状态的每次变化，空闲 heartbeat 秒产出 None，任务结束后停止
+
+        由其他进程执行的任务按 GENERATION_PROGRESS_FLUSH_SECONDS 轮询数据库（需在 app context 中调用）。
+        """
+        live = self._live.get(job_id)
+        if live is None:
+            yield from self._poll(job_id, heartbeat)
+            return
+        version = -1
+        while True:
+            with live.condition:
+                if live.version == version:
+                    live.condition.wait(heartbeat)
+                if live.version == version:
+                    state = None
+                else:
+                    state, version = dict(live.state), live.version
+            if state is None and self._live.get(job_id) is not live:
+                # 任务已由其他进程领取
+                yield from self._poll(job_id, heartbeat)
+                return
+            yield state
+            if state is not None and state['status'] in (GenerationJobStatus.done.value,
+                                                         GenerationJobStatus.failed.value):
+                return
+
+    def _poll(self, job_id: str, heartbeat: float) -> Iterator[Optional[dict]]:
+        last = None
+        idle = 0.0
+        while True:
+            # 结束当前读事务，读取其他进程提交的最新进度
+            db.session.rollback()
+            job = db.session.get(GenerationJob, job_id, populate_existing=True)
+            if job is None:
+                return
+            state = job.to_dict()
+            if state != last:
+                yield state
+                last = state
+                idle = 0.0
+            elif idle >= heartbeat:
+                yield None
+                idle = 0.0
+            if job.finished:
+                return
+            time.sleep(GENERATION_PROGRESS_FLUSH_SECONDS)
+            idle += GENERATION_PROGRESS_FLUSH_SECONDS
+
+
+def sse_message(state: Optional[dict]) -> str:
+    if state is None:
+        return ': keep-alive\n\n'
+    return f"event: progress\ndata: {json.dumps(state)}\n\n"
+
+
+generation_queue = GenerationQueue()
@@ -0,0 +1,745 @@
+"""图片相关的后台任务，复用 AgentScheduler 的 BackgroundScheduler 执行"""
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.extensions import db
+from app.models.image import Image, ImageSource, ImageType, DeletedImagePath
+from app.scheduler import scheduler
+from app.utils.blob_store import output_blob_store
+from app.utils.color_index import color_index
+from app.utils.count_cache import image_count_cache
+from app.utils.image_analysis import analyze_paths
+from app.utils.image_archive import image_archive
+from app.utils.image_metadata import read_file_metadata
+from app.utils.image_paths import candidate_paths, find_existing_path, image_path_resolver
+from app.utils.image_walker import DirectoryListing
+from app.utils.job_progress import JobProgress, job_registry
+from app.utils.logger import logger
+from app.utils.perceptual_hash import dhash, phash_index, to_signed
+from app.utils.storage_layout import STORAGE_ROOTS, file_path_variants, iter_flat_files, place_file, shard_moves
+from app.utils.image_derivatives import derivative_service
+from app.utils.sprites import sprite_service
+from app.utils.thumbnails import prewarm_thumbnails, thumbnail_service
+from conf import (METADATA_BACKFILL_BATCH_SIZE, THUMBNAIL_PREWARM_WIDTHS, UPLOAD_FOLDER, OUTPUT_FOLDER,
+                  IMAGE_MAINTENANCE_BATCH_SIZE, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL_HOURS)
+
+METADATA_BACKFILL_JOB_ID = 'image_metadata_backfill'
+
+
+def _resolve_app(app=None):
+    if app is not None:
+        return app
+    if scheduler.app is not None:
+        return scheduler.app
+    if has_app_context():
+        return current_app._get_current_object()
+    return None
+
+
+_running_jobs = set()
+# 执行期间再次触发的任务：{job_id: args}，结束后用最后一次触发的参数再执行一次
+_rerun_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _run_job(app, func, job_id: str, *args):
+    with _jobs_lock:
+        _running_jobs.add(job_id)
+    try:
+        func(app, *args)
+    finally:
+        with _jobs_lock:
+            _running_jobs.discard(job_id)
+            rerun = _rerun_jobs.pop(job_id, None)
+        if rerun is not None:
+            run_in_background(func, job_id, *rerun, app=app)
+
+
+def run_in_background(func, job_id: str, *args, app=None) -> bool:
+    """在调度器线程池中立即执行一次 func(app, *args)，同一 job_id 只保留一个待执行任务
+
+    该 job_id 正在执行时不会丢弃这次触发（max_instances=1 会直接跳过），而是在本次执行结束后再执行一次，
+    执行开始后才出现的数据同样会被处理。
+    """
+    app = _resolve_app(app)
+    if app is None:
+        logger.warning(f"Cannot schedule background job {job_id}: no Flask app")
+        return False
+    with _jobs_lock:
+        if job_id in _running_jobs:
+            _rerun_jobs[job_id] = args
+            return True
+    scheduler.scheduler.add_job(
+        func=_run_job,
+        args=[app, func, job_id, *args],
+        id=job_id,
+        replace_existing=True,
+        max_instances=1
+    )
+    return True
+
+
+def _analysis_updates(rows, with_stat: bool = False):
+    """rows 为 (id, local_path, file_path, phash)，在线程池中提取属性
+
+    Returns:
+        (批量 UPDATE 参数, 找不到文件的图片 id 列表)
+    """
+    targets = []
+    missing = []
+    for image_id, local_path, file_path, phash in rows:
+        path = find_existing_path(local_path, file_path)
+        if not path:
+            missing.append(image_id)
+            continue
+        meta = {'id': image_id}
+        if with_stat:
+            try:
+                meta.update(read_file_metadata(path, with_dimensions=False))
+            except OSError:
+                missing.append(image_id)
+                continue
+        targets.append((path, phash, meta))
+
+    now = datetime.utcnow()
+    updates = []
+    for (path, phash, meta), result in zip(targets, analyze_paths(p for p, _, _ in targets)):
+        if result:
+            meta.update(result)
+            if phash is not None:
+                meta['phash'] = phash
+        # 无法解码的文件同样记录 analyzed_at，文件变化前不再重试
+        meta['analyzed_at'] = now
+        updates.append(meta)
+    return updates, missing
+
+
+def backfill_image_metadata(app, prewarm: bool = False, batch_size: int = METADATA_BACKFILL_BATCH_SIZE):
+    """为缺少文件大小、尺寸或固有属性的图片记录补齐元数据，按 id 分批处理
+
+    尺寸、格式、EXIF 方向、主色调、颜色直方图与 dHash 在线程池中提取；prewarm 为 True 时
+    （新文件入库后触发）为补齐的图片预生成缩略图。找不到文件的记录写入 metadata_probed_at，
+    之后的回填不再重复探测，直到文件重新入库或内容变化时清空该标记。
+    """
+    with app.app_context():
+        last_id = 0
+        filled = 0
+        missing = 0
+        try:
+            while True:
+                rows = db.session.query(Image.id, Image.local_path, Image.file_path, Image.phash).filter(
+                    Image.id > last_id,
+                    Image.metadata_probed_at.is_(None),
+                    # 无法解码的文件也会记录 analyzed_at，不再按 width/phash 是否为空反复重试；
+                    # 文件内容变化时 _refresh_stat 会清空 analyzed_at
+                    or_(Image.analyzed_at.is_(None), Image.file_size.is_(None), Image.file_mtime.is_(None))
+                ).order_by(Image.id).limit(batch_size).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                updates, batch_missing = _analysis_updates(rows, with_stat=True)
+                missing += len(batch_missing)
+                if updates:
+                    db.session.execute(update(Image), updates)
+                    filled += len(updates)
+                if batch_missing:
+                    db.session.execute(update(Image).where(Image.id.in_(batch_missing))
+                                       .values(metadata_probed_at=datetime.utcnow())
+                                       .execution_options(synchronize_session=False))
+                db.session.commit()
+                if updates:
+                    phash_index.invalidate()
+                    color_index.upsert((u['id'], u.get('color_histogram')) for u in updates)
+                if prewarm and updates:
+                    prewarm_thumbnails([u['id'] for u in updates], THUMBNAIL_PREWARM_WIDTHS)
+            logger.info(f"Image metadata backfill complete: filled={filled}, missing_files={missing}")
+        except Exception as e:
+            logger.error(f"Image metadata backfill failed: {str(e)}", exc_info=True)
+            db.session.rollback()
+
+
+def schedule_metadata_backfill(app=None, prewarm: bool = False) -> bool:
+    return run_in_background(backfill_image_metadata, METADATA_BACKFILL_JOB_ID, prewarm, app=app)
+
+
+def read_perceptual_hash(path: str):
+    """计算可直接写入 Image.phash 的 dHash，无法解码时返回 None"""
+    try:
+        return to_signed(dhash(path))
+    except Exception as e:
+        logger.warning(f"Failed to compute perceptual hash for {path}: {str(e)}")
+        return None
+
+
+def compute_perceptual_hashes(image_ids) -> int:
+    """为指定图片计算并保存感知哈希（需在 app context 中调用）"""
+    updates = []
+    rows = db.session.query(Image.id, Image.local_path, Image.file_path).filter(
+        Image.id.in_(list(image_ids)), Image.phash.is_(None))
+    for image_id, local_path, file_path in rows:
+        path = find_existing_path(local_path, file_path)
+        value = read_perceptual_hash(path) if path else None
+        if value is not None:
+            updates.append({'id': image_id, 'phash': value})
+    if updates:
+        db.session.execute(update(Image), updates)
+        db.session.commit()
+        phash_index.invalidate()
+    return len(updates)
+
+
+def analyze_images(image_ids) -> int:
+    """为指定图片提取固有属性（含缺失的感知哈希）并保存（需在 app context 中调用）"""
+    rows = db.session.query(Image.id, Image.local_path, Image.file_path, Image.phash).filter(
+        Image.id.in_(list(image_ids)), Image.analyzed_at.is_(None)).all()
+    updates, _ = _analysis_updates(rows)
+    if updates:
+        db.session.execute(update(Image), updates)
+        db.session.commit()
+        phash_index.invalidate()
+        color_index.upsert((u['id'], u.get('color_histogram')) for u in updates)
+    return len(updates)
+
+
+def _prewarm_job(app, image_ids):
+    """新上传/生成的图片：提取属性与感知哈希并预生成缩略图"""
+    with app.app_context():
+        try:
+            analyze_images(image_ids)
+        except Exception as e:
+            logger.error(f"Image analysis failed: {str(e)}", exc_info=True)
+            db.session.rollback()
+        try:
+            prewarm_thumbnails(image_ids, THUMBNAIL_PREWARM_WIDTHS)
+        except Exception as e:
+            logger.error(f"Thumbnail prewarm failed: {str(e)}", exc_info=True)
+
+
+def schedule_thumbnail_prewarm(image_ids, app=None) -> bool:
+    image_ids = list(image_ids)
+    if not image_ids:
+        return False
+    return run_in_background(_prewarm_job, f'thumbnail_prewarm_{uuid.uuid4().hex}', image_ids, app=app)
+
+
+CLEAR_ALL_JOB = 'image_clear_all'
+CLEANUP_ORPHANS_JOB = 'image_cleanup_orphans'
+
+
+def _owned_file(file_path: Optional[str]) -> Optional[str]:
+    """上传/生成图片在 UPLOAD_FOLDER/OUTPUT_FOLDER 中的文件（本地目录中的文件不属于本系统，不删除）"""
+    p = str(file_path or '').replace('\\', '/')
+    if p.startswith('/uploads/'):
+        return os.path.join(UPLOAD_FOLDER, p.split('/uploads/', 1)[1])
+    if 'upload/images/' in p:
+        return os.path.join(UPLOAD_FOLDER, p.split('upload/images/', 1)[1])
+    if 'output/images/' in p:
+        return os.path.join(OUTPUT_FOLDER, p.split('output/images/', 1)[1])
+    if p.startswith('/output/'):
+        return os.path.join(OUTPUT_FOLDER, p.split('/output/', 1)[1])
+    if p.startswith('output/'):
+        return os.path.join(OUTPUT_FOLDER, p.split('output/', 1)[1])
+    return None
+
+
+def _record_deleted_paths(local_paths):
+    """批量记录被删除的本地目录图片路径，防止重新扫描时再次入库"""
+    local_paths = set(local_paths)
+    if not local_paths:
+        return
+    existing = set(db.session.scalars(
+        select(DeletedImagePath.local_path).where(DeletedImagePath.local_path.in_(local_paths))))
+    rows = [{'local_path': p} for p in local_paths - existing]
+    if rows:
+        db.session.execute(insert(DeletedImagePath), rows)
+
+
+def _after_images_deleted(image_ids=None):
+    if image_ids is None:
+        image_path_resolver.clear()
+        color_index.invalidate()
+        # 图片 id 不再有效，缩略图、派生格式与拼图缓存整体清空
+        for service in (thumbnail_service, derivative_service, sprite_service):
+            service.cache.clear()
+    else:
+        image_path_resolver.invalidate_many(image_ids)
+        color_index.discard(image_ids)
+    image_count_cache.clear()
+    phash_index.invalidate()
+
+
+def clear_all_images_job(app, job: JobProgress, batch_size: int = IMAGE_MAINTENANCE_BATCH_SIZE):
+    """删除全部图片记录及上传/生成的文件
+
+    按 id 分批：每批读取所需列，按目录列表判断文件是否存在并删除，批量写入 DeletedImagePath 后
+    用一条 DELETE 删除该批记录并提交。每批都是独立的短查询，不在删除的同时保持打开的游标。
+    """
+    with app.app_context():
+        try:
+            max_id = db.session.scalar(select(func.max(Image.id)))
+            job_registry.start(job, db.session.scalar(select(func.count(Image.id))))
+            listing = DirectoryListing()
+            last_id = 0
+            deleted = 0
+            removed_files = 0
+            while max_id is not None:
+                rows = db.session.execute(
+                    select(Image.id, Image.source, Image.local_path, Image.file_path)
+                    .where(Image.id > last_id, Image.id <= max_id)
+                    .order_by(Image.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+
+                targets = {os.path.abspath(t) for t in (_owned_file(r.file_path) for r in rows) if t}
+                listing.prefetch(targets)
+                for target in targets:
+                    if target not in listing:
+                        continue
+                    try:
+                        os.remove(target)
+                        listing.discard(target)
+                        removed_files += 1
+                    except OSError as e:
+                        logger.error(f'Failed to delete file {target}: {str(e)}')
+
+                _record_deleted_paths(
+                    r.local_path for r in rows if r.source == ImageSource.local_dir and r.local_path)
+                ids = [r.id for r in rows]
+                deleted += db.session.execute(
+                    delete(Image).where(Image.id.in_(ids)).execution_options(synchronize_session=False)
+                ).rowcount
+                db.session.commit()
+                job_registry.advance(job, len(rows))
+
+            _after_images_deleted()
+            # 生成图片的原路径已删除，回收不再被任何记录引用的输出 blob 以及全部归档
+            output_blob_store.prune_unreferenced(_live_output_hashes())
+            for name in image_archive.pack_names():
+                image_archive.remove_pack(name)
+            logger.info(f'Cleared {deleted} images, removed {removed_files} files')
+            job_registry.finish(job, {'message': '已删除所有图片', 'count': deleted})
+        except Exception as e:
+            logger.error(f'清空图片失败: {str(e)}', exc_info=True)
+            db.session.rollback()
+            _after_images_deleted()
+            job_registry.fail(job, str(e))
+
+
+def _orphan_candidates(row):
+    paths = [row.resolved_path] + candidate_paths(row.local_path, row.file_path)
+    return list(dict.fromkeys(os.path.abspath(p) for p in paths if p))
+
+
+def cleanup_orphan_images_job(app, job: JobProgress, dry_run: bool = False,
+                              image_type: Optional[ImageType] = None,
+                              batch_size: int = IMAGE_MAINTENANCE_BATCH_SIZE):
+    """查找（并删除）指向不存在文件的图片记录
+
+    只读扫描阶段以 yield_per 流式读取、按 id 顺序分批处理，每个目录只列出一次；
+    扫描结束后再按批量 DELETE 删除找到的记录。
+    """
+    with app.app_context():
+        try:
+            # 已归档到冷存储的图片热盘上没有文件，不算脏数据
+            stmt = select(Image.id, Image.filename, Image.file_path, Image.local_path, Image.resolved_path,
+                          Image.image_type, Image.source).where(Image.archive_pack.is_(None))
+            count_stmt = select(func.count(Image.id)).where(Image.archive_pack.is_(None))
+            if image_type is not None:
+                stmt = stmt.where(Image.image_type == image_type)
+                count_stmt = count_stmt.where(Image.image_type == image_type)
+            job_registry.start(job, db.session.scalar(count_stmt))
+
+            listing = DirectoryListing()
+            orphan_ids = []
+            orphan_details = []
+            result = db.session.execute(stmt.order_by(Image.id).execution_options(yield_per=batch_size))
+            for rows in result.partitions():
+                candidates = [_orphan_candidates(row) for row in rows]
+                listing.prefetch(p for paths in candidates for p in paths)
+                for row, paths in zip(rows, candidates):
+                    if any(p in listing for p in paths):
+                        continue
+                    orphan_ids.append(row.id)
+                    if len(orphan_details) < 100:  # Limit to first 100 for response size
+                        orphan_details.append({
+                            'id': row.id,
+                            'filename': row.filename,
+                            'file_path': row.file_path,
+                            'local_path': row.local_path,
+                            'image_type': row.image_type.value if hasattr(row.image_type, 'value') else row.image_type,
+                            'source': row.source.value if hasattr(row.source, 'value') else row.source,
+                            'checked_path': row.file_path or row.local_path
+                        })
+                job_registry.advance(job, len(rows))
+            result.close()
+
+            deleted_count = 0
+            if not dry_run and orphan_ids:
+                for start in range(0, len(orphan_ids), batch_size):
+                    chunk = orphan_ids[start:start + batch_size]
+                    deleted_count += db.session.execute(
+                        delete(Image).where(Image.id.in_(chunk)).execution_options(synchronize_session=False)
+                    ).rowcount
+                    db.session.commit()
+                _after_images_deleted(orphan_ids)
+                logger.info(f'Cleaned up {deleted_count} orphan image records')
+
+            job_registry.finish(job, {
+                'message': f'找到 {len(orphan_ids)} 条脏数据' + (f'，已删除 {deleted_count} 条' if not dry_run else ' (dry run模式，未删除)'),
+                'orphan_count': len(orphan_ids),
+                'deleted_count': deleted_count,
+                'dry_run': dry_run,
+                'orphans': orphan_details
+            })
+        except Exception as e:
+            logger.error(f'清理脏数据失败: {str(e)}', exc_info=True)
+            db.session.rollback()
+            job_registry.fail(job, str(e))
+
+
+def start_clear_all_images(app=None) -> Optional[JobProgress]:
+    """启动清空任务；已有清空任务在执行时返回该任务"""
+    running = job_registry.active(CLEAR_ALL_JOB)
+    if running:
+        return running
+    job = job_registry.create(CLEAR_ALL_JOB)
+    if not run_in_background(clear_all_images_job, f'{CLEAR_ALL_JOB}_{job.id}', job, app=app):
+        job_registry.fail(job, 'scheduler unavailable')
+        return None
+    return job
+
+
+def start_orphan_cleanup(dry_run: bool = False, image_type: Optional[ImageType] = None,
+                         app=None) -> Optional[JobProgress]:
+    job = job_registry.create(CLEANUP_ORPHANS_JOB)
+    if not run_in_background(cleanup_orphan_images_job, f'{CLEANUP_ORPHANS_JOB}_{job.id}',
+                             job, dry_run, image_type, app=app):
+        job_registry.fail(job, 'scheduler unavailable')
+        return None
+    return job
+
+
+SHARD_STORAGE_JOB = 'storage_shard'
+
+
+def _shard_batch(root_key: str, entries, dry_run: bool) -> int:
+    """迁移一批平铺文件：建立新路径 -> 更新记录并提交 -> 删除旧路径，返回迁移的文件数"""
+    paths = [os.path.abspath(e.path) for e in entries]
+    variants = [v for e in entries for v in file_path_variants(root_key, e.name)]
+    rows = db.session.execute(
+        select(Image.id, Image.created_at, Image.file_path, Image.local_path, Image.resolved_path)
+        .where(or_(Image.file_path.in_(variants), Image.local_path.in_(paths), Image.resolved_path.in_(paths)))
+    ).all()
+    updates, moves = shard_moves(root_key, entries, rows)
+    if dry_run:
+        return len(moves)
+
+    placed = []
+    try:
+        for old_path, new_path in moves:
+            if place_file(old_path, new_path) != 'existing':
+                placed.append(new_path)
+        if updates:
+            db.session.execute(update(Image), updates)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for new_path in placed:
+            try:
+                os.remove(new_path)
+            except OSError:
+                pass
+        raise
+
+    image_path_resolver.invalidate_many(u['id'] for u in updates)
+    for old_path, new_path in moves:
+        if old_path != new_path:
+            try:
+                os.remove(old_path)
+            except OSError as e:
+                logger.warning(f'Failed to remove migrated file {old_path}: {str(e)}')
+    return len(moves)
+
+
+def shard_flat_files_job(app, job: JobProgress, roots=tuple(STORAGE_ROOTS), dry_run: bool = False,
+                         batch_size: int = IMAGE_MAINTENANCE_BATCH_SIZE):
+    """把 UPLOAD_FOLDER/OUTPUT_FOLDER 根目录下平铺的文件迁移到 YYYY/MM/DD 分片目录
+
+    以 scandir 流式读取目录，每批文件只查询引用它们的记录，可随时中断，重新执行时继续处理剩余的文件。
+    总数未知，进度只记录已处理的文件数。
+    """
+    with app.app_context():
+        try:
+            job_registry.start(job)
+            moved = {}
+            for root_key in roots:
+                moved[root_key] = 0
+                batch = []
+                for entry in iter_flat_files(STORAGE_ROOTS[root_key][0]):
+                    batch.append(entry)
+                    if len(batch) >= batch_size:
+                        moved[root_key] += _shard_batch(root_key, batch, dry_run)
+                        job_registry.advance(job, len(batch))
+                        batch = []
+                if batch:
+                    moved[root_key] += _shard_batch(root_key, batch, dry_run)
+                    job_registry.advance(job, len(batch))
+            logger.info(f'Sharded flat storage files: {moved}' + (' (dry run)' if dry_run else ''))
+            job_registry.finish(job, {
+                'message': (f'共有 {sum(moved.values())} 个文件需要迁移' if dry_run
+                            else f'已迁移 {sum(moved.values())} 个文件'),
+                'moved': moved,
+                'dry_run': dry_run
+            })
+        except Exception as e:
+            logger.error(f'迁移存储目录失败: {str(e)}', exc_info=True)
+            db.session.rollback()
+            job_registry.fail(job, str(e))
+
+
+def start_storage_shard_migration(roots=tuple(STORAGE_ROOTS), dry_run: bool = False,
+                                  app=None) -> Optional[JobProgress]:
+    """启动平铺文件迁移任务；已有迁移任务在执行时返回该任务"""
+    running = job_registry.active(SHARD_STORAGE_JOB)
+    if running:
+        return running
+    job = job_registry.create(SHARD_STORAGE_JOB)
+    if not run_in_background(shard_flat_files_job, f'{SHARD_STORAGE_JOB}_{job.id}', job, tuple(roots), dry_run,
+                             app=app):
+        job_registry.fail(job, 'scheduler unavailable')
+        return None
+    return job
+
+
+ARCHIVE_JOB = 'image_archive'
+ARCHIVE_SCHEDULE_JOB_ID = 'image_archive_schedule'
+# last_accessed_at 的更新粒度：同一图片一天内只写一次
+_ACCESS_RESOLUTION = timedelta(days=1)
+_promote_lock = threading.Lock()
+
+
+def _hot_path(image) -> Optional[str]:
+    """归档图片提升回热盘时写回的路径"""
+    return image.resolved_path or _owned_file(image.file_path) or next(
+        iter(candidate_paths(image.local_path, image.file_path)), None)
+
+
+def _live_output_hashes() -> set:
+    """仍在热盘上的图片引用的内容哈希（已归档的图片提升时会重新纳入输出 blob 存储）"""
+    return set(db.session.scalars(
+        select(Image.content_hash).where(Image.content_hash.isnot(None), Image.archive_pack.is_(None)).distinct()))
+
+
+def _release_output_blob(path: str, content_hash: Optional[str]):
+    """热盘文件移走后，输出 blob 若已没有未归档的记录引用则一并删除"""
+    if not content_hash:
+        return
+    blob = output_blob_store.find(content_hash, os.path.splitext(path)[1])
+    if not blob:
+        return
+    in_use = db.session.scalar(
+        select(Image.id).where(Image.content_hash == content_hash, Image.archive_pack.is_(None)).limit(1))
+    if in_use is None:
+        output_blob_store.remove(blob)
+
+
+def touch_image_access(image):
+    """记录原图被请求的时间，最近访问过的图片不会被归档"""
+    now = datetime.utcnow()
+    if image.last_accessed_at and now - image.last_accessed_at < _ACCESS_RESOLUTION:
+        return
+    try:
+        db.session.execute(
+            update(Image).where(Image.id == image.id).values(last_accessed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        image.last_accessed_at = now
+    except Exception as e:
+        logger.warning(f'Failed to record access for image {image.id}: {str(e)}')
+        db.session.rollback()
+
+
+def promote_archived_image(image) -> Optional[str]:
+    """把已归档的图片解压回热盘（原路径），清除归档标记并返回文件路径
+
+    由 ImagePathResolver.resolve 在解析已归档图片时调用；归档状态在独立连接上读取与写回，
+    不提交调用方的会话。
+    """
+    if image.archive_pack is None:
+        return None
+    with _promote_lock:
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(Image.archive_pack, Image.archive_offset, Image.resolved_path).where(Image.id == image.id)
+            ).first()
+        if row is None:
+            return None
+        if row.archive_pack is None:
+            # 已被其他请求提升：同步实例上的归档标记后按普通图片解析
+            _set_promoted(image, row.resolved_path)
+            return image_path_resolver.resolve(image)
+        dest = _hot_path(image)
+        if not dest:
+            return None
+        image_archive.restore(row.archive_pack, row.archive_offset, dest, image.file_mtime)
+        if image.content_hash and image.source == ImageSource.generated:
+            # 重新纳入输出 blob 存储，与生成时的状态一致
+            output_blob_store.adopt(dest)
+        logger.info(f'Promoted archived image {image.id} from {row.archive_pack} to {dest}')
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            conn.execute(update(Image).where(Image.id == image.id).values(
+                archive_pack=None, archive_offset=None, archived_at=None, last_accessed_at=now, resolved_path=dest))
+        _set_promoted(image, dest, now)
+        image_path_resolver.invalidate(image.id)
+        return dest
+
+
+def _set_promoted(image, resolved_path: Optional[str], accessed_at: Optional[datetime] = None):
+    """把提升后的状态作为已提交的值写入实例，调用方会话不会因此变脏"""
+    for key, value in (('archive_pack', None), ('archive_offset', None), ('archived_at', None),
+                       ('resolved_path', resolved_path)):
+        set_committed_value(image, key, value)
+    if accessed_at is not None:
+        set_committed_value(image, 'last_accessed_at', accessed_at)
+
+
+def _archive_batch(rows, listing: DirectoryListing, dry_run: bool):
+    """归档一批图片：按创建日期追加到打包文件 -> 提交归档位置 -> 删除热盘文件，返回 (归档数, 释放字节数)"""
+    located = {}
+    for row in rows:
+        paths = [os.path.abspath(p) for p in [row.resolved_path] + candidate_paths(row.local_path, row.file_path) if p]
+        listing.prefetch(paths)
+        path = next((p for p in paths if p in listing), None)
+        if path:
+            located[row.id] = (row, path)
+    if dry_run:
+        return len(located), sum(row.file_size or 0 for row, _ in located.values())
+
+    by_pack = {}
+    for row, path in located.values():
+        by_pack.setdefault(image_archive.pack_name((row.created_at or datetime.utcnow()).date()), []).append(
+            (row.id, path, row.content_hash))
+
+    now = datetime.utcnow()
+    updates = []
+    for name, members in by_pack.items():
+        for image_id, offset, _ in image_archive.append(name, members):
+            updates.append({'id': image_id, 'archive_pack': name, 'archive_offset': offset,
+                            'archived_at': now, 'resolved_path': located[image_id][1]})
+    if not updates:
+        return 0, 0
+    db.session.execute(update(Image), updates)
+    db.session.commit()
+    image_path_resolver.invalidate_many(u['id'] for u in updates)
+
+    freed = 0
+    for u in updates:
+        row, path = located[u['id']]
+        try:
+            freed += os.path.getsize(path)
+            os.remove(path)
+            listing.discard(path)
+        except OSError as e:
+            logger.warning(f'Failed to remove archived file {path}: {str(e)}')
+            continue
+        _release_output_blob(path, row.content_hash)
+    return len(updates), freed
+
+
+def _remove_dead_packs() -> int:
+    """删除已没有记录引用的打包文件（成员全部被提升或删除），返回释放的字节数"""
+    live = set(db.session.scalars(select(Image.archive_pack).where(Image.archive_pack.isnot(None)).distinct()))
+    return sum(image_archive.remove_pack(name) for name in image_archive.pack_names() if name not in live)
+
+
+def archive_cold_images_job(app, job: JobProgress, older_than_days: int = ARCHIVE_AFTER_DAYS, dry_run: bool = False,
+                            batch_size: int = IMAGE_MAINTENANCE_BATCH_SIZE):
+    """把创建与最近访问都早于 older_than_days 天的生成图片移入冷存储
+
+    按 id 分批：每批先追加到对应日期的打包文件并 fsync，提交归档位置后才删除热盘文件，
+    任一步失败时原文件仍在；最后删除已无记录引用的打包文件。
+    """
+    with app.app_context():
+        try:
+            cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+            conditions = (
+                Image.source == ImageSource.generated,
+                Image.archive_pack.is_(None),
+                Image.created_at < cutoff,
+                or_(Image.last_accessed_at.is_(None), Image.last_accessed_at < cutoff),
+            )
+            job_registry.start(job, db.session.scalar(select(func.count(Image.id)).where(*conditions)))
+            listing = DirectoryListing()
+            archived = 0
+            freed = 0
+            last_id = 0
+            while True:
+                rows = db.session.execute(
+                    select(Image.id, Image.created_at, Image.file_path, Image.local_path, Image.resolved_path,
+                           Image.content_hash, Image.file_size)
+                    .where(Image.id > last_id, *conditions).order_by(Image.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                count, size = _archive_batch(rows, listing, dry_run)
+                archived += count
+                freed += size
+                job_registry.advance(job, len(rows))
+
+            reclaimed_packs = 0 if dry_run else _remove_dead_packs()
+            logger.info(f'Archived {archived} images ({freed} bytes), removed dead packs: {reclaimed_packs} bytes'
+                        + (' (dry run)' if dry_run else ''))
+            job_registry.finish(job, {
+                'message': (f'共有 {archived} 张图片可以归档' if dry_run else f'已归档 {archived} 张图片'),
+                'archived_count': archived,
+                'freed_bytes': freed,
+                'reclaimed_pack_bytes': reclaimed_packs,
+                'dry_run': dry_run
+            })
+        except Exception as e:
+            logger.error(f'归档图片失败: {str(e)}', exc_info=True)
+            db.session.rollback()
+            job_registry.fail(job, str(e))
+
+
+def start_cold_image_archive(older_than_days: int = ARCHIVE_AFTER_DAYS, dry_run: bool = False,
+                             app=None) -> Optional[JobProgress]:
+    """启动归档任务；已有归档任务在执行时返回该任务"""
+    running = job_registry.active(ARCHIVE_JOB)
+    if running:
+        return running
+    job = job_registry.create(ARCHIVE_JOB)
+    if not run_in_background(archive_cold_images_job, f'{ARCHIVE_JOB}_{job.id}', job, older_than_days, dry_run,
+                             app=app):
+        job_registry.fail(job, 'scheduler unavailable')
+        return None
+    return job
+
+
+def schedule_cold_image_archive(app=None) -> bool:
+    """按 ARCHIVE_INTERVAL_HOURS 周期性执行归档任务（0 表示不自动执行）"""
+    app = _resolve_app(app)
+    if app is None or ARCHIVE_INTERVAL_HOURS <= 0:
+        return False
+    scheduler.scheduler.add_job(
+        func=lambda: start_cold_image_archive(app=app),
+        trigger='interval',
+        hours=ARCHIVE_INTERVAL_HOURS,
+        id=ARCHIVE_SCHEDULE_JOB_ID,
+        replace_existing=True,
+        max_instances=1
+    )
+    return True
@@ -0,0 +1,245 @@
+"""默认目录(ImageDefaultLocation)的实时同步服务
+
+通过 watchdog（Linux 下基于 inotify）订阅每个默认目录的文件系统事件，把短时间内的大量事件
+合并后定期批量写入 Image / DeletedImagePath。watchdog 不可用或监听启动失败时，
+退化为定时对所有默认目录执行增量扫描。
+"""
+import os
+import threading
+from typing import Dict, Optional
+
+from apscheduler.triggers.interval import IntervalTrigger
+
+from app.extensions import db
+from app.models.image import ImageDefaultLocation, ImageType
+from app.image_jobs import schedule_metadata_backfill
+from app.scheduler import scheduler
+from app.utils.image_ingest import ImageIngestor, sync_directory
+from app.utils.image_walker import has_extension, normalize_extensions
+from app.utils.logger import logger
+from conf import (ALLOWED_EXTENSIONS, IMAGE_WATCH_ENABLED, IMAGE_WATCH_DEBOUNCE_SECONDS,
+                  IMAGE_WATCH_POLL_INTERVAL)
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover - 取决于运行环境
+    FileSystemEventHandler = object
+    Observer = None
+
+FLUSH_JOB_ID = 'image_watcher_flush'
+POLL_JOB_ID = 'image_watcher_poll'
+
+_UPSERT = 'upsert'
+_REMOVE = 'remove'
+
+
+class _LocationEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher: 'ImageLocationWatcher'):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        self.watcher.record(event.src_path, _UPSERT, event.is_directory)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.record(event.src_path, _UPSERT, False)
+
+    def on_deleted(self, event):
+        self.watcher.record(event.src_path, _REMOVE, event.is_directory)
+
+    def on_moved(self, event):
+        self.watcher.record(event.src_path, _REMOVE, event.is_directory)
+        self.watcher.record(event.dest_path, _UPSERT, event.is_directory)
+
+
+class ImageLocationWatcher:
+    _instance = None
+
+    def __init__(self):
+        if not hasattr(self, 'initialized'):
+            self.app = None
+            self.started = False
+            self.observer = None
+            self.locations: Dict[str, ImageType] = {}  # directory -> image_type
+            self.watches = {}  # directory -> watchdog ObservedWatch
+            self.extensions = normalize_extensions(ALLOWED_EXTENSIONS)
+            self._lock = threading.Lock()
+            # path -> (upsert/remove, 所属默认目录)，同一路径只保留最后一次事件
+            self._pending: Dict[str, tuple] = {}
+            self._dirty_locations = set()  # 发生目录级事件、需要增量扫描的默认目录
+            self.initialized = True
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self.observer is not None else 'polling'
+
+    def init_app(self, app):
+        self.app = app
+        if not IMAGE_WATCH_ENABLED:
+            logger.info("Image location watcher disabled")
+            return
+
+        if Observer is not None:
+            try:
+                self.observer = Observer()
+                self.observer.start()
+            except Exception as e:
+                logger.warning(f"Failed to start filesystem observer, falling back to polling: {str(e)}")
+                self.observer = None
+
+        self.started = True
+        with app.app_context():
+            self.refresh_locations()
+
+        if self.observer is not None:
+            scheduler.scheduler.add_job(
+                func=self.flush,
+                trigger=IntervalTrigger(seconds=IMAGE_WATCH_DEBOUNCE_SECONDS),
+                id=FLUSH_JOB_ID,
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True
+            )
+        else:
+            scheduler.scheduler.add_job(
+                func=self.scan_all,
+                trigger=IntervalTrigger(seconds=IMAGE_WATCH_POLL_INTERVAL),
+                id=POLL_JOB_ID,
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True
+            )
+        logger.info(f"Image location watcher started in {self.mode} mode for {len(self.locations)} locations")
+
+    def refresh_locations(self):
+        """根据 ImageDefaultLocation 重新订阅目录，目录配置变更后调用（需在 app context 中）"""
+        if not self.started:
+            return
+        locations = {}
+        for loc in ImageDefaultLocation.query.all():
+            try:
+                image_type = ImageType(loc.image_type)
+            except ValueError:
+                image_type = ImageType.general
+            if loc.directory and os.path.isdir(loc.directory):
+                locations[os.path.normpath(loc.directory)] = image_type
+
+        with self._lock:
+            self.locations = locations
+
+        if self.observer is None:
+            return
+
+        for directory in list(self.watches):
+            if directory not in locations:
+                self.observer.unschedule(self.watches.pop(directory))
+                logger.info(f"Stopped watching {directory}")
+        for directory in locations:
+            if directory in self.watches:
+                continue
+            try:
+                self.watches[directory] = self.observer.schedule(
+                    _LocationEventHandler(self), directory, recursive=True)
+                # 订阅前可能已有文件落盘，先做一次增量扫描补齐
+                with self._lock:
+                    self._dirty_locations.add(directory)
+                logger.info(f"Watching {directory} ({locations[directory].value})")
+            except Exception as e:
+                logger.error(f"Failed to watch {directory}: {str(e)}")
+
+    def _location_for(self, path: str) -> Optional[str]:
+        best = None
+        for directory in self.locations:
+            if path == directory or path.startswith(directory + os.sep):
+                if best is None or len(directory) > len(best):
+                    best = directory
+        return best
+
+    def record(self, path, action: str, is_directory: bool):
+        """由 watchdog 线程调用，只记录事件，不访问数据库"""
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        with self._lock:
+            location = self._location_for(path)
+            if location is None:
+                return
+            if is_directory:
+                # 目录创建/删除/移动交给基于清单的增量扫描处理
+                self._dirty_locations.add(location)
+            elif has_extension(path, self.extensions):
+                self._pending[path] = (action, location)
+
+    def flush(self):
+        """把累积的事件合并成一次批量写入"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            dirty, self._dirty_locations = self._dirty_locations, set()
+            locations = dict(self.locations)
+        if not pending and not dirty:
+            return
+
+        with self.app.app_context():
+            try:
+                for directory in dirty:
+                    if directory in locations:
+                        sync_directory(directory, locations[directory])
+
+                # 已整体重新扫描过的目录无需再逐个处理文件事件
+                pending = {p: v for p, v in pending.items() if v[1] not in dirty and v[1] in locations}
+                removals = [p for p, (action, _) in pending.items() if action == _REMOVE]
+
+                ingestor = ImageIngestor()
+                for path, (action, location) in sorted(pending.items()):
+                    if action != _UPSERT:
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        # 创建后又被删除
+                        removals.append(path)
+                        continue
+                    ingestor.add_scanned_file(path, st.st_mtime, locations[location], st.st_size)
+                ingestor.remove_paths(removals)
+                ingestor.forget_deleted_paths(removals)
+                result = ingestor.flush()
+                db.session.commit()
+                if dirty or result.added or result.updated:
+                    schedule_metadata_backfill(self.app, prewarm=True)
+                logger.info(
+                    f"Image watcher synced: rescanned={len(dirty)}, added={result.added}, "
+                    f"updated={result.updated}, removed={result.removed}"
+                )
+            except Exception as e:
+                logger.error(f"Image watcher flush failed: {str(e)}", exc_info=True)
+                db.session.rollback()
+
+    def scan_all(self):
+        """轮询模式：对所有默认目录执行一次增量扫描"""
+        with self.app.app_context():
+            try:
+                self.refresh_locations()
+                for directory, image_type in self.locations.items():
+                    _, result = sync_directory(directory, image_type)
+                    db.session.commit()
+                    if result.added:
+                        schedule_metadata_backfill(self.app, prewarm=True)
+                    if result.added or result.updated or result.removed:
+                        logger.info(
+                            f"Polled {directory}: added={result.added}, "
+                            f"updated={result.updated}, removed={result.removed}"
+                        )
+            except Exception as e:
+                logger.error(f"Image location polling failed: {str(e)}", exc_info=True)
+                db.session.rollback()
+
+
+# Create a global instance
+image_watcher = ImageLocationWatcher.get_instance()
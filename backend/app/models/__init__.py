@@ -7,6 +7,7 @@ from app.models.workflow_variable import WorkflowVariable
 from app.models.advertisement_task import AdvertisementTask, TaskStatus
 from app.models.task_rule_card import TaskRuleCard
 from app.models.system_config import SystemConfig, ConfigCategory
+from app.models.generation_job import GenerationJob, GenerationJobStatus
 
 __all__ = [
     'Image',
@@ -21,4 +22,6 @@ __all__ = [
     'TaskStatus',
     'SystemConfig',
     'ConfigCategory',
+    'GenerationJob',
+    'GenerationJobStatus',
 ]
@@ -0,0 +1,70 @@
+from datetime import datetime
+from enum import Enum
+from app.extensions import db
+
+
+class GenerationJobStatus(Enum):
+    queued = 'queued'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+
+
+class GenerationJob(db.Model):
+    """/images/generate 提交的异步生成任务，由 app.generation_jobs 的工作线程池执行"""
+    __tablename__ = 'generation_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    workflow_id = db.Column(db.Integer, db.ForeignKey('workflows.id'), nullable=True)
+    workflow_name = db.Column(db.String(255))
+    # 生成参数：{node_id: {value_path: value}} 与输出节点 id 列表，服务重启后据此重新排队
+    variables = db.Column(db.JSON)
+    output_nodes = db.Column(db.JSON)
+    status = db.Column(
+        db.Enum(GenerationJobStatus, native_enum=False, values_callable=lambda x: [e.value for e in x]),
+        default=GenerationJobStatus.queued,
+        nullable=False,
+        index=True
+    )
+    prompt_id = db.Column(db.String(64), nullable=True)
+    # 执行进度：正在执行的节点、已完成节点数/节点总数、采样步数 step/max_steps
+    current_node = db.Column(db.String(64), nullable=True)
+    nodes_done = db.Column(db.Integer, nullable=False, default=0)
+    nodes_total = db.Column(db.Integer, nullable=True)
+    step = db.Column(db.Integer, nullable=True)
+    max_steps = db.Column(db.Integer, nullable=True)
+    # 生成的文件（相对 OUTPUT_FOLDER）与对应的图片记录
+    result = db.Column(db.JSON, nullable=True)
+    image_ids = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # 执行任务的进程定期刷新，用于识别进程退出后遗留的 running 任务
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    workflow = db.relationship('Workflow', foreign_keys=[workflow_id])
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (GenerationJobStatus.done, GenerationJobStatus.failed)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'workflow_id': self.workflow_id,
+            'workflow_name': self.workflow_name,
+            'status': self.status.value if hasattr(self.status, 'value') else self.status,
+            'prompt_id': self.prompt_id,
+            'current_node': self.current_node,
+            'nodes_done': self.nodes_done or 0,
+            'nodes_total': self.nodes_total,
+            'step': self.step,
+            'max_steps': self.max_steps,
+            'result': self.result,
+            'image_ids': self.image_ids,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -24,6 +24,13 @@ class ImageType(Enum):
 
 class Image(db.Model):
     __tablename__ = 'images'
+    __table_args__ = (
+        # 图片列表按 source / image_type 过滤并按 created_at, id 做游标分页
+        db.Index('ix_images_source_type_created', 'source', 'image_type', 'created_at', 'id'),
+        db.Index('ix_images_created_id', 'created_at', 'id'),
+        # 按类型筛选未参与/未使用的图片，以及按类型批量标记参与
+        db.Index('ix_images_type_participated_used', 'image_type', 'participated', 'used'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
@@ -43,6 +50,36 @@ class Image(db.Model):
         nullable=False
     )
     local_path = db.Column(db.String(500), nullable=True)  # Only used when source is LOCAL_DIR
+    # 实际存在的文件路径，由 ImagePathResolver 维护，避免每次请求都探测候选路径
+    resolved_path = db.Column(db.String(500), nullable=True)
+    # 文件元数据，在上传/扫描/生成时写入，避免序列化时访问文件系统
+    file_size = db.Column(db.BigInteger, nullable=True)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    format = db.Column(db.String(16), nullable=True)
+    file_mtime = db.Column(db.DateTime, nullable=True)
+    # 文件内容的 SHA-256，上传与生成的图片按内容去重存储
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+    # 64 位感知哈希(dHash)，按有符号整数保存，用于查找近似重复的图片
+    phash = db.Column(db.BigInteger, nullable=True)
+    # 由后台线程池提取的图片固有属性：EXIF 方向、主色调 [{color, ratio}]、64 bin 颜色直方图(float32)
+    exif_orientation = db.Column(db.SmallInteger, nullable=True)
+    dominant_colors = db.Column(db.JSON, nullable=True)
+    color_histogram = db.Column(db.LargeBinary, nullable=True)
+    analyzed_at = db.Column(db.DateTime, nullable=True)
+    # 元数据回填时找不到文件的时间，已标记的记录不再重复探测（文件重新入库或内容变化时清空）
+    metadata_probed_at = db.Column(db.DateTime, nullable=True)
+    # 参与/使用状态（原先保存在 variables JSON 中），独立成列以便在 SQL 中筛选与批量更新
+    participated = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    participated_at = db.Column(db.DateTime, nullable=True)
+    used = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    used_at = db.Column(db.DateTime, nullable=True)
+    # 冷存储：归档后文件位于 <ARCHIVE_FOLDER>/<archive_pack> 的 archive_offset 处（见 image_archive），
+    # last_accessed_at 为最近一次请求原图的时间（按天更新），用于判断是否归档
+    archive_pack = db.Column(db.String(32), nullable=True, index=True)
+    archive_offset = db.Column(db.BigInteger, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=True)
+    last_accessed_at = db.Column(db.DateTime, nullable=True)
     
     # 修改关系定义，指定正确的表名
     workflow = db.relationship('Workflow', 
@@ -50,18 +87,6 @@ class Image(db.Model):
                               foreign_keys=[workflow_id])
 
     def to_dict(self):
-        import os
-        
-        # Calculate file size from actual file
-        size = 0
-        for path in [self.local_path, self.file_path]:
-            if path and os.path.isfile(path):
-                try:
-                    size = os.path.getsize(path)
-                    break
-                except:
-                    pass
-        
         return {
             'id': self.id,
             'filename': self.filename,
@@ -73,11 +98,34 @@ class Image(db.Model):
             'source': self.source.value if hasattr(self.source, 'value') else self.source,
             'image_type': self.image_type.value if hasattr(self.image_type, 'value') else self.image_type,
             'local_path': self.local_path,
-            'participated': (self.variables or {}).get('participated', False),
-            'used': (self.variables or {}).get('used', False),
-            'size': size
+            'participated': bool(self.participated),
+            'participated_at': self.participated_at.isoformat() if self.participated_at else None,
+            'used': bool(self.used),
+            'used_at': self.used_at.isoformat() if self.used_at else None,
+            'size': self.file_size or 0,
+            'width': self.width,
+            'height': self.height,
+            'format': self.format,
+            'file_mtime': self.file_mtime.isoformat() if self.file_mtime else None,
+            'content_hash': self.content_hash,
+            'exif_orientation': self.exif_orientation,
+            'dominant_colors': self.dominant_colors,
+            'archived': self.archive_pack is not None,
+            'archived_at': self.archived_at.isoformat() if self.archived_at else None
         }
 
+    def set_participated(self, value: bool):
+        value = bool(value)
+        if value != bool(self.participated):
+            self.participated = value
+            self.participated_at = datetime.utcnow() if value else None
+
+    def set_used(self, value: bool):
+        value = bool(value)
+        if value != bool(self.used):
+            self.used = value
+            self.used_at = datetime.utcnow() if value else None
+
 # 默认目录配置，用于为不同图片类型设置本地扫描目录
 class ImageDefaultLocation(db.Model):
     __tablename__ = 'image_default_locations'
@@ -111,4 +159,25 @@ class DeletedImagePath(db.Model):
             'id': self.id,
             'local_path': self.local_path,
             'deleted_at': self.deleted_at.isoformat() if self.deleted_at else None,
-        }
\ No newline at end of file
+        }
+
+
+# 目录扫描清单：记录每个目录的 mtime 以及其中图片文件的 (size, mtime, inode)，用于增量扫描
+class ImageDirectoryManifest(db.Model):
+    __tablename__ = 'image_directory_manifests'
+
+    id = db.Column(db.Integer, primary_key=True)
+    directory = db.Column(db.String(500), nullable=False, unique=True)
+    mtime_ns = db.Column(db.BigInteger, nullable=False, default=0)
+    # {'dirs': [子目录名], 'files': {文件名: [size, mtime_ns, inode]}}
+    entries = db.Column(db.JSON)
+    scanned_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        entries = self.entries or {}
+        return {
+            'id': self.id,
+            'directory': self.directory,
+            'file_count': len(entries.get('files', {})),
+            'scanned_at': self.scanned_at.isoformat() if self.scanned_at else None,
+        }
@@ -0,0 +1,185 @@
+"""按内容寻址(SHA-256)的图片存储
+
+文件以 <root>/<hash[:2]>/<hash><ext> 保存，相同内容只保留一份。写入时边读边计算哈希，
+先落到同一文件系统上的临时文件，再原子地重命名为最终路径；若该哈希已存在则直接丢弃临时文件。
+需要在其他位置（如默认目录）出现同一文件时，依次尝试硬链接、reflink、符号链接，最后才复制。
+
+注意：硬链接与 blob 共享 inode，在默认目录中原地修改文件也会改变 blob 的内容。
+"""
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from typing import BinaryIO, Optional, Set, Tuple
+
+from app.utils.logger import logger
+from conf import UPLOAD_BLOB_DIR, OUTPUT_BLOB_DIR
+
+_CHUNK_SIZE = 1024 * 1024
+# linux/fs.h: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+
+def _reflink(src: str, dest: str):
+    """写时复制克隆（btrfs/xfs 等），不支持时抛出 OSError"""
+    try:
+        import fcntl
+    except ImportError:  # pragma: no cover - 非 Linux 平台
+        raise OSError('reflink is not supported on this platform')
+    try:
+        with open(src, 'rb') as s, open(dest, 'xb') as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+    except OSError:
+        if os.path.exists(dest):
+            os.remove(dest)
+        raise
+
+
+def link_file(src: str, dest: str) -> str:
+    """让 dest 指向与 src 相同的内容，返回实际使用的方式：hardlink/reflink/symlink/copy"""
+    try:
+        os.link(src, dest)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        _reflink(src, dest)
+        return 'reflink'
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(src), dest)
+        return 'symlink'
+    except OSError:
+        pass
+    shutil.copy2(src, dest)
+    return 'copy'
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob_path(self, content_hash: str, ext: str = '') -> str:
+        ext = ext.lower()
+        if ext and not ext.startswith('.'):
+            ext = '.' + ext
+        return os.path.join(self.root, content_hash[:2], f'{content_hash}{ext}')
+
+    def relative_path(self, path: str) -> str:
+        return os.path.relpath(path, os.path.dirname(self.root)).replace(os.sep, '/')
+
+    def new_tmp_path(self) -> str:
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f'{uuid.uuid4().hex}.tmp')
+
+    def commit_file(self, tmp_path: str, content_hash: str, ext: str) -> Tuple[str, bool]:
+        """把同一文件系统上已写好的文件重命名到最终位置；同一内容已存在时删除该文件"""
+        path = self.blob_path(content_hash, ext)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return path, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return path, True
+
+    def put_stream(self, stream: BinaryIO, ext: str = '') -> Tuple[str, str, bool]:
+        """流式写入并计算哈希
+
+        Returns:
+            (content_hash, blob 路径, 是否为新写入的内容)
+        """
+        digest = hashlib.sha256()
+        tmp_path = self.new_tmp_path()
+        try:
+            with open(tmp_path, 'wb') as out:
+                for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            content_hash = digest.hexdigest()
+            path, created = self.commit_file(tmp_path, content_hash, ext)
+            return content_hash, path, created
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def adopt(self, path: str, content_hash: Optional[str] = None) -> Tuple[str, str]:
+        """把已写在别处（同一文件系统）的文件纳入存储，原路径保留为指向 blob 的硬链接
+
+        内容重复时原文件被替换为已有 blob 的链接，重复内容不再额外占用磁盘空间。
+        写入时已计算过哈希（如流式下载的生成结果）可通过 content_hash 传入，避免再读一遍文件。
+
+        Returns:
+            (content_hash, blob 路径)
+        """
+        content_hash = content_hash or hash_file(path)
+        ext = os.path.splitext(path)[1]
+        blob = self.blob_path(content_hash, ext)
+        if os.path.exists(blob):
+            if not os.path.samefile(blob, path):
+                tmp_path = self.new_tmp_path()
+                try:
+                    link_file(blob, tmp_path)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.lexists(tmp_path):
+                        os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            link_file(path, blob)
+        return content_hash, blob
+
+    def find(self, content_hash: str, ext: str = '') -> Optional[str]:
+        path = self.blob_path(content_hash, ext)
+        return path if os.path.exists(path) else None
+
+    def remove(self, path: str) -> bool:
+        """删除一个 blob（调用方需确认已无记录引用该内容）"""
+        if not os.path.abspath(path).startswith(os.path.abspath(self.root) + os.sep):
+            return False
+        try:
+            os.remove(path)
+            return True
+        except OSError as e:
+            logger.warning(f"Failed to remove blob {path}: {str(e)}")
+            return False
+
+    def prune_unreferenced(self, referenced: Set[str], grace: int = 3600) -> int:
+        """删除内容哈希不在 referenced 中的 blob
+
+        是否仍被引用以数据库记录的 content_hash 为准，不依赖硬链接数（link_file 可能退化为
+        reflink/复制，此时 blob 的链接数为 1 但仍被引用）。最近 grace 秒内写入的 blob 可能属于
+        尚未提交记录的生成任务，跳过不删。
+        """
+        removed = 0
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - grace
+        for dirpath, _, filenames in os.walk(self.root):
+            if os.path.basename(dirpath) == 'tmp':
+                continue
+            for name in filenames:
+                if os.path.splitext(name)[0] in referenced:
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    if os.stat(path).st_ctime > cutoff:
+                        continue
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    continue
+        return removed
+
+upload_blob_store = BlobStore(UPLOAD_BLOB_DIR)
+output_blob_store = BlobStore(OUTPUT_BLOB_DIR)
@@ -0,0 +1,211 @@
+"""可续传的分片上传
+
+每个上传会话在 blob 存储目录下对应 <id>.part（已接收的数据）与 <id>.json（文件名、总大小、
+期望的 SHA-256 等）。分片按 offset 顺序追加写入 .part，已接收的字节数即 .part 的大小，
+因此服务重启后客户端仍可通过查询 offset 续传。.part 与 blob 位于同一文件系统，
+完成后直接重命名为 blob，不再复制整个文件。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from app.utils.blob_store import BlobStore, hash_file, upload_blob_store
+from conf import UPLOAD_SESSION_TTL
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadSessionError(Exception):
+    """分片上传协议错误，status_code 为建议返回的 HTTP 状态码"""
+
+    def __init__(self, message: str, status_code: int = 400, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class ChunkedUploadStore:
+    def __init__(self, blob_store: BlobStore = upload_blob_store, ttl: int = UPLOAD_SESSION_TTL):
+        self.blob_store = blob_store
+        self.root = os.path.join(blob_store.root, 'sessions')
+        self.ttl = ttl
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        # session_id -> (offset, sha256)：进程内增量哈希，避免完成时重新读取整个文件
+        self._digests: Dict[str, Tuple[int, 'hashlib._Hash']] = {}
+
+    def _part_path(self, session_id: str) -> str:
+        return os.path.join(self.root, f'{session_id}.part')
+
+    def _meta_path(self, session_id: str) -> str:
+        return os.path.join(self.root, f'{session_id}.json')
+
+    def _lock(self, session_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(session_id, threading.Lock())
+
+    def create(self, filename: str, size: int, sha256: Optional[str] = None, **extra) -> dict:
+        if size <= 0:
+            raise UploadSessionError('文件大小无效')
+        os.makedirs(self.root, exist_ok=True)
+        self.purge_expired()
+        session_id = uuid.uuid4().hex
+        meta = {
+            'id': session_id,
+            'filename': filename,
+            'size': size,
+            'sha256': sha256.lower() if sha256 else None,
+            'created_at': time.time(),
+            **extra
+        }
+        open(self._part_path(session_id), 'wb').close()
+        with open(self._meta_path(session_id), 'w') as f:
+            json.dump(meta, f)
+        self._digests[session_id] = (0, hashlib.sha256())
+        return {**meta, 'offset': 0}
+
+    def get(self, session_id: str) -> dict:
+        if not session_id.isalnum():
+            raise UploadSessionError('上传会话不存在', 404)
+        try:
+            with open(self._meta_path(session_id)) as f:
+                meta = json.load(f)
+            offset = os.path.getsize(self._part_path(session_id))
+        except (OSError, ValueError):
+            raise UploadSessionError('上传会话不存在', 404)
+        return {**meta, 'offset': offset}
+
+    def write_chunk(self, session_id: str, offset: int, stream: BinaryIO, length: Optional[int],
+                    chunk_sha256: Optional[str] = None) -> int:
+        """把一个分片追加到 offset 处，返回新的 offset
+
+        offset 必须等于已接收的字节数，否则返回 409 与服务端当前的 offset。提供 chunk_sha256
+        时校验分片内容，不一致或数据不完整时丢弃该分片。
+        """
+        with self._lock(session_id):
+            meta = self.get(session_id)
+            current = meta['offset']
+            if offset != current:
+                raise UploadSessionError(f'offset 不匹配，服务端已接收 {current} 字节', 409, current)
+
+            digest_state = self._digests.get(session_id)
+            file_digest = digest_state[1].copy() if digest_state and digest_state[0] == current else None
+            chunk_digest = hashlib.sha256()
+            received = 0
+            part_path = self._part_path(session_id)
+            with open(part_path, 'r+b') as out:
+                out.seek(current)
+                try:
+                    while length is None or received < length:
+                        to_read = _CHUNK_SIZE if length is None else min(_CHUNK_SIZE, length - received)
+                        data = stream.read(to_read)
+                        if not data:
+                            break
+                        received += len(data)
+                        if current + received > meta['size']:
+                            raise UploadSessionError('分片超出文件大小', 416, current)
+                        chunk_digest.update(data)
+                        if file_digest is not None:
+                            file_digest.update(data)
+                        out.write(data)
+                    if length is not None and received != length:
+                        raise UploadSessionError('分片数据不完整', 400, current)
+                    if chunk_sha256 and chunk_digest.hexdigest() != chunk_sha256.lower():
+                        raise UploadSessionError('分片校验失败', 422, current)
+                except UploadSessionError:
+                    # 丢弃本次写入，保持 .part 与上一次成功的 offset 一致
+                    out.truncate(current)
+                    raise
+
+            new_offset = current + received
+            if file_digest is not None:
+                self._digests[session_id] = (new_offset, file_digest)
+            else:
+                self._digests.pop(session_id, None)
+            return new_offset
+
+    def complete(self, session_id: str) -> Tuple[dict, str, str, bool]:
+        """校验整个文件并移入 blob 存储
+
+        Returns:
+            (会话信息, content_hash, blob 路径, 是否为新内容)
+        """
+        with self._lock(session_id):
+            meta = self.get(session_id)
+            if meta['offset'] != meta['size']:
+                raise UploadSessionError(
+                    f"文件尚未上传完成（{meta['offset']}/{meta['size']}）", 409, meta['offset'])
+
+            part_path = self._part_path(session_id)
+            digest_state = self._digests.pop(session_id, None)
+            if digest_state and digest_state[0] == meta['size']:
+                content_hash = digest_state[1].hexdigest()
+            else:
+                # 服务重启后没有增量哈希，重新读取一遍
+                content_hash = hash_file(part_path)
+
+            if meta.get('sha256') and meta['sha256'] != content_hash:
+                self.abort(session_id)
+                raise UploadSessionError('文件校验失败，请重新上传', 422)
+
+            ext = os.path.splitext(meta['filename'])[1]
+            blob_path, created = self.blob_store.commit_file(part_path, content_hash, ext)
+            self._remove_meta(session_id)
+            return meta, content_hash, blob_path, created
+
+    def abort(self, session_id: str):
+        self._digests.pop(session_id, None)
+        for path in (self._part_path(session_id), self._meta_path(session_id)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._locks_guard:
+            self._locks.pop(session_id, None)
+
+    def _remove_meta(self, session_id: str):
+        try:
+            os.remove(self._meta_path(session_id))
+        except OSError:
+            pass
+        with self._locks_guard:
+            self._locks.pop(session_id, None)
+
+    def purge_expired(self) -> int:
+        """删除超过有效期没有任何活动的会话
+
+        最后活动时间取 .part（每次写入分片时更新）与 .json 修改时间中较晚的一个，
+        正在写入分片的会话不会被删除。
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                session_id = entry.name[:-len('.json')]
+                try:
+                    last_active = entry.stat().st_mtime
+                    if os.path.exists(self._part_path(session_id)):
+                        last_active = max(last_active, os.path.getmtime(self._part_path(session_id)))
+                except OSError:
+                    continue
+                if last_active >= cutoff:
+                    continue
+                lock = self._lock(session_id)
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    self.abort(session_id)
+                finally:
+                    lock.release()
+                removed += 1
+        return removed
+
+chunked_upload_store = ChunkedUploadStore()
@@ -0,0 +1,176 @@
+"""基于颜色直方图的相似图片检索
+
+每张图片的 64 bin 颜色直方图（见 image_analysis）组成一个 (N, 64) float32 矩阵常驻内存，
+一次查询即对全部图片做向量化的余弦相似度或 χ² 距离计算，10 万张图片约几十毫秒。
+新图片分析完成后调用 upsert() 增量写入，删除时调用 discard()；只有清空等批量变化才 invalidate() 整体重建。
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.utils.image_analysis import HISTOGRAM_BINS, HISTOGRAM_DTYPE, HISTOGRAM_LEVELS, histogram_from_bytes
+
+METRICS = ('cosine', 'chi2')
+_EPS = 1e-10
+
+
+def histogram_from_colors(colors: Iterable[Tuple[str, float]]) -> Optional[np.ndarray]:
+    """由 [('#rrggbb', 权重)] 构造查询直方图，用于按调色板搜索"""
+    shift = 8 - int(np.log2(HISTOGRAM_LEVELS))
+    hist = np.zeros(HISTOGRAM_BINS, dtype=HISTOGRAM_DTYPE)
+    for color, weight in colors:
+        value = color.lstrip('#')
+        if len(value) != 6:
+            raise ValueError(f'invalid color: {color}')
+        r, g, b = (int(value[i:i + 2], 16) >> shift for i in (0, 2, 4))
+        hist[(r * HISTOGRAM_LEVELS + g) * HISTOGRAM_LEVELS + b] += weight
+    total = hist.sum()
+    return hist / total if total > 0 else None
+
+
+class ColorHistogramIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._count = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._hists = np.empty((0, HISTOGRAM_BINS), dtype=HISTOGRAM_DTYPE)
+        # 行向量的 L2 范数归一化结果，余弦相似度只需一次矩阵-向量乘法
+        self._units = np.empty((0, HISTOGRAM_BINS), dtype=HISTOGRAM_DTYPE)
+        self._position: Dict[int, int] = {}
+
+    def invalidate(self):
+        self._dirty = True
+
+    def _reserve(self, size: int):
+        capacity = self._hists.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 1024)
+        for name in ('_hists', '_units'):
+            grown = np.zeros((capacity, HISTOGRAM_BINS), dtype=HISTOGRAM_DTYPE)
+            grown[:self._count] = getattr(self, name)[:self._count]
+            setattr(self, name, grown)
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._count] = self._ids[:self._count]
+        self._ids = ids
+
+    @staticmethod
+    def _unit(hists: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(hists, axis=-1, keepdims=True)
+        return hists / np.maximum(norms, _EPS)
+
+    def _load(self):
+        from app.extensions import db
+        from app.models.image import Image
+
+        rows = db.session.query(Image.id, Image.color_histogram).filter(
+            Image.color_histogram.isnot(None)).order_by(Image.id).all()
+        self._count = 0
+        self._position = {}
+        self._reserve(len(rows))
+        self._dirty = False
+        self._upsert_locked(rows)
+
+    def _ensure_loaded(self):
+        if self._dirty:
+            self._load()
+
+    def _upsert_locked(self, items):
+        for image_id, value in items:
+            hist = histogram_from_bytes(value)
+            if hist is None:
+                self._discard_locked(image_id)
+                continue
+            pos = self._position.get(image_id)
+            if pos is None:
+                self._reserve(self._count + 1)
+                pos = self._count
+                self._count += 1
+                self._position[image_id] = pos
+                self._ids[pos] = image_id
+            self._hists[pos] = hist
+            self._units[pos] = self._unit(hist)
+
+    def _discard_locked(self, image_id: int):
+        pos = self._position.pop(image_id, None)
+        if pos is None:
+            return
+        last = self._count - 1
+        if pos != last:
+            # 用最后一行填补空位，保持矩阵紧凑
+            moved = int(self._ids[last])
+            self._ids[pos] = moved
+            self._hists[pos] = self._hists[last]
+            self._units[pos] = self._units[last]
+            self._position[moved] = pos
+        self._count = last
+
+    def upsert(self, items: Iterable[Tuple[int, Optional[bytes]]]):
+        """增量写入 [(image_id, color_histogram 字节)]；索引尚未加载时忽略，加载时会从数据库读取"""
+        with self._lock:
+            if not self._dirty:
+                self._upsert_locked(items)
+
+    def discard(self, image_ids: Iterable[int]):
+        with self._lock:
+            if not self._dirty:
+                for image_id in image_ids:
+                    self._discard_locked(image_id)
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return self._count
+
+    def histogram(self, image_id: int) -> Optional[np.ndarray]:
+        with self._lock:
+            self._ensure_loaded()
+            pos = self._position.get(image_id)
+            return None if pos is None else self._hists[pos].copy()
+
+    def search(self, query: np.ndarray, metric: str = 'cosine', limit: int = 50,
+               exclude_ids: Iterable[int] = (), only_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """返回最相近的 limit 个 [(image_id, score)]：cosine 为相似度（降序），chi2 为距离（升序）
+
+        类型、参与状态等过滤由调用方在数据库中求出允许的 only_ids（这些字段变化频繁，不放进索引），
+        在选取前屏蔽其余图片。
+        """
+        if metric not in METRICS:
+            raise ValueError(f'unknown metric: {metric}')
+        query = np.asarray(query, dtype=HISTOGRAM_DTYPE)
+        with self._lock:
+            self._ensure_loaded()
+            n = self._count
+            ids = self._ids[:n]
+            if metric == 'cosine':
+                scores = self._units[:n] @ self._unit(query)
+                keys = -scores
+            else:
+                hists = self._hists[:n]
+                # 原地运算，避免为 (N, 64) 的中间结果反复分配内存
+                diff = hists - query
+                np.square(diff, out=diff)
+                denom = hists + (query + _EPS)
+                np.divide(diff, denom, out=diff)
+                scores = 0.5 * diff.sum(axis=1)
+                keys = scores
+            if only_ids is not None:
+                allowed = np.zeros(n, dtype=bool)
+                allowed[[self._position[i] for i in only_ids if i in self._position]] = True
+                keys = np.where(allowed, keys, np.inf)
+            exclude = [self._position[i] for i in exclude_ids if i in self._position]
+            if exclude:
+                keys = keys.copy() if only_ids is None else keys
+                keys[exclude] = np.inf
+            limit = min(limit, int(np.count_nonzero(keys != np.inf)))
+            if limit <= 0:
+                return []
+            candidates = np.argpartition(keys, limit - 1)[:limit] if limit < n else np.arange(n)
+            order = np.lexsort((ids[candidates], keys[candidates]))
+            candidates = candidates[order]
+            return [(int(ids[i]), float(scores[i])) for i in candidates]
+
+
+color_index = ColorHistogramIndex()
@@ -0,0 +1,37 @@
+"""带有效期的查询总数缓存
+
+列表接口翻页时总数变化不大，按过滤条件缓存 COUNT(*) 的结果，避免每一页都全表计数。
+"""
+import threading
+import time
+from typing import Callable, Dict, Hashable, Tuple
+
+from conf import IMAGE_COUNT_CACHE_TTL
+
+
+class CountCache:
+    def __init__(self, ttl: int = IMAGE_COUNT_CACHE_TTL, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], int]) -> int:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and now - cached[1] < self.ttl:
+                return cached[0]
+        value = compute()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (value, now)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+image_count_cache = CountCache()
@@ -0,0 +1,91 @@
+"""图片文件响应的公共实现
+
+统一生成强 ETag（优先使用内容哈希，否则由 inode/size/mtime 组成）与 Last-Modified，
+由 send_file 的 conditional 处理 If-None-Match / If-Modified-Since（返回 304）以及 Range 请求。
+按内容寻址的路径内容永不改变，使用长期 immutable 缓存；其他路径要求浏览器每次重新验证，
+未变化时只需一次 304 往返。negotiate=True 时按 Accept 返回 WebP/AVIF 衍生文件（见 image_derivatives）。
+"""
+import os
+from typing import Optional
+
+from flask import request, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+from app.utils.image_derivatives import derivative_service, negotiate_format
+from app.utils.logger import logger
+
+# immutable 资源的缓存时间：一年
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def file_etag(st: os.stat_result, content_hash: Optional[str] = None) -> str:
+    if content_hash:
+        return content_hash
+    return f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+
+def is_content_addressed(relative_path: str) -> bool:
+    """blob 存储中的文件（blobs/<2 位前缀>/<sha256>.<ext>）"""
+    return relative_path.replace('\\', '/').startswith('blobs/')
+
+
+def _negotiated_derivative(path: str, st: os.stat_result, content_hash: Optional[str]):
+    """请求原图（下载）或浏览器未声明支持时返回 None"""
+    if request.args.get('original') or request.args.get('download'):
+        return None
+    fmt = negotiate_format(request.accept_mimetypes, derivative_service.formats)
+    if fmt is None:
+        return None
+    try:
+        found = derivative_service.get_or_create(path, st, fmt, content_hash)
+    except Exception as e:
+        logger.warning(f'Failed to build {fmt} derivative for {path}, serving original: {str(e)}')
+        return None
+    return (fmt, *found) if found else None
+
+
+def send_image_file(path: str, mimetype: Optional[str] = None, content_hash: Optional[str] = None,
+                    immutable: bool = False, max_age: Optional[int] = None, negotiate: bool = False):
+    """发送图片文件并附带缓存校验信息
+
+    Args:
+        path: 文件路径
+        mimetype: 缺省时按扩展名推断
+        content_hash: 文件内容的 SHA-256，作为 ETag
+        immutable: URL 与内容一一对应时为 True，浏览器与代理可长期缓存而无需重新验证
+        max_age: 非 immutable 时允许直接使用缓存的秒数，缺省为每次重新验证
+        negotiate: 按 Accept 返回更小的 WebP/AVIF 衍生文件
+    """
+    st = os.stat(path)
+    etag = file_etag(st, content_hash)
+    derivative = _negotiated_derivative(path, st, content_hash) if negotiate else None
+    if derivative:
+        fmt, path, etag = derivative
+        mimetype = derivative_service.mimetype(fmt)
+    response = send_file(
+        path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=etag,
+        last_modified=st.st_mtime,
+        max_age=IMMUTABLE_MAX_AGE if immutable else max_age,
+    )
+    if negotiate:
+        response.vary.add('Accept')
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    elif not max_age:
+        response.cache_control.no_cache = True
+    return response
+
+
+def send_image_from_directory(directory: str, filename: str, **kwargs):
+    """send_from_directory 的替代，防止路径穿越，对 blob 存储中的文件启用 immutable 缓存，并按 Accept 协商格式"""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    kwargs.setdefault('immutable', is_content_addressed(filename))
+    kwargs.setdefault('negotiate', True)
+    return send_image_file(path, **kwargs)
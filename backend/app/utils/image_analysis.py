@@ -0,0 +1,134 @@
+"""图片固有属性的提取（尺寸、格式、EXIF 方向、主色调、颜色直方图、dHash）
+
+analyze_image() 在线程池中执行（Pillow 解码与缩放时释放 GIL）：尺寸、格式与 EXIF 方向只读取文件头；颜色与 dHash 共用一次解码，
+JPEG 通过 draft 在解码阶段直接缩小到约 64px，其他格式解码后缩放到 64x64 再统计。
+结果写入 Image 表后，各处直接读取已保存的元数据，不必再用 Pillow 打开文件。
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+import numpy as np
+from PIL import Image as PILImage
+
+from app.utils.perceptual_hash import DECODE_SIZE, dhash_image, to_signed
+from conf import IMAGE_ANALYSIS_WORKERS
+
+# 颜色直方图：RGB 每个通道分 4 档，共 64 个 bin，L1 归一化后以 float32 字节保存
+HISTOGRAM_LEVELS = 4
+HISTOGRAM_BINS = HISTOGRAM_LEVELS ** 3
+HISTOGRAM_DTYPE = np.float32
+DOMINANT_COLOR_COUNT = 5
+_SAMPLE_SIZE = 64
+_EXIF_ORIENTATION = 0x0112
+
+
+def _opaque_pixels(im: PILImage.Image) -> np.ndarray:
+    """缩放到 _SAMPLE_SIZE 以内后的 RGB 像素 (N, 3)，忽略（近似）透明的像素"""
+    has_alpha = 'A' in im.getbands() or 'transparency' in im.info
+    sample = im.convert('RGBA' if has_alpha else 'RGB')
+    sample.thumbnail((_SAMPLE_SIZE, _SAMPLE_SIZE), PILImage.BILINEAR)
+    pixels = np.asarray(sample, dtype=np.uint8).reshape(-1, 4 if has_alpha else 3)
+    if has_alpha:
+        opaque = pixels[pixels[:, 3] >= 128, :3]
+        pixels = opaque if len(opaque) else pixels[:, :3]
+    return pixels
+
+
+def color_histogram(pixels: np.ndarray) -> np.ndarray:
+    shift = 8 - int(np.log2(HISTOGRAM_LEVELS))
+    q = (pixels >> shift).astype(np.intp)
+    index = (q[:, 0] * HISTOGRAM_LEVELS + q[:, 1]) * HISTOGRAM_LEVELS + q[:, 2]
+    hist = np.bincount(index, minlength=HISTOGRAM_BINS).astype(HISTOGRAM_DTYPE)
+    total = hist.sum()
+    return hist / total if total else hist
+
+
+def dominant_colors(pixels: np.ndarray, count: int = DOMINANT_COLOR_COUNT) -> List[dict]:
+    """用八叉树量化取出占比最高的几种颜色：[{'color': '#rrggbb', 'ratio': 0.42}, ...]"""
+    strip = PILImage.fromarray(pixels.reshape(1, -1, 3), 'RGB')
+    quantized = strip.quantize(colors=count, method=PILImage.Quantize.FASTOCTREE)
+    palette = quantized.getpalette() or []
+    total = pixels.shape[0]
+    colors = []
+    for pixel_count, index in sorted(quantized.getcolors(count) or [], reverse=True):
+        r, g, b = palette[index * 3:index * 3 + 3]
+        colors.append({'color': f'#{r:02x}{g:02x}{b:02x}', 'ratio': round(pixel_count / total, 4)})
+    return colors
+
+
+def analyze_image(path: str) -> Optional[dict]:
+    """提取一张图片的固有属性，无法解码时返回 None（在工作线程中执行）"""
+    try:
+        with PILImage.open(path) as im:
+            width, height = im.size
+            result = {
+                'width': width,
+                'height': height,
+                'format': im.format.lower() if im.format else None,
+                'exif_orientation': int(im.getexif().get(_EXIF_ORIENTATION) or 1),
+            }
+            im.draft('RGB', (DECODE_SIZE, DECODE_SIZE))
+            result['phash'] = to_signed(dhash_image(im))
+            pixels = _opaque_pixels(im)
+        result['dominant_colors'] = dominant_colors(pixels)
+        result['color_histogram'] = color_histogram(pixels).tobytes()
+        return result
+    except Exception:
+        return None
+
+
+def histogram_from_bytes(value: Optional[bytes]) -> Optional[np.ndarray]:
+    if not value:
+        return None
+    hist = np.frombuffer(value, dtype=HISTOGRAM_DTYPE)
+    return hist if hist.shape[0] == HISTOGRAM_BINS else None
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Optional[ThreadPoolExecutor]:
+    """按需创建工作线程池，IMAGE_ANALYSIS_WORKERS=0 时在当前线程执行
+
+    不使用进程池：调度器与 Web 服务都是多线程的，在多线程进程中 fork 子进程可能死锁。
+    """
+    global _executor
+    if IMAGE_ANALYSIS_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(IMAGE_ANALYSIS_WORKERS, thread_name_prefix='image-analysis')
+        return _executor
+
+
+def analyze_paths(paths: Iterable[str]) -> List[Optional[dict]]:
+    """并行分析一批文件，结果与 paths 一一对应"""
+    paths = list(paths)
+    executor = _get_executor()
+    if executor is None or len(paths) <= 1:
+        return [analyze_image(p) for p in paths]
+    return list(executor.map(analyze_image, paths))
+
+
+def stored_formats_by_path(paths: Iterable[str]) -> dict:
+    """按文件路径查询已保存的图片格式（需在 app context 中调用）"""
+    from app.extensions import db
+    from app.models.image import Image
+    from sqlalchemy import or_
+
+    paths = list({p for p in paths if p})
+    if not paths:
+        return {}
+    found = {}
+    rows = db.session.query(Image.resolved_path, Image.local_path, Image.format).filter(
+        Image.format.isnot(None),
+        or_(Image.resolved_path.in_(paths), Image.local_path.in_(paths))
+    )
+    wanted = set(paths)
+    for resolved_path, local_path, fmt in rows:
+        for p in (resolved_path, local_path):
+            if p in wanted:
+                found[p] = fmt
+    return found
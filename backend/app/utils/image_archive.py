@@ -0,0 +1,159 @@
+"""生成图片的冷存储（归档层）
+
+长期未被访问的生成图片从热盘移入归档目录：按图片创建日期每天一个只追加的打包文件
+<ARCHIVE_FOLDER>/<YYYY-MM-DD>.pack，每个成员为 固定长度头 + 压缩后的文件内容；旁边的 .idx 以 JSON lines
+记录每个成员的偏移、原路径与哈希，即使数据库丢失也能据此恢复。Image.archive_pack/archive_offset 指向成员。
+
+成员逐个压缩（zlib，压缩后不更小时原样保存），解压结果与原文件逐字节一致并校验 CRC32。
+打包文件写入后不再修改；其中的成员全部被提升回热盘或删除后，由分层任务删除整个打包文件。
+"""
+import json
+import os
+import struct
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from conf import ARCHIVE_FOLDER, ARCHIVE_COMPRESSION_LEVEL
+
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.idx'
+_MAGIC = b'MWA1'
+# magic, 编码方式, 原始大小, 保存的字节数, 原始内容的 CRC32
+_HEADER = struct.Struct('>4sBQQI')
+CODEC_STORED = 0
+CODEC_ZLIB = 1
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ImageArchive:
+    def __init__(self, root: str = ARCHIVE_FOLDER, level: int = ARCHIVE_COMPRESSION_LEVEL):
+        self.root = root
+        self.level = level
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pack_name(day: date) -> str:
+        return f'{day:%Y-%m-%d}{PACK_SUFFIX}'
+
+    def pack_path(self, name: str) -> str:
+        if os.path.basename(name) != name or not name.endswith(PACK_SUFFIX):
+            raise ArchiveError(f'invalid pack name: {name}')
+        return os.path.join(self.root, name)
+
+    def index_path(self, name: str) -> str:
+        return self.pack_path(name)[:-len(PACK_SUFFIX)] + INDEX_SUFFIX
+
+    def _encode(self, data: bytes) -> Tuple[int, bytes]:
+        compressed = zlib.compress(data, self.level)
+        if len(compressed) < len(data):
+            return CODEC_ZLIB, compressed
+        return CODEC_STORED, data
+
+    def append(self, name: str, members: Iterable[Tuple[int, str, Optional[str]]]) -> List[Tuple[int, int, int]]:
+        """把 [(image_id, 文件路径, content_hash)] 追加到打包文件并 fsync
+
+        Returns:
+            [(image_id, 偏移, 原始大小)]，与成功读取的 members 一一对应（读取失败的文件跳过）
+        """
+        os.makedirs(self.root, exist_ok=True)
+        written = []
+        index_lines = []
+        with self._lock:
+            with open(self.pack_path(name), 'ab') as pack:
+                offset = pack.seek(0, os.SEEK_END)
+                for image_id, path, content_hash in members:
+                    try:
+                        with open(path, 'rb') as f:
+                            data = f.read()
+                    except OSError:
+                        continue
+                    codec, payload = self._encode(data)
+                    pack.write(_HEADER.pack(_MAGIC, codec, len(data), len(payload), zlib.crc32(data)))
+                    pack.write(payload)
+                    written.append((image_id, offset, len(data)))
+                    index_lines.append(json.dumps({
+                        'id': image_id, 'offset': offset, 'size': len(data), 'stored': len(payload),
+                        'path': path, 'content_hash': content_hash
+                    }) + '\n')
+                    offset += _HEADER.size + len(payload)
+                pack.flush()
+                os.fsync(pack.fileno())
+            if index_lines:
+                with open(self.index_path(name), 'a', encoding='utf-8') as index:
+                    index.writelines(index_lines)
+                    index.flush()
+                    os.fsync(index.fileno())
+        return written
+
+    def read(self, name: str, offset: int) -> bytes:
+        with open(self.pack_path(name), 'rb') as pack:
+            pack.seek(offset)
+            header = pack.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ArchiveError(f'truncated member at {name}:{offset}')
+            magic, codec, size, stored, crc = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise ArchiveError(f'bad member header at {name}:{offset}')
+            payload = pack.read(stored)
+        data = zlib.decompress(payload) if codec == CODEC_ZLIB else payload
+        if len(data) != size or zlib.crc32(data) != crc:
+            raise ArchiveError(f'corrupt member at {name}:{offset}')
+        return data
+
+    def restore(self, name: str, offset: int, dest: str, mtime: Optional[datetime] = None) -> str:
+        """解压一个成员写回 dest（先写临时文件并 fsync，再原子替换），可恢复原修改时间"""
+        data = self.read(name, offset)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp_path = f'{dest}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            if mtime is not None:
+                ts = mtime.timestamp()
+                os.utime(tmp_path, (ts, ts))
+            os.replace(tmp_path, dest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return dest
+
+    @contextmanager
+    def extracted(self, name: str, offset: int, suffix: str = '') -> Iterator[str]:
+        """把成员解压到临时文件供一次性读取（如生成缩略图），退出时删除"""
+        tmp_dir = os.path.join(self.root, 'tmp')
+        path = self.restore(name, offset, os.path.join(tmp_dir, f'{uuid.uuid4().hex}{suffix}'))
+        try:
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def pack_names(self) -> List[str]:
+        try:
+            return sorted(n for n in os.listdir(self.root) if n.endswith(PACK_SUFFIX))
+        except OSError:
+            return []
+
+    def remove_pack(self, name: str) -> int:
+        """删除打包文件及其索引，返回释放的字节数"""
+        freed = 0
+        with self._lock:
+            for path in (self.pack_path(name), self.index_path(name)):
+                try:
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+        return freed
+
+
+image_archive = ImageArchive()
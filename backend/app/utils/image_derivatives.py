@@ -0,0 +1,125 @@
+"""按 Accept 协商的全尺寸 WebP/AVIF 衍生文件
+
+浏览器声明支持 image/avif 或 image/webp 时，PNG/JPEG 原图以对应格式重新编码后返回。衍生文件按源内容
+哈希缓存在 <IMAGE_DERIVATIVE_CACHE_DIR>/<format>/<hash[:2]>/<hash>_q<quality>.<ext>，总大小受
+IMAGE_DERIVATIVE_CACHE_MAX_BYTES 限制（LRU 淘汰）。没有 content_hash 的文件以 路径+inode+大小+mtime
+计算键，源文件变化即对应新的衍生文件。下载（?download=1 / ?original=1）与 XHS 上传始终使用原图。
+"""
+import hashlib
+import os
+import uuid
+from typing import Iterable, Optional, Tuple
+
+from PIL import Image as PILImage, ImageOps
+
+from app.utils.logger import logger
+from app.utils.thumbnails import DiskLRUCache
+from conf import (IMAGE_DERIVATIVE_CACHE_DIR, IMAGE_DERIVATIVE_CACHE_MAX_BYTES, IMAGE_DERIVATIVE_FORMATS,
+                  IMAGE_DERIVATIVE_QUALITY, IMAGE_DERIVATIVE_MIN_BYTES)
+
+try:  # Pillow < 11.2 需要 pillow-avif-plugin 才能编码 AVIF
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+_MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+# 只为这些格式生成衍生文件；GIF 可能是动图，WebP/AVIF 本身已经足够小
+_CONVERTIBLE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'}
+
+
+def _encoder_available(fmt: str) -> bool:
+    PILImage.init()
+    return fmt.upper() in PILImage.SAVE
+
+
+def supported_formats(preferred: Iterable[str] = IMAGE_DERIVATIVE_FORMATS) -> list:
+    """按优先顺序返回当前 Pillow 能编码的衍生格式"""
+    return [fmt for fmt in preferred if fmt in _MIMETYPES and _encoder_available(fmt)]
+
+
+def negotiate_format(accept_mimetypes, formats: Iterable[str]) -> Optional[str]:
+    """从 Accept 中选出显式声明支持的第一个格式；只有 */* 时返回 None（保持原图）"""
+    accepted = {value.lower() for value, quality in accept_mimetypes if quality > 0}
+    for fmt in formats:
+        if _MIMETYPES[fmt] in accepted:
+            return fmt
+    return None
+
+
+def render_derivative(source_path: str, dest_path: str, fmt: str, quality: int):
+    """以原尺寸重新编码，先写临时文件再原子替换"""
+    with PILImage.open(source_path) as im:
+        icc_profile = im.info.get('icc_profile')
+        # 原图依赖 EXIF 方向显示，衍生文件不携带 EXIF，因此先转正
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            im = im.convert('RGBA' if 'A' in im.getbands() or 'transparency' in im.info else 'RGB')
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp_path = f'{dest_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            options = {'quality': quality}
+            if icc_profile:
+                options['icc_profile'] = icc_profile
+            if fmt == 'webp':
+                options['method'] = 4
+            im.save(tmp_path, format=fmt.upper(), **options)
+            os.replace(tmp_path, dest_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class DerivativeService:
+    def __init__(self, root: str = IMAGE_DERIVATIVE_CACHE_DIR, max_bytes: int = IMAGE_DERIVATIVE_CACHE_MAX_BYTES,
+                 quality: int = IMAGE_DERIVATIVE_QUALITY, min_bytes: int = IMAGE_DERIVATIVE_MIN_BYTES):
+        self.root = root
+        self.quality = quality
+        self.min_bytes = min_bytes
+        self.cache = DiskLRUCache(root, max_bytes)
+        self._formats = None
+
+    @property
+    def formats(self) -> list:
+        if self._formats is None:
+            self._formats = supported_formats()
+        return self._formats
+
+    @staticmethod
+    def mimetype(fmt: str) -> str:
+        return _MIMETYPES[fmt]
+
+    @staticmethod
+    def source_key(path: str, st: os.stat_result, content_hash: Optional[str] = None) -> str:
+        if content_hash:
+            return content_hash
+        ident = f'{os.path.abspath(path)}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}'
+        return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+    def eligible(self, path: str, st: os.stat_result) -> bool:
+        return (os.path.splitext(path)[1].lower() in _CONVERTIBLE_EXTENSIONS
+                and st.st_size >= self.min_bytes)
+
+    def cache_path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.root, fmt, key[:2], f'{key}_q{self.quality}.{fmt}')
+
+    def get_or_create(self, path: str, st: os.stat_result, fmt: str,
+                      content_hash: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """返回 (衍生文件路径, ETag)；不适用或重新编码后并不更小时返回 None，调用方发送原图"""
+        if not self.eligible(path, st):
+            return None
+        key = self.source_key(path, st, content_hash)
+        dest = self.cache_path(key, fmt)
+        if not self.cache.get(dest):
+            render_derivative(path, dest, fmt, self.quality)
+            self.cache.put(dest)
+            logger.info(f'Built {fmt} derivative for {path}: {st.st_size} -> {os.path.getsize(dest)} bytes')
+        try:
+            if os.path.getsize(dest) >= st.st_size:
+                return None
+        except OSError:
+            return None
+        return dest, f'{key}-{fmt}-q{self.quality}'
+
+
+derivative_service = DerivativeService()
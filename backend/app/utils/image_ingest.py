@@ -0,0 +1,305 @@
+"""基于集合运算的图片批量入库
+
+一次性把已有记录的 local_path / filename / source / image_type 以及 DeletedImagePath
+加载到内存，在 Python 中完成去重与差异计算，再按批次执行 INSERT / UPDATE / DELETE，
+使数据库往返次数只与批次数相关，而与文件数量无关。
+"""
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, update
+
+from app.extensions import db
+from app.models.image import Image, ImageSource, ImageType, DeletedImagePath
+from app.utils.image_paths import image_path_resolver
+from app.utils.color_index import color_index
+from app.utils.image_scanner import scan_directory_incremental
+from app.utils.logger import logger
+from conf import ALLOWED_EXTENSIONS, BASE_PATH
+
+# 每条批量 SQL 语句处理的记录数
+INGEST_CHUNK_SIZE = 500
+
+
+def _chunks(items: List, size: int = INGEST_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class _Row:
+    __slots__ = ('id', 'filename', 'file_path', 'local_path', 'source', 'image_type', 'file_size', 'file_mtime')
+
+    def __init__(self, id, filename, file_path, local_path, source, image_type, file_size=None, file_mtime=None):
+        self.id = id
+        self.filename = filename
+        self.file_path = file_path
+        self.local_path = local_path
+        self.source = source
+        self.image_type = image_type
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+
+
+class IngestIndex:
+    """已有图片记录的内存索引，只查询需要的列，不构造 ORM 对象"""
+
+    def __init__(self):
+        self.by_local_path: Dict[str, _Row] = {}
+        self.local_dir_by_filename: Dict[str, _Row] = {}
+        self.upload_by_filename: Dict[str, List[_Row]] = {}
+        self.deleted_paths = set()
+
+    @classmethod
+    def load(cls) -> 'IngestIndex':
+        index = cls()
+        rows = db.session.query(
+            Image.id, Image.filename, Image.file_path, Image.local_path, Image.source, Image.image_type,
+            Image.file_size, Image.file_mtime
+        ).order_by(Image.id)
+        for r in rows:
+            row = _Row(*r)
+            index._add(row)
+        index.deleted_paths = {p for (p,) in db.session.query(DeletedImagePath.local_path)}
+        return index
+
+    @classmethod
+    def load_uploads(cls, filenames: Iterable[str]) -> 'IngestIndex':
+        """只加载给定文件名的上传记录（按文件名纠正上传记录类型时使用）"""
+        index = cls()
+        for chunk in _chunks(sorted(set(filenames))):
+            rows = db.session.query(
+                Image.id, Image.filename, Image.file_path, Image.local_path, Image.source, Image.image_type,
+                Image.file_size, Image.file_mtime
+            ).filter(Image.source == ImageSource.upload, Image.filename.in_(chunk)).order_by(Image.id)
+            for r in rows:
+                index._add(_Row(*r))
+        return index
+
+    def _add(self, row: _Row):
+        if row.local_path:
+            self.by_local_path.setdefault(row.local_path, row)
+        if row.source == ImageSource.local_dir:
+            self.local_dir_by_filename.setdefault(row.filename, row)
+        elif row.source == ImageSource.upload:
+            self.upload_by_filename.setdefault(row.filename, []).append(row)
+
+
+class IngestResult:
+    def __init__(self):
+        self.added = 0
+        self.updated = 0
+        self.skipped = 0
+        self.removed = 0
+
+
+class ImageIngestor:
+    """收集待写入的变更，最后由 flush() 按批次落库（由调用方负责 commit）"""
+
+    def __init__(self, index: Optional[IngestIndex] = None):
+        self.index = index or IngestIndex.load()
+        self.result = IngestResult()
+        self._inserts: List[dict] = []
+        self._retype: Dict[ImageType, set] = {}
+        self._delete_ids: set = set()
+        self._forget_paths: set = set()
+        self._stat_updates: Dict[int, dict] = {}
+
+    def _retype_row(self, row: _Row, image_type: ImageType):
+        self._retype.setdefault(image_type, set()).add(row.id)
+        row.image_type = image_type
+
+    def _refresh_stat(self, row: _Row, size: Optional[int], mtime: datetime):
+        """文件大小或修改时间变化时更新记录，并清空尺寸、感知哈希与提取的属性，等待元数据回填任务重新读取"""
+        if row.id is None or size is None:
+            return
+        if row.file_size == size and row.file_mtime == mtime:
+            return
+        self._stat_updates[row.id] = {
+            'id': row.id, 'file_size': size, 'file_mtime': mtime,
+            'width': None, 'height': None, 'format': None, 'phash': None, 'analyzed_at': None,
+            'metadata_probed_at': None,
+        }
+        row.file_size = size
+        row.file_mtime = mtime
+
+    def add_scanned_file(self, path: str, mtime: float, image_type: Optional[ImageType] = None,
+                         size: Optional[int] = None):
+        """处理扫描到的一个新增或修改的文件，去重规则与逐条扫描时保持一致"""
+        index = self.index
+        result = self.result
+        mtime_dt = datetime.fromtimestamp(mtime)
+
+        if path in index.deleted_paths:
+            result.skipped += 1
+            return
+
+        existing = index.by_local_path.get(path)
+        if existing:
+            self._refresh_stat(existing, size, mtime_dt)
+            if image_type and existing.image_type != image_type:
+                self._retype_row(existing, image_type)
+                result.updated += 1
+            else:
+                result.skipped += 1
+            return
+
+        filename = os.path.basename(path)
+        duplicate = index.local_dir_by_filename.get(filename)
+        if duplicate:
+            if image_type and duplicate.image_type != image_type:
+                self._retype_row(duplicate, image_type)
+                result.updated += 1
+            else:
+                result.skipped += 1
+            return
+
+        # 同名上传记录只纠正类型，不阻止创建本地目录记录
+        if image_type:
+            for rec in index.upload_by_filename.get(filename, []):
+                if rec.image_type != image_type:
+                    p = (rec.file_path or '').replace('\\', '/').lower()
+                    if 'upload/images/' in p or p.endswith(filename.lower()):
+                        self._retype_row(rec, image_type)
+
+        values = {
+            'filename': filename,
+            'file_path': str(Path(path).relative_to(BASE_PATH)) if path.startswith(str(BASE_PATH)) else path,
+            'source': ImageSource.local_dir,
+            'local_path': path,
+            'resolved_path': path,
+            'image_type': image_type or ImageType.general,
+            'created_at': mtime_dt,
+            'file_size': size,
+            'file_mtime': mtime_dt,
+        }
+        self._inserts.append(values)
+        # 新记录还没有 id，但需要参与后续文件的去重
+        index._add(_Row(None, filename, values['file_path'], path, ImageSource.local_dir, values['image_type']))
+        result.added += 1
+
+    def mark_unchanged(self, files: Iterable[Tuple[str, int, int, int]], image_type: Optional[ImageType] = None):
+        """与清单一致的文件 (path, size, mtime_ns, inode)：指定类型时纠正类型，否则计为跳过
+
+        记录已被删除（如清除本地图片记录）而文件仍在的，按新增文件重新入库；用户删除过的路径除外。
+        """
+        for path, size, mtime_ns, _ino in files:
+            row = self.index.by_local_path.get(path)
+            if row is None:
+                self.add_scanned_file(path, mtime_ns / 1e9, image_type, size)
+            elif image_type and row.id is not None and row.image_type != image_type:
+                self._retype_row(row, image_type)
+                self.result.updated += 1
+            else:
+                self.result.skipped += 1
+
+    def remove_paths(self, paths: Iterable[str]):
+        """磁盘上已不存在的文件：删除对应的本地目录记录"""
+        for path in paths:
+            row = self.index.by_local_path.get(path)
+            if row is not None and row.id is not None and row.source == ImageSource.local_dir:
+                self._delete_ids.add(row.id)
+                self.index.by_local_path.pop(path, None)
+                if self.index.local_dir_by_filename.get(row.filename) is row:
+                    self.index.local_dir_by_filename.pop(row.filename, None)
+
+    def forget_deleted_paths(self, paths: Iterable[str]):
+        """文件已从磁盘消失时，其删除标记也不再需要；之后同一路径出现的新文件会被正常入库"""
+        paths = [p for p in paths if p in self.index.deleted_paths]
+        self._forget_paths.update(paths)
+        self.index.deleted_paths.difference_update(paths)
+
+    def delete_rows(self, ids: Iterable[int]):
+        self._delete_ids.update(ids)
+
+    def retype_rows(self, rows: Iterable[_Row], image_type: ImageType):
+        for row in rows:
+            self._retype_row(row, image_type)
+
+    def flush(self):
+        """按批次执行 DELETE / UPDATE / INSERT"""
+        delete_ids = sorted(self._delete_ids)
+        for chunk in _chunks(delete_ids):
+            db.session.execute(
+                delete(Image).where(Image.id.in_(chunk)).execution_options(synchronize_session=False)
+            )
+        self.result.removed += len(delete_ids)
+        image_path_resolver.invalidate_many(delete_ids)
+        color_index.discard(delete_ids)
+
+        for image_type, ids in self._retype.items():
+            ids = sorted(i for i in ids if i is not None and i not in self._delete_ids)
+            for chunk in _chunks(ids):
+                db.session.execute(
+                    update(Image).where(Image.id.in_(chunk)).values(image_type=image_type)
+                    .execution_options(synchronize_session=False)
+                )
+
+        # 按主键批量更新文件大小/修改时间（executemany，每批一次往返）
+        stat_updates = [v for k, v in sorted(self._stat_updates.items()) if k not in self._delete_ids]
+        for chunk in _chunks(stat_updates):
+            db.session.execute(update(Image), chunk)
+
+        for chunk in _chunks(sorted(self._forget_paths)):
+            db.session.execute(
+                delete(DeletedImagePath).where(DeletedImagePath.local_path.in_(chunk))
+                .execution_options(synchronize_session=False)
+            )
+
+        for chunk in _chunks(self._inserts):
+            db.session.execute(insert(Image), chunk)
+
+        self._inserts = []
+        self._retype = {}
+        self._delete_ids = set()
+        self._forget_paths = set()
+        self._stat_updates = {}
+        return self.result
+
+
+def group_upload_duplicates(index: IngestIndex, filenames: Iterable[str],
+                            image_type: ImageType) -> Tuple[List[int], List[_Row], int]:
+    """按文件名合并重复的上传记录：优先保留已是目标类型的记录，否则保留 id 最大的
+
+    Returns:
+        (待删除的 id 列表, 保留下来的记录, 涉及的上传记录总数)
+    """
+    delete_ids = []
+    targets = []
+    total = 0
+    for name in filenames:
+        group = index.upload_by_filename.get(name)
+        if not group:
+            continue
+        target = next((r for r in group if r.image_type == image_type), None)
+        if target is None:
+            target = max(group, key=lambda r: r.id)
+        delete_ids.extend(r.id for r in group if r.id != target.id)
+        targets.append(target)
+        total += len(group)
+    return delete_ids, targets, total
+
+
+def sync_directory(directory: str, image_type: Optional[ImageType] = None, force: bool = False):
+    """增量扫描目录并把差异批量写入数据库（由调用方负责 commit）
+
+    Returns:
+        (ScanResult, IngestResult)
+    """
+    scan = scan_directory_incremental(directory, ALLOWED_EXTENSIONS, force=force)
+    logger.info(
+        f'Scanning directory: {directory}, found {scan.total_files} image files '
+        f'(added={len(scan.added)}, modified={len(scan.modified)}, removed={len(scan.removed)}, '
+        f'scanned_dirs={scan.scanned_dirs}, reused_dirs={scan.reused_dirs}), '
+        f'type: {image_type}, force_rescan: {force}'
+    )
+
+    # 已有记录与已删除路径一次性加载到内存，在 Python 中去重后批量写入
+    ingestor = ImageIngestor()
+    ingestor.mark_unchanged(sorted(scan.unchanged), image_type)
+    for path, size, mtime_ns, _ino in sorted(scan.added + scan.modified):
+        ingestor.add_scanned_file(path, mtime_ns / 1e9, image_type, size)
+    # 已从磁盘删除的文件：移除对应的本地目录记录
+    ingestor.remove_paths(scan.removed)
+    return scan, ingestor.flush()
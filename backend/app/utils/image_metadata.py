@@ -0,0 +1,43 @@
+"""图片文件元数据（大小、修改时间、尺寸、格式）的读取"""
+import os
+from datetime import datetime
+from typing import Optional
+
+from PIL import Image as PILImage
+
+
+def read_dimensions(path: str) -> dict:
+    """只解析文件头获取尺寸与格式，不解码像素数据"""
+    try:
+        with PILImage.open(path) as im:
+            return {
+                'width': im.width,
+                'height': im.height,
+                'format': im.format.lower() if im.format else None,
+            }
+    except Exception:
+        return {'width': None, 'height': None, 'format': None}
+
+
+def read_file_metadata(path: str, stat_result: Optional[os.stat_result] = None,
+                       with_dimensions: bool = True) -> dict:
+    """读取写入 Image 表的文件元数据，stat_result 可复用调用方已有的 stat 结果"""
+    st = stat_result or os.stat(path)
+    meta = {
+        'file_size': st.st_size,
+        'file_mtime': datetime.fromtimestamp(st.st_mtime),
+    }
+    if with_dimensions:
+        meta.update(read_dimensions(path))
+    return meta
+
+
+def apply_file_metadata(image, path: str) -> bool:
+    """把 path 对应文件的元数据写到 Image 对象上，文件不存在时返回 False"""
+    try:
+        meta = read_file_metadata(path)
+    except OSError:
+        return False
+    for key, value in meta.items():
+        setattr(image, key, value)
+    return True
@@ -0,0 +1,139 @@
+"""图片记录到磁盘文件路径的推导
+
+ImagePathResolver 按 进程内 LRU(id -> path) -> Image.resolved_path -> 逐个探测候选路径 的顺序解析，
+探测到的结果会写回 resolved_path，之后的请求只需一次字典查找。已归档（冷存储）的图片在解析时
+先解压回热盘，所有需要原图文件的调用方都通过 resolve 获取路径。
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+from conf import UPLOAD_FOLDER, OUTPUT_FOLDER, BASE_PATH, IMAGE_PATH_CACHE_SIZE
+
+
+def candidate_paths(local_path: Optional[str], file_path: Optional[str]) -> List[str]:
+    """按优先级列出一条图片记录可能对应的磁盘路径"""
+    paths = []
+    # 1. local_path 通常最准确（local_dir 来源，或上传时复制到默认目录的文件）
+    if local_path:
+        paths.append(local_path)
+
+    # 2. file_path
+    if file_path:
+        normalized = file_path.replace('\\', '/')
+        filename = os.path.basename(normalized)
+        if normalized.startswith('/uploads/'):
+            paths.append(os.path.join(UPLOAD_FOLDER, normalized[len('/uploads/'):]))
+        elif normalized.startswith('/output/'):
+            paths.append(os.path.join(OUTPUT_FOLDER, normalized[len('/output/'):]))
+        elif os.path.isabs(file_path):
+            paths.append(file_path)
+        else:
+            # Relative path - try as-is, then common directories
+            paths.append(file_path)
+            paths.append(os.path.join(str(BASE_PATH), file_path))
+            if normalized != filename:
+                paths.append(os.path.join(UPLOAD_FOLDER, file_path))
+                paths.append(os.path.join(OUTPUT_FOLDER, file_path))
+            paths.append(os.path.join(UPLOAD_FOLDER, filename))
+            paths.append(os.path.join(OUTPUT_FOLDER, filename))
+    return paths
+
+
+def find_existing_path(local_path: Optional[str], file_path: Optional[str]) -> Optional[str]:
+    """返回第一个存在的候选路径"""
+    for path in candidate_paths(local_path, file_path):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+
+class ImagePathResolver:
+    def __init__(self, max_entries: int = IMAGE_PATH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache: 'OrderedDict[int, str]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, image_id: int, path: str):
+        with self._lock:
+            self._cache[image_id] = path
+            self._cache.move_to_end(image_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def resolve(self, image, verify: bool = True) -> Optional[str]:
+        """返回图片文件的实际路径
+
+        verify=False 时信任缓存与 resolved_path，不再 stat（调用方在打开文件失败后应
+        invalidate 并以 verify=True 重试）。已归档的图片先提升回热盘，提升失败时返回 None。
+        """
+        if getattr(image, 'archive_pack', None) is not None:
+            return self._promote(image)
+
+        if image.id is not None:
+            with self._lock:
+                cached = self._cache.get(image.id)
+                if cached is not None:
+                    self._cache.move_to_end(image.id)
+            if cached is not None and (not verify or os.path.isfile(cached)):
+                return cached
+
+        path = image.resolved_path
+        if not path or (verify and not os.path.isfile(path)):
+            path = find_existing_path(image.local_path, image.file_path)
+            if path and path != image.resolved_path:
+                self._persist(image, path)
+        if path and image.id is not None:
+            self._remember(image.id, path)
+        return path
+
+    def _promote(self, image) -> Optional[str]:
+        from app.image_jobs import promote_archived_image
+        from app.utils.logger import logger
+
+        try:
+            path = promote_archived_image(image)
+        except Exception as e:
+            logger.error(f'Failed to promote archived image {image.id}: {str(e)}')
+            return None
+        if path and image.id is not None:
+            self._remember(image.id, path)
+        return path
+
+    @staticmethod
+    def _persist(image, path: str):
+        """在独立连接上写回 resolved_path，不提交（也不回滚）调用方的会话"""
+        from sqlalchemy import update
+        from sqlalchemy.orm.attributes import set_committed_value
+        from app.extensions import db
+        from app.models.image import Image
+        from app.utils.logger import logger
+
+        if image.id is None:
+            image.resolved_path = path
+            return
+        # 作为已提交的值写入实例，调用方会话不会因此变脏
+        set_committed_value(image, 'resolved_path', path)
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(update(Image).where(Image.id == image.id).values(resolved_path=path))
+        except Exception as e:
+            logger.warning(f'Failed to persist resolved path for image {image.id}: {str(e)}')
+
+    def invalidate(self, image_id: int):
+        with self._lock:
+            self._cache.pop(image_id, None)
+
+    def invalidate_many(self, image_ids: Iterable[int]):
+        with self._lock:
+            for image_id in image_ids:
+                self._cache.pop(image_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+image_path_resolver = ImagePathResolver()
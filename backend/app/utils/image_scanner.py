@@ -0,0 +1,127 @@
+"""基于目录清单(manifest)的增量图片扫描
+
+每个目录保存一条 ImageDirectoryManifest，记录目录自身的 mtime 以及目录下图片文件的
+(size, mtime_ns, inode)。重新扫描时只对 mtime 发生变化的目录执行 scandir/stat，
+未变化的目录直接复用清单，最终只返回新增、修改、删除的文件。
+
+注意：原地覆盖写入文件不会改变所在目录的 mtime，这类修改只有在 force=True 时才能发现。
+force=True 时所有目录都重新 scandir/stat，且不与清单比较，已有文件全部按修改处理。
+"""
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import or_
+
+from app.extensions import db
+from app.models.image import ImageDirectoryManifest
+from app.utils.image_walker import list_directory, normalize_extensions, walk_directories
+
+# (path, size, mtime_ns, inode)
+FileStat = Tuple[str, int, int, int]
+
+
+class ScanResult:
+    """一次增量扫描的差异结果"""
+
+    def __init__(self):
+        self.added: List[FileStat] = []
+        self.modified: List[FileStat] = []
+        self.removed: List[str] = []
+        self.unchanged: List[FileStat] = []
+        self.scanned_dirs = 0   # 实际执行了 scandir 的目录数
+        self.reused_dirs = 0    # 直接复用清单的目录数
+
+    @property
+    def total_files(self) -> int:
+        return len(self.added) + len(self.modified) + len(self.unchanged)
+
+
+def normalize_directory(directory: str) -> str:
+    """与历史扫描保持一致的目录表示（local_path 基于 str(Path(...)) 生成）"""
+    return str(Path(directory))
+
+
+def _load_manifests(root: str) -> Dict[str, ImageDirectoryManifest]:
+    prefix = root.rstrip(os.sep) + os.sep
+    rows = ImageDirectoryManifest.query.filter(or_(
+        ImageDirectoryManifest.directory == root,
+        ImageDirectoryManifest.directory.like(f'{prefix}%')
+    )).all()
+    # LIKE 中的 _ 与 % 是通配符，这里再做一次精确前缀过滤
+    return {r.directory: r for r in rows if r.directory == root or r.directory.startswith(prefix)}
+
+
+def scan_directory_incremental(directory: str, extensions, force: bool = False) -> ScanResult:
+    """增量扫描目录树，并在当前 session 中更新清单（由调用方负责 commit）
+
+    目录的 stat/scandir 在线程池中并行执行，数据库读写只在调用线程中进行。
+
+    Args:
+        directory: 扫描根目录
+        extensions: 允许的扩展名集合（不区分大小写，不含点）
+        force: 为 True 时忽略已有清单，对所有目录重新 scandir/stat，所有文件都按新增或修改返回
+    """
+    root = normalize_directory(directory)
+    exts = normalize_extensions(extensions)
+    manifests = _load_manifests(root)
+    # 工作线程只读取这份快照，不接触 ORM 对象
+    snapshot = {path: (m.mtime_ns, m.entries or {}) for path, m in manifests.items()}
+    result = ScanResult()
+    visited = set()
+
+    def visit(current):
+        dir_mtime = os.stat(current).st_mtime_ns
+        cached = snapshot.get(current)
+        if cached and not force and cached[0] == dir_mtime:
+            # 目录未变化：复用清单，不再 stat 其中的文件
+            entries = cached[1]
+            subdirs = [os.path.join(current, d) for d in entries.get('dirs', [])]
+            return subdirs, (dir_mtime, None, None)
+        subdirs, files = list_directory(current, exts)
+        listing = {}
+        for entry in files:
+            st = entry.stat()
+            listing[entry.name] = [st.st_size, st.st_mtime_ns, st.st_ino]
+        return subdirs, (dir_mtime, [os.path.basename(d) for d in subdirs], listing)
+
+    for current, (dir_mtime, dir_names, files) in walk_directories(root, visit):
+        visited.add(current)
+        manifest: Optional[ImageDirectoryManifest] = manifests.get(current)
+        old_entries = (manifest.entries or {}) if manifest else {}
+        old_files = old_entries.get('files', {})
+
+        if files is None:
+            result.reused_dirs += 1
+            result.unchanged.extend((os.path.join(current, name), *stat) for name, stat in old_files.items())
+            continue
+        result.scanned_dirs += 1
+
+        for name, stat in files.items():
+            path = os.path.join(current, name)
+            previous = old_files.get(name)
+            if previous is None:
+                result.added.append((path, *stat))
+            elif force or list(previous) != stat:
+                result.modified.append((path, *stat))
+            else:
+                result.unchanged.append((path, *stat))
+        for name in old_files:
+            if name not in files:
+                result.removed.append(os.path.join(current, name))
+
+        if manifest is None:
+            manifest = ImageDirectoryManifest(directory=current)
+            db.session.add(manifest)
+        manifest.mtime_ns = dir_mtime
+        manifest.entries = {'dirs': dir_names, 'files': files}
+
+    # 已经不存在的目录：其中的文件全部视为删除
+    for path, manifest in manifests.items():
+        if path in visited:
+            continue
+        for name in (manifest.entries or {}).get('files', {}):
+            result.removed.append(os.path.join(path, name))
+        db.session.delete(manifest)
+
+    return result
@@ -0,0 +1,186 @@
+"""上传图片入库的公共逻辑
+
+单文件上传、批量上传与分片上传都先把内容写入 blob 存储，再由 register_upload() 在当前 session 中
+创建或复用 Image 记录（由调用方负责 commit），提交后调用 finish_uploads() 失效缓存并释放被替换的旧内容。
+"""
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from app.extensions import db
+from app.models.image import Image, ImageSource, ImageType, ImageDefaultLocation
+from app.utils.blob_store import upload_blob_store, link_file
+from app.utils.image_metadata import apply_file_metadata
+from app.utils.image_paths import find_existing_path, image_path_resolver
+from app.utils.logger import logger
+from app.utils.thumbnails import thumbnail_service
+from conf import ALLOWED_EXTENSIONS, UPLOAD_FOLDER
+
+
+def allowed_file(filename):
+    return '.' in filename and \
+           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def parse_image_type(value: Optional[str]) -> ImageType:
+    """按枚举值解析图片类型，无法识别时使用 general"""
+    try:
+        return ImageType(value or 'general')
+    except ValueError:
+        return ImageType.general
+
+
+def pasted_filename(mimetype: Optional[str]) -> str:
+    """为粘贴的图片（没有文件名）生成唯一文件名"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    ext = mimetype.split('/')[-1] if mimetype and '/' in mimetype else 'png'
+    return f'pasted_{timestamp}_{uuid.uuid4().hex}.{ext}'
+
+
+def content_hash_in_use(content_hash: str, exclude_id: Optional[int] = None) -> bool:
+    query = Image.query.filter(Image.content_hash == content_hash)
+    if exclude_id is not None:
+        query = query.filter(Image.id != exclude_id)
+    return db.session.query(query.exists()).scalar()
+
+
+def release_upload_blob(path: Optional[str], content_hash: Optional[str]):
+    """上传记录不再引用某个文件时将其删除；按内容存储的 blob 仅在没有其他记录引用时删除"""
+    if not path:
+        return
+    if content_hash is None:
+        # 引入内容寻址存储之前的上传文件（UPLOAD_FOLDER/<filename>，或已迁移到日期分片目录），
+        # 行为与原先覆盖写入一致
+        upload_root = os.path.abspath(UPLOAD_FOLDER)
+        if os.path.abspath(path).startswith(upload_root + os.sep):
+            os.remove(path)
+        return
+    if not content_hash_in_use(content_hash):
+        upload_blob_store.remove(path)
+
+
+class UploadOutcome:
+    def __init__(self, image: Image, duplicate: bool, local_path: Optional[str], replaced_blob=None,
+                 previous_type: Optional[ImageType] = None):
+        self.image = image
+        self.duplicate = duplicate
+        self.local_path = local_path
+        self.replaced_blob = replaced_blob  # (旧文件路径, 旧 content_hash)，提交后释放
+        self.previous_type = previous_type  # 重复上传改变了已有记录的类型时为原类型
+
+    def to_dict(self) -> dict:
+        message = '图片已存在' if self.duplicate else '图片上传成功'
+        if self.previous_type is not None:
+            message += f'，类型已由 {self.previous_type.value} 改为 {self.image.image_type.value}'
+        return {
+            'message': message + (' (已保存到默认目录)' if self.local_path else ''),
+            'image': self.image.to_dict(),
+            'duplicate': self.duplicate,
+            'previous_image_type': self.previous_type.value if self.previous_type is not None else None
+        }
+
+
+def _link_to_default_location(blob_path: str, filename: str, default_dir: str) -> Optional[str]:
+    """默认目录中放置指向 blob 的链接，而不是完整复制一份"""
+    try:
+        os.makedirs(default_dir, exist_ok=True)
+
+        dest_path = os.path.join(default_dir, filename)
+        # If file already exists, add timestamp to make it unique
+        if os.path.lexists(dest_path):
+            name, ext = os.path.splitext(filename)
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            dest_path = os.path.join(default_dir, f"{name}_{timestamp}{ext}")
+
+        method = link_file(blob_path, dest_path)
+        logger.info(f"File linked to default location ({method}): {dest_path}")
+        return dest_path
+    except Exception as e:
+        logger.error(f"Failed to link file to default location: {str(e)}")
+        return None
+
+
+def register_upload(filename: str, content_hash: str, blob_path: str, image_type: ImageType,
+                    default_locations: Optional[Dict[ImageType, Optional[str]]] = None) -> UploadOutcome:
+    """为已写入 blob 存储的上传内容创建或复用 Image 记录（不提交）
+
+    Args:
+        default_locations: 批量上传时复用的 {图片类型: 默认目录} 缓存
+    """
+    if default_locations is None:
+        default_locations = {}
+    if image_type not in default_locations:
+        location = ImageDefaultLocation.query.filter_by(image_type=image_type.value).first()
+        default_locations[image_type] = location.directory if location and location.directory else None
+
+    file_path = f'/uploads/{upload_blob_store.relative_path(blob_path)}'
+
+    # 内容完全相同的上传直接复用已有记录
+    duplicate = Image.query.filter_by(source=ImageSource.upload, content_hash=content_hash).first()
+
+    local_path = duplicate.local_path if duplicate else None
+    if local_path and not os.path.exists(local_path):
+        local_path = None
+    if not local_path and default_locations[image_type]:
+        local_path = _link_to_default_location(blob_path, filename, default_locations[image_type])
+
+    if duplicate:
+        logger.info(f"Identical content already uploaded as image {duplicate.id}, reusing record")
+        previous_type = duplicate.image_type if duplicate.image_type != image_type else None
+        if previous_type is not None:
+            logger.info(f"Image {duplicate.id} re-typed from {previous_type.value} to {image_type.value} "
+                        f"by a duplicate upload")
+        duplicate.image_type = image_type
+        duplicate.local_path = local_path
+        duplicate.resolved_path = local_path or blob_path
+        return UploadOutcome(duplicate, True, local_path, previous_type=previous_type)
+
+    replaced_blob = None
+    # For uploaded files with duplicate names (not pasted), update existing record
+    existing = Image.query.filter_by(source=ImageSource.upload, filename=filename).first()
+    if existing and not filename.startswith('pasted_'):
+        logger.info(f"Updating existing image record for {filename}")
+        if existing.content_hash != content_hash:
+            replaced_blob = (find_existing_path(None, existing.file_path), existing.content_hash)
+        existing.file_path = file_path
+        existing.content_hash = content_hash
+        existing.phash = None
+        existing.analyzed_at = None
+        existing.metadata_probed_at = None
+        existing.resolved_path = local_path or blob_path
+        existing.image_type = image_type
+        existing.local_path = local_path
+        image = existing
+    else:
+        logger.info(f"Creating new image record for {filename} with type {image_type}")
+        image = Image(
+            filename=filename,
+            file_path=file_path,
+            source=ImageSource.upload,
+            image_type=image_type,
+            local_path=local_path,
+            resolved_path=local_path or blob_path,
+            content_hash=content_hash
+        )
+        db.session.add(image)
+    apply_file_metadata(image, blob_path)
+    return UploadOutcome(image, False, local_path, replaced_blob)
+
+
+def finish_uploads(outcomes: Iterable[UploadOutcome]) -> List[int]:
+    """事务提交后：失效缓存、释放被替换的旧内容
+
+    Returns:
+        新内容的图片 id，调用方据此安排感知哈希与缩略图任务
+    """
+    new_ids = []
+    for outcome in outcomes:
+        image_path_resolver.invalidate(outcome.image.id)
+        if outcome.replaced_blob:
+            # 同名文件被新内容覆盖，旧内容若已无引用则删除
+            release_upload_blob(*outcome.replaced_blob)
+        if not outcome.duplicate:
+            thumbnail_service.invalidate(outcome.image.id)
+            new_ids.append(outcome.image.id)
+    return new_ids
@@ -0,0 +1,134 @@
+"""并行的单次遍历文件系统工具
+
+每个目录只 scandir 一次，子目录作为独立任务提交到线程池并行遍历；扩展名匹配不区分大小写。
+返回的 os.DirEntry 已经在工作线程中调用过 stat()，结果被 DirEntry 缓存，调用方再次
+entry.stat() 不会产生额外的系统调用。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
+
+from conf import SCAN_WORKERS
+
+T = TypeVar('T')
+
+
+def normalize_extensions(extensions: Optional[Iterable[str]]) -> Optional[Set[str]]:
+    if extensions is None:
+        return None
+    return {e.lower().lstrip('.') for e in extensions}
+
+
+def has_extension(name: str, extensions: Optional[Set[str]]) -> bool:
+    if extensions is None:
+        return True
+    return '.' in name and name.rsplit('.', 1)[1].lower() in extensions
+
+
+def list_directory(directory: str, extensions: Optional[Set[str]] = None) -> Tuple[List[str], List[os.DirEntry]]:
+    """scandir 一个目录，返回 (子目录路径列表, 匹配扩展名且已 stat 过的文件 DirEntry 列表)"""
+    dirs = []
+    files = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file() and has_extension(entry.name, extensions):
+                    entry.stat()  # 预先 stat，结果缓存在 DirEntry 上
+                    files.append(entry)
+            except OSError:
+                # 遍历过程中文件被删除或无权限，忽略即可
+                continue
+    return dirs, files
+
+
+def walk_directories(root: str, visit: Callable[[str], Tuple[List[str], T]],
+                     max_workers: Optional[int] = None) -> Iterator[Tuple[str, T]]:
+    """并行遍历目录树
+
+    visit(directory) 在线程池中执行，返回 (需要继续遍历的子目录列表, 该目录的结果)；
+    本函数按完成顺序 yield (directory, 结果)。visit 抛出 OSError 的目录会被跳过。
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or SCAN_WORKERS) as executor:
+        pending = {executor.submit(visit, root): root}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = pending.pop(future)
+                try:
+                    subdirs, result = future.result()
+                except OSError:
+                    continue
+                for sub in subdirs:
+                    pending[executor.submit(visit, sub)] = sub
+                yield directory, result
+
+
+def iter_image_files(root: str, extensions: Optional[Iterable[str]] = None, recursive: bool = True,
+                     max_workers: Optional[int] = None) -> Iterator[os.DirEntry]:
+    """遍历目录（默认递归）下所有匹配扩展名的文件，extensions 为 None 时返回全部文件"""
+    exts = normalize_extensions(extensions)
+
+    if not recursive:
+        try:
+            _, files = list_directory(root, exts)
+        except OSError:
+            return
+        yield from files
+        return
+
+    def visit(directory):
+        return list_directory(directory, exts)
+
+    for _, files in walk_directories(root, visit, max_workers):
+        yield from files
+
+
+def existing_files(directories: Iterable[str], max_workers: Optional[int] = None) -> Set[str]:
+    """并行列出若干目录（不递归），返回其中所有文件的路径集合，用于代替逐个 os.path.isfile"""
+    directories = list(directories)
+    if not directories:
+        return set()
+
+    def visit(directory):
+        paths = []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            paths.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return paths
+
+    found = set()
+    with ThreadPoolExecutor(max_workers=max_workers or SCAN_WORKERS) as executor:
+        for paths in executor.map(visit, directories):
+            found.update(paths)
+    return found
+
+
+class DirectoryListing:
+    """按需列出目录并缓存结果：分批处理大量记录时，每个目录在整个任务中只 scandir 一次"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self._listed: Set[str] = set()
+        self._files: Set[str] = set()
+
+    def prefetch(self, paths: Iterable[str]):
+        """列出 paths 所在的、尚未列出过的目录"""
+        directories = {os.path.dirname(p) for p in paths} - self._listed
+        if directories:
+            self._files.update(existing_files(directories, self.max_workers))
+            self._listed.update(directories)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._files
+
+    def discard(self, path: str):
+        self._files.discard(path)
@@ -0,0 +1,101 @@
+"""后台任务的进度登记
+
+接口启动耗时操作后立即返回 job id，前端通过 GET /api/images/jobs/<id> 轮询进度。
+进度只保存在进程内存中，保留最近 MAX_FINISHED_JOBS 个已结束的任务。
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+MAX_FINISHED_JOBS = 100
+
+
+class JobProgress:
+    def __init__(self, kind: str, total: Optional[int] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'pending'  # pending / running / done / failed
+        self.processed = 0
+        self.total = total
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def to_dict(self) -> dict:
+        percent = None
+        if self.total:
+            percent = round(min(self.processed / self.total, 1.0) * 100, 1)
+        elif self.status == 'done':
+            percent = 100.0
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'processed': self.processed,
+            'total': self.total,
+            'percent': percent,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobRegistry:
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._jobs: 'OrderedDict[str, JobProgress]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, kind: str, total: Optional[int] = None) -> JobProgress:
+        job = JobProgress(kind, total)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        return job
+
+    def get(self, job_id: str) -> Optional[JobProgress]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self, kind: str) -> Optional[JobProgress]:
+        """同类任务中尚未结束的一个（用于避免重复启动）"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.kind == kind and not job.finished:
+                    return job
+        return None
+
+    def start(self, job: JobProgress, total: Optional[int] = None):
+        job.status = 'running'
+        if total is not None:
+            job.total = total
+
+    def advance(self, job: JobProgress, count: int = 1):
+        with self._lock:
+            job.processed += count
+
+    def finish(self, job: JobProgress, result=None):
+        job.result = result
+        job.status = 'done'
+        job.finished_at = time.time()
+
+    def fail(self, job: JobProgress, error: str):
+        job.error = error
+        job.status = 'failed'
+        job.finished_at = time.time()
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+
+job_registry = JobRegistry()
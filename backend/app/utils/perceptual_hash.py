@@ -0,0 +1,206 @@
+"""感知哈希(dHash)与基于汉明距离的近似重复检索
+
+每张图片计算 64 位 dHash，以有符号 BIGINT 保存在 Image.phash 中。检索时把全部哈希加载为
+NumPy uint64 数组，按位异或后统计置位数即可一次向量化地得到与所有图片的汉明距离。
+"""
+import threading
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+HASH_BITS = 64
+# 分组报告允许的最大汉明距离：不超过 7 时每段只需枚举翻转 0~1 位，10 万张图片可在 1 秒内完成
+MAX_GROUP_DISTANCE = 7
+# 分组时把 64 位哈希切分的段数
+_SEGMENTS = 4
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+# 解码时的最小尺寸：JPEG 可按比例缩小解码，与 image_analysis 共用同一次解码结果
+DECODE_SIZE = 64
+
+
+def dhash_image(im: PILImage.Image, hash_size: int = 8) -> int:
+    """对已打开（可能已 draft 缩小解码）的图片计算差值哈希"""
+    im = im.convert('L').resize((hash_size + 1, hash_size), PILImage.LANCZOS)
+    pixels = np.asarray(im, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(path: str, hash_size: int = 8) -> int:
+    """差值哈希：缩放为 (hash_size+1) x hash_size 灰度图，逐行比较相邻像素"""
+    with PILImage.open(path) as im:
+        im.draft('RGB', (DECODE_SIZE, DECODE_SIZE))
+        return dhash_image(im, hash_size)
+
+
+def to_signed(value: int) -> int:
+    """uint64 -> int64，便于存入 BIGINT 列"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    as_bytes = values.view(np.uint8).reshape(values.shape + (8,))
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        root = parent.setdefault(x, x)
+        while root != parent[root]:
+            root = parent[root]
+        while x != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+class PerceptualHashIndex:
+    """全部图片 dHash 的内存索引，数据库中的哈希变化后调用 invalidate()，下次查询时重建"""
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self._position: Dict[int, int] = {}
+        self._group_cache: Dict[tuple, List[List[int]]] = {}
+        self._lock = threading.Lock()
+        self._dirty = True
+
+    def invalidate(self):
+        self._dirty = True
+
+    def _load(self):
+        from app.extensions import db
+        from app.models.image import Image
+
+        rows = db.session.query(Image.id, Image.phash).filter(
+            Image.phash.isnot(None)).order_by(Image.id).all()
+        self.ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        # 有符号 int64 按位重解释为 uint64
+        self.hashes = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows)).view(np.uint64)
+        self._position = {int(i): n for n, i in enumerate(self.ids)}
+        self._group_cache = {}
+        self._dirty = False
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._dirty:
+                self._load()
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self.ids)
+
+    def distances(self, value: int) -> np.ndarray:
+        self._ensure_loaded()
+        return popcount(self.hashes ^ np.uint64(to_unsigned(value)))
+
+    def search(self, value: int, max_distance: int, limit: int = 50,
+               exclude_id: Optional[int] = None) -> List[Tuple[int, int]]:
+        """返回 [(image_id, distance)]，按距离、id 升序"""
+        dist = self.distances(value)
+        hits = np.nonzero(dist <= max_distance)[0]
+        if exclude_id is not None:
+            hits = hits[self.ids[hits] != exclude_id]
+        order = np.lexsort((self.ids[hits], dist[hits]))[:limit]
+        hits = hits[order]
+        return [(int(self.ids[i]), int(dist[i])) for i in hits]
+
+    def groups(self, max_distance: int, candidate_ids: Optional[np.ndarray] = None) -> List[List[int]]:
+        """把汉明距离不超过 max_distance 的图片合并为组（传递闭包），只返回成员数 >= 2 的组
+
+        先合并哈希完全相同的图片，再按鸽巢原理把 64 位切成 4 段 16 位：距离不超过 d 的两个哈希
+        至少有一段相差不超过 d // 4 位。对每段枚举翻转至多 d // 4 位后的取值，按段值直接定位
+        候选，最后向量化地校验真实距离。
+        """
+        self._ensure_loaded()
+        max_distance = max(0, min(int(max_distance), MAX_GROUP_DISTANCE))
+        cache_key = (max_distance, None if candidate_ids is None else tuple(sorted(candidate_ids)))
+        cached = self._group_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        ids, hashes = self.ids, self.hashes
+        if candidate_ids is not None:
+            mask = np.isin(ids, candidate_ids)
+            ids, hashes = ids[mask], hashes[mask]
+        if len(ids) < 2:
+            return []
+
+        unique, inverse = np.unique(hashes, return_inverse=True)
+        uf = _UnionFind()
+        if max_distance > 0:
+            for left, right in self._close_pairs(unique, max_distance):
+                for a, b in zip(left.tolist(), right.tolist()):
+                    uf.union(a, b)
+
+        roots = np.arange(len(unique))
+        for node in list(uf.parent):
+            roots[node] = uf.find(node)
+        member_roots = roots[inverse.ravel()]
+        order = np.argsort(member_roots, kind='stable')
+        sorted_roots = member_roots[order]
+        run_starts = np.flatnonzero(np.r_[True, sorted_roots[1:] != sorted_roots[:-1]])
+        run_ends = np.r_[run_starts[1:], len(sorted_roots)]
+        groups = [
+            sorted(ids[order[a:b]].tolist())
+            for a, b in zip(run_starts.tolist(), run_ends.tolist()) if b - a > 1
+        ]
+        groups = sorted(groups, key=lambda g: (-len(g), g[0]))
+        self._group_cache[cache_key] = groups
+        return groups
+
+    @staticmethod
+    def _close_pairs(hashes: np.ndarray, max_distance: int):
+        """逐段生成 (i, j) 下标对（i < j），其汉明距离不超过 max_distance"""
+        n = len(hashes)
+        segment_bits = HASH_BITS // _SEGMENTS
+        flips = max_distance // _SEGMENTS
+        variants = [0]
+        for count in range(1, flips + 1):
+            for bits in combinations(range(segment_bits), count):
+                variants.append(sum(1 << b for b in bits))
+        positions = np.arange(n)
+
+        for segment in range(_SEGMENTS):
+            keys = ((hashes >> np.uint64(segment * segment_bits)) & np.uint64((1 << segment_bits) - 1)).astype(np.int64)
+            order = np.argsort(keys, kind='stable')
+            # 段值只有 2^16 种，预先算出每个取值在排序数组中的起始位置，查找变为一次数组索引
+            starts = np.searchsorted(keys[order], np.arange((1 << segment_bits) + 1))
+            for variant in variants:
+                query = keys ^ variant
+                lo = starts[query]
+                counts = starts[query + 1] - lo
+                total = int(counts.sum())
+                if not total:
+                    continue
+                left = np.repeat(positions, counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                right = order[np.repeat(lo, counts) + offsets]
+                keep = left < right
+                left, right = left[keep], right[keep]
+                close = popcount(hashes[left] ^ hashes[right]) <= max_distance
+                yield left[close], right[close]
+
+
+phash_index = PerceptualHashIndex()
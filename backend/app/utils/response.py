@@ -9,8 +9,11 @@ def success_response(data=None, message="Success"):
         response['data'] = data
     return jsonify(response)
 
-def error_response(message, status_code=400):
-    return jsonify({
+def error_response(message, status_code=400, data=None):
+    response = {
         'success': False,
         'message': str(message)
-    }), status_code 
\ No newline at end of file
+    }
+    if data is not None:
+        response['data'] = data
+    return jsonify(response), status_code 
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""图库页面的拼图（sprite sheet）
+
+一页图片的缩略图拼成一张图片，配合 {image_id: {x, y, w, h}} 偏移表由前端按 background-position 显示，
+首屏只需一次请求。拼图以 (图片 id 列表, 每张图片的版本, 格子尺寸) 的哈希为键缓存在
+<SPRITE_CACHE_DIR>/<key[:2]>/<key>.<ext>，偏移表保存在同名 .json 中，总大小受 SPRITE_CACHE_MAX_BYTES 限制。
+每个格子的图片取自缩略图缓存，只在缩略图缺失时才读取原图。
+
+有格子加载失败（可能只是暂时的）时，拼图另取一个包含失败 id 的键（内容仍不会变化，可长期缓存），
+偏移表只缓存 SPRITE_PARTIAL_TTL 秒，过期后重新拼接。
+"""
+import hashlib
+import json
+import math
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from PIL import Image as PILImage
+
+from app.utils.logger import logger
+from app.utils.thumbnails import DiskLRUCache, _MIMETYPES
+from conf import (SPRITE_CACHE_DIR, SPRITE_CACHE_MAX_BYTES, SPRITE_COLUMNS, SPRITE_PARTIAL_TTL, THUMBNAIL_FORMAT,
+                  THUMBNAIL_QUALITY, SCAN_WORKERS)
+
+
+class SpriteService:
+    def __init__(self, root: str = SPRITE_CACHE_DIR, max_bytes: int = SPRITE_CACHE_MAX_BYTES,
+                 fmt: str = THUMBNAIL_FORMAT, quality: int = THUMBNAIL_QUALITY, columns: int = SPRITE_COLUMNS,
+                 partial_ttl: int = SPRITE_PARTIAL_TTL):
+        self.root = root
+        self.fmt = fmt
+        self.quality = quality
+        self.columns = columns
+        self.partial_ttl = partial_ttl
+        self.cache = DiskLRUCache(root, max_bytes)
+
+    @property
+    def mimetype(self) -> str:
+        return _MIMETYPES.get(self.fmt, 'application/octet-stream')
+
+    def sheet_key(self, entries: Sequence[Tuple[int, str]], tile: int) -> str:
+        """entries 为 [(image_id, 版本)]，版本取 content_hash 或文件修改时间，任一图片变化即得到新的键"""
+        ident = f'{tile}|{self.fmt}|{self.quality}|{self.columns}|' + ','.join(f'{i}:{v}' for i, v in entries)
+        return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+
+    def sheet_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f'{key}.{self.fmt}')
+
+    def layout_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f'{key}.json')
+
+    def load(self, key: str) -> Optional[dict]:
+        """已缓存的偏移表；拼图或偏移表任一缺失，或含失败格子的偏移表已过期时返回 None"""
+        if not self.cache.get(self.layout_path(key)):
+            return None
+        try:
+            with open(self.layout_path(key), encoding='utf-8') as f:
+                layout = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if layout.get('expires_at') and layout['expires_at'] < time.time():
+            return None
+        if not self.cache.get(self.sheet_path(layout.get('key', key))):
+            return None
+        return layout
+
+    def _write(self, path: str, writer: Callable[[str], None]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            writer(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.cache.put(path)
+
+    def get_or_build(self, entries: Sequence[Tuple[int, str]], tile: int,
+                     load_tile: Callable[[int], Optional[str]]) -> Tuple[str, dict]:
+        """返回 (拼图的键, 偏移表)，未缓存时拼接生成
+
+        load_tile(image_id) 返回该图片缩略图文件的路径（在线程池中并行调用），失败或返回 None 的
+        图片不占格子，列入偏移表的 missing。
+        """
+        key = self.sheet_key(entries, tile)
+        layout = self.load(key)
+        if layout is not None:
+            return layout.get('key', key), layout
+
+        ids = [image_id for image_id, _ in entries]
+
+        def fetch(image_id):
+            try:
+                return load_tile(image_id)
+            except Exception as e:
+                logger.warning(f'Failed to load sprite tile for image {image_id}: {str(e)}')
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(SCAN_WORKERS, max(1, len(ids)))) as executor:
+            sources = list(executor.map(fetch, ids))
+
+        placed: List[Tuple[int, str]] = [(i, s) for i, s in zip(ids, sources) if s]
+        columns = max(1, min(self.columns, len(placed)))
+        rows = max(1, math.ceil(len(placed) / columns))
+        sheet = PILImage.new('RGBA', (columns * tile, rows * tile), (0, 0, 0, 0))
+        tiles = {}
+        missing = [i for i, s in zip(ids, sources) if not s]
+        for image_id, source in placed:
+            try:
+                with PILImage.open(source) as im:
+                    im.thumbnail((tile, tile), PILImage.LANCZOS)
+                    im = im.convert('RGBA')
+            except Exception as e:
+                logger.warning(f'Failed to read sprite tile for image {image_id}: {str(e)}')
+                missing.append(image_id)
+                continue
+            # 按顺序占用格子，在格子内居中
+            index = len(tiles)
+            x = (index % columns) * tile + (tile - im.width) // 2
+            y = (index // columns) * tile + (tile - im.height) // 2
+            sheet.paste(im, (x, y))
+            tiles[str(image_id)] = {'x': x, 'y': y, 'w': im.width, 'h': im.height}
+
+        if self.fmt == 'jpeg':
+            sheet = sheet.convert('RGB')
+        sheet_key = key
+        expires_at = None
+        if missing:
+            # 缺格子的拼图不能占用完整拼图的键：之后重试成功时内容会变化
+            sheet_key = hashlib.sha256(f"{key}|missing:{','.join(map(str, sorted(missing)))}".encode()).hexdigest()
+            expires_at = time.time() + self.partial_ttl
+        layout = {
+            'key': sheet_key,
+            'tile': tile,
+            'columns': columns,
+            'width': sheet.width,
+            'height': sheet.height,
+            'format': self.fmt,
+            'tiles': tiles,
+            'missing': missing,
+            'expires_at': expires_at
+        }
+        self._write(self.sheet_path(sheet_key),
+                    lambda p: sheet.save(p, format=self.fmt.upper(), quality=self.quality))
+
+        def write_layout(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(layout, f)
+
+        self._write(self.layout_path(key), write_layout)
+        logger.info(f'Built sprite {sheet_key[:12]} with {len(tiles)} tiles ({sheet.width}x{sheet.height}), '
+                    f'{len(missing)} missing')
+        return sheet_key, layout
+
+
+sprite_service = SpriteService()
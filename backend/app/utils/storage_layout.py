@@ -0,0 +1,167 @@
+"""上传/生成文件的目录分片
+
+新生成的图片写入 OUTPUT_FOLDER/YYYY/MM/DD/，上传文件按内容哈希分目录保存（见 blob_store）。
+早期平铺在 UPLOAD_FOLDER/OUTPUT_FOLDER 根目录下的文件由 image_jobs.shard_flat_files_job 分批迁移：
+先在日期目录中建立硬链接、更新记录中的路径并提交，最后才删除旧路径，迁移过程中任一时刻文件都可访问。
+"""
+import os
+import shutil
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from conf import UPLOAD_FOLDER, OUTPUT_FOLDER, DATE_SHARDED_STORAGE
+
+# 各存储根目录：名称 -> (根目录, 规范的 file_path 前缀, 记录中可能出现的 file_path 前缀)
+STORAGE_ROOTS = {
+    'upload': (UPLOAD_FOLDER, '/uploads/', ('/uploads/', 'upload/images/')),
+    'output': (OUTPUT_FOLDER, '/output/', ('/output/', 'output/images/')),
+}
+
+
+def date_shard(when: Optional[datetime] = None) -> str:
+    return (when or datetime.now()).strftime('%Y/%m/%d')
+
+
+def dated_directory(root: str, when: Optional[datetime] = None) -> str:
+    """返回（并创建）root 下当天的分片目录；关闭 DATE_SHARDED_STORAGE 时返回 root 本身"""
+    if not DATE_SHARDED_STORAGE:
+        os.makedirs(root, exist_ok=True)
+        return root
+    directory = os.path.join(root, *date_shard(when).split('/'))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def iter_flat_files(root: str) -> Iterator[os.DirEntry]:
+    """流式列出 root 根目录下（不含子目录）的文件，不一次性 listdir 全部文件名"""
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                try:
+                    if entry.is_file(follow_symlinks=False) and not entry.name.endswith('.tmp'):
+                        yield entry
+                except OSError:
+                    continue
+    except OSError:
+        return
+
+
+def unique_target(directory: str, name: str, source: str, taken=()) -> str:
+    """目标目录中已有同名的其他文件（或已分配给同批的其他文件）时追加 _1、_2… 后缀"""
+    stem, ext = os.path.splitext(name)
+    candidate = os.path.join(directory, name)
+    n = 0
+    while candidate in taken or os.path.lexists(candidate):
+        try:
+            if candidate not in taken and os.path.samefile(candidate, source):
+                return candidate
+        except OSError:
+            pass
+        n += 1
+        candidate = os.path.join(directory, f'{stem}_{n}{ext}')
+    return candidate
+
+
+def place_file(source: str, target: str) -> str:
+    """让 target 与 source 指向同一文件（优先硬链接，inode 不变），源文件保留，由调用方稍后删除"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.lexists(target):
+        return 'existing'
+    try:
+        os.link(source, target)
+        return 'hardlink'
+    except OSError:
+        shutil.copy2(source, target)
+        return 'copy'
+
+
+def file_path_variants(root_key: str, name: str) -> List[str]:
+    """记录中可能指向 root/name 的 file_path 写法"""
+    root, _, prefixes = STORAGE_ROOTS[root_key]
+    return [os.path.join(root, name), name] + [prefix + name for prefix in prefixes]
+
+
+def rewrite_file_path(root_key: str, file_path: str, old_path: str, new_path: str) -> Optional[str]:
+    """把指向 old_path 的 file_path 改写为指向 new_path 的同类写法，不指向 old_path 时返回 None"""
+    root, canonical_prefix, prefixes = STORAGE_ROOTS[root_key]
+    name = os.path.basename(old_path)
+    relative = os.path.relpath(new_path, root).replace(os.sep, '/')
+    normalized = file_path.replace('\\', '/')
+    if normalized == name:
+        return canonical_prefix + relative
+    for prefix in prefixes:
+        if normalized == prefix + name:
+            return prefix + relative
+    if os.path.isabs(file_path) and os.path.abspath(file_path) == old_path:
+        return new_path
+    return None
+
+
+def migrated_file_path(filename: str) -> Optional[str]:
+    """按旧的平铺文件名（可带 output/、upload/ 一级前缀）查找已迁移到分片目录的文件（需在 app context 中调用）"""
+    from app.models.image import Image
+    from app.utils.image_paths import image_path_resolver
+
+    name = os.path.basename(filename)
+    if not name or name != filename.split('/', 1)[-1]:
+        return None
+    for image in Image.query.filter(Image.filename == name).limit(10):
+        path = image_path_resolver.resolve(image)
+        if path and os.path.basename(path) == name:
+            return path
+    return None
+
+
+def shard_moves(root_key: str, entries: List[os.DirEntry], rows) -> Tuple[List[dict], List[Tuple[str, str]]]:
+    """为一批平铺文件规划迁移
+
+    rows 为引用这些文件的记录 (id, created_at, file_path, local_path, resolved_path)；
+    分片日期取引用记录中最早的 created_at，没有记录引用时取文件修改时间。
+
+    Returns:
+        (批量 UPDATE 参数, [(旧路径, 新路径)])
+    """
+    root = os.path.abspath(STORAGE_ROOTS[root_key][0])
+    old_paths = {os.path.abspath(entry.path): entry for entry in entries}
+    by_variant = {}
+    for old_path, entry in old_paths.items():
+        for variant in file_path_variants(root_key, entry.name):
+            by_variant[variant] = old_path
+
+    # 旧路径 -> [(记录, 需要改写的字段)]
+    references = {}
+    for row in rows:
+        fields = {}
+        for column in ('resolved_path', 'local_path'):
+            value = getattr(row, column)
+            if value and os.path.abspath(value) in old_paths:
+                fields[column] = os.path.abspath(value)
+        if row.file_path:
+            normalized = row.file_path.replace('\\', '/')
+            old_path = by_variant.get(normalized)
+            if old_path is None and os.path.isabs(row.file_path):
+                old_path = os.path.abspath(row.file_path)
+            if old_path in old_paths:
+                fields['file_path'] = old_path
+        for column, old_path in fields.items():
+            references.setdefault(old_path, []).append((row, column))
+
+    new_paths = {}
+    taken = set()
+    for old_path, entry in old_paths.items():
+        dates = [row.created_at for row, _ in references.get(old_path, ()) if row.created_at]
+        when = min(dates) if dates else datetime.fromtimestamp(entry.stat().st_mtime)
+        directory = os.path.join(root, *date_shard(when).split('/'))
+        new_paths[old_path] = unique_target(directory, entry.name, old_path, taken)
+        taken.add(new_paths[old_path])
+
+    updates = {}
+    for old_path, refs in references.items():
+        new_path = new_paths[old_path]
+        for row, column in refs:
+            values = updates.setdefault(row.id, {'id': row.id})
+            if column == 'file_path':
+                values[column] = rewrite_file_path(root_key, row.file_path, old_path, new_path)
+            else:
+                values[column] = new_path
+    return list(updates.values()), list(new_paths.items())
@@ -0,0 +1,220 @@
+"""缩略图衍生文件服务
+
+缩略图按宽度分目录缓存在磁盘上：<THUMBNAIL_CACHE_DIR>/<width>/<image_id>_<mtime>.<ext>，
+源文件修改后 mtime 变化即自动失效。缓存总大小受 THUMBNAIL_CACHE_MAX_BYTES 限制，
+超出时按最近最少使用(LRU)顺序淘汰；命中时更新文件 mtime，使 LRU 顺序在重启后得以保留。
+"""
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image as PILImage, ImageOps
+
+from app.utils.logger import logger
+from conf import (THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_WIDTHS,
+                  THUMBNAIL_FORMAT, THUMBNAIL_QUALITY)
+
+_MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+
+def snap_width(width: Optional[int]) -> int:
+    """把请求宽度归一到配置的档位（不小于请求宽度的最小档位），限制缓存变体数量"""
+    widths = sorted(THUMBNAIL_WIDTHS)
+    if not width or width <= 0:
+        return widths[len(widths) // 2]
+    for w in widths:
+        if w >= width:
+            return w
+    return widths[-1]
+
+
+def render_thumbnail(source_path: str, dest_path: str, width: int, fmt: str = THUMBNAIL_FORMAT,
+                     quality: int = THUMBNAIL_QUALITY):
+    """生成等比缩放的缩略图，先写临时文件再原子替换"""
+    with PILImage.open(source_path) as im:
+        # JPEG 可在解码阶段直接按比例缩小，避免解码完整分辨率
+        im.draft('RGB', (width, width * 4))
+        im = ImageOps.exif_transpose(im)
+        if im.width > width:
+            im.thumbnail((width, max(1, round(im.height * width / im.width))), PILImage.LANCZOS)
+        if fmt == 'jpeg' and im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+        elif im.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            im = im.convert('RGBA' if 'A' in im.getbands() or 'transparency' in im.info else 'RGB')
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp_path = f'{dest_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            im.save(tmp_path, format=fmt.upper(), quality=quality)
+            os.replace(tmp_path, dest_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class DiskLRUCache:
+    """带字节预算的磁盘 LRU 缓存，只负责记账与淘汰，文件由调用方写入"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()  # path -> size，末尾为最近使用
+        self._total = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        """首次使用时从磁盘恢复缓存索引，按 mtime 由旧到新排列"""
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+        found.sort()
+        for _, path, size in found:
+            self._entries[path] = size
+            self._total += size
+        self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._load()
+
+    def get(self, path: str) -> bool:
+        """命中时刷新 LRU 位置并返回 True"""
+        with self._lock:
+            self._ensure_loaded()
+            if path not in self._entries:
+                return False
+            if not os.path.exists(path):
+                self._total -= self._entries.pop(path)
+                return False
+            self._entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def put(self, path: str):
+        """登记一个新写入的文件，并在超出预算时淘汰最久未使用的文件"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        evicted = []
+        with self._lock:
+            self._ensure_loaded()
+            self._total -= self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._total += size
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_path, old_size = self._entries.popitem(last=False)
+                self._total -= old_size
+                evicted.append(old_path)
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def discard_prefix(self, prefix: str):
+        """删除文件名以 prefix 开头的所有缓存项（如某张图片的全部衍生文件）"""
+        removed = []
+        with self._lock:
+            self._ensure_loaded()
+            for path in list(self._entries):
+                if os.path.basename(path).startswith(prefix):
+                    self._total -= self._entries.pop(path)
+                    removed.append(path)
+        for path in removed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """删除全部缓存文件（如清空图库后）"""
+        with self._lock:
+            self._ensure_loaded()
+            removed = list(self._entries)
+            self._entries.clear()
+            self._total = 0
+        for path in removed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+
+class ThumbnailService:
+    def __init__(self, root: str = THUMBNAIL_CACHE_DIR, max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES,
+                 fmt: str = THUMBNAIL_FORMAT):
+        self.root = root
+        self.fmt = fmt
+        self.cache = DiskLRUCache(root, max_bytes)
+
+    @property
+    def mimetype(self) -> str:
+        return _MIMETYPES.get(self.fmt, 'application/octet-stream')
+
+    def cache_path(self, image_id: int, mtime_key: int, width: int) -> str:
+        ext = 'jpg' if self.fmt == 'jpeg' else self.fmt
+        return os.path.join(self.root, str(width), f'{image_id}_{mtime_key}.{ext}')
+
+    def cached(self, image_id: int, width: int, mtime_key: int) -> Optional[str]:
+        """已生成的缩略图路径，不存在时返回 None（不需要源文件）"""
+        path = self.cache_path(image_id, mtime_key, width)
+        return path if self.cache.get(path) else None
+
+    def get_or_create(self, image_id: int, source_path: str, width: int,
+                      mtime_key: Optional[int] = None) -> str:
+        """返回缩略图路径，不存在时生成；mtime_key 为源文件修改时间（秒），缺省时 stat 源文件"""
+        if mtime_key is None:
+            mtime_key = int(os.stat(source_path).st_mtime)
+        path = self.cache_path(image_id, mtime_key, width)
+        if self.cache.get(path):
+            return path
+        render_thumbnail(source_path, path, width, self.fmt)
+        self.cache.put(path)
+        return path
+
+    def invalidate(self, image_id: int):
+        self.cache.discard_prefix(f'{image_id}_')
+
+
+thumbnail_service = ThumbnailService()
+
+
+def prewarm_thumbnails(image_ids, widths=None):
+    """为给定图片生成常用尺寸的缩略图（需在 app context 中调用）"""
+    from app.models.image import Image
+    from app.utils.image_paths import image_path_resolver
+
+    widths = widths or THUMBNAIL_WIDTHS
+    generated = 0
+    for image in Image.query.filter(Image.id.in_(list(image_ids))).all():
+        source = image_path_resolver.resolve(image)
+        if not source:
+            continue
+        mtime_key = int(image.file_mtime.timestamp()) if image.file_mtime else None
+        for width in widths:
+            try:
+                thumbnail_service.get_or_create(image.id, source, width, mtime_key)
+                generated += 1
+            except Exception as e:
+                logger.warning(f"Failed to prewarm thumbnail for image {image.id} at {width}px: {str(e)}")
+                break
+    return generated
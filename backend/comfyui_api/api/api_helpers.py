@@ -1,102 +1,135 @@
-import json
-from PIL import Image
-import io
 import os
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 # Assuming the import paths are correct and the methods are defined elsewhere:
-from comfyui_api.api.websocket_api import queue_prompt, get_history, get_image, upload_image, clear_comfy_cache
-from comfyui_api.api.open_websocket import open_websocket_connection
+from comfyui_api.api.websocket_api import clear_comfy_cache
+from comfyui_api.api.client import get_client
+from comfyui_api.api.router import comfyui_router
+from app.utils.logger import logger
+from conf import COMFYUI_PROMPT_TIMEOUT
 
 def generate_image_by_prompt(prompt, output_path, output_id, save_previews=False) -> List[str]:
-  try:
-    ws, server_address, client_id = open_websocket_connection()
-    prompt_id = queue_prompt(prompt, client_id, server_address)['prompt_id']
-    track_progress(prompt, ws, prompt_id)
-    images = get_images(prompt_id, server_address, output_id, save_previews)
-    output_files = save_image(images, output_path, save_previews)
-    return output_files
-  finally:
-    ws.close()
+  files, errors = generate_images_by_prompt(prompt, output_path, [output_id], save_previews)
+  if output_id in errors:
+    raise RuntimeError(errors[output_id])
+  return files.get(output_id, [])
+
+def generate_images_by_prompt(prompt, output_path, output_ids, save_previews=False, on_event=None, backend_tags=(), content_hashes=None) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+  """Queue the workflow once and collect every requested output node from the same /history entry.
+
+  on_event, if given, is called with every execution event (executing/progress/executed/...) of this prompt.
+  The prompt runs on the least loaded ComfyUI backend that supports it and has all backend_tags (see comfyui_router).
+  If content_hashes is a dict, it receives {file name: SHA-256} of every saved file.
+
+  Returns:
+    (saved file names per output node, error message per output node that produced nothing)
+  """
+  backend, prompt_id = comfyui_router.submit(prompt, backend_tags)
+  client = backend.client
+  failure = track_progress(prompt, client.events(prompt_id, COMFYUI_PROMPT_TIMEOUT), prompt_id, on_event)
+  history = client.get_history(prompt_id).get(prompt_id, {})
+  files = {}
+  errors = {}
+  for output_id in output_ids:
+    images = collect_node_images(history, output_id, save_previews)
+    if not images:
+      errors[output_id] = _missing_output_reason(history, output_id, failure)
+      continue
+    saved = save_image(images, output_path, save_previews, client, content_hashes)
+    if saved:
+      files[output_id] = saved
+    else:
+      errors[output_id] = f"Failed to save images of output node {output_id}"
+  return files, errors
+
+def _missing_output_reason(history, output_id, failure):
+  if failure:
+    return f"Output node {output_id} produced no images: {failure}"
+  if output_id not in history.get('outputs', {}):
+    return f"Output node {output_id} was not executed"
+  return f"Output node {output_id} produced no images"
 
 def generate_image_by_prompt_and_image(prompt, output_path, input_path, filename, save_previews=False):
-  try:
-    ws, server_address, client_id = open_websocket_connection()
-    upload_image(input_path, filename, server_address, client_id)
-    prompt_id = queue_prompt(prompt, client_id, server_address)['prompt_id']
-    track_progress(prompt, ws, prompt_id)
-    images = get_images(prompt_id, server_address, save_previews)
-    save_image(images, output_path, save_previews)
-  finally:
-    ws.close()
-
-def save_image(images, output_path, save_previews):
+  backend, prompt_id = comfyui_router.submit(prompt, prepare=lambda client: client.upload_image(input_path, filename))
+  client = backend.client
+  track_progress(prompt, client.events(prompt_id, COMFYUI_PROMPT_TIMEOUT), prompt_id)
+  history = client.get_history(prompt_id).get(prompt_id, {})
+  for output_id in history.get('outputs', {}):
+    save_image(collect_node_images(history, output_id, save_previews), output_path, save_previews, client)
+
+def save_image(images, output_path, save_previews, client, content_hashes=None):
+  """Stream each image from /view straight to output_path as-is (no decode/re-encode), hashing it on the way.
+
+  An existing file with the same name is never replaced: the image is saved under a free name (_1, _2, ...
+  suffix) and that name is returned.
+  """
   output_files = []
   for itm in images:
     directory = output_path
     os.makedirs(directory, exist_ok=True)
     try:
-      image = Image.open(io.BytesIO(itm['image_data']))
       file_name = os.path.join(directory, itm['file_name'])
-      image.save(file_name)
-      output_files.append(itm['file_name'])
+      saved_path, content_hash, _ = client.download_image(itm['file_name'], itm['subfolder'], itm['type'], file_name)
+      saved_name = os.path.basename(saved_path)
+      output_files.append(saved_name)
+      if content_hashes is not None:
+        content_hashes[saved_name] = content_hash
     except Exception as e:
-      print(f"Failed to save image {itm['file_name']}: {e}")
+      logger.error(f"Failed to save image {itm['file_name']}: {e}")
   return output_files
 
-def track_progress(prompt, ws, prompt_id):
+def track_progress(prompt, events, prompt_id, on_event=None) -> Optional[str]:
+  """Follow the prompt's execution events (see ComfyUIClient.events) until it finishes; returns the error message if execution failed."""
   node_ids = list(prompt.keys())
   finished_nodes = []
 
-  while True:
-      out = ws.recv()
-      if isinstance(out, str):
-          message = json.loads(out)
-          if message['type'] == 'progress':
-              data = message['data']
-              current_step = data['value']
-              print('In K-Sampler -> Step: ', current_step, ' of: ', data['max'])
-          if message['type'] == 'execution_cached':
-              data = message['data']
-              for itm in data['nodes']:
-                  if itm not in finished_nodes:
-                      finished_nodes.append(itm)
-                      print('Progess: ', len(finished_nodes), '/', len(node_ids), ' Tasks done')
-          if message['type'] == 'executing':
-              data = message['data']
-              if data['node'] not in finished_nodes:
-                  finished_nodes.append(data['node'])
-                  print('Progess: ', len(finished_nodes), '/', len(node_ids), ' Tasks done')
-
-
-              if data['node'] is None and data['prompt_id'] == prompt_id:
-                  break #Execution is done
-      else:
-          continue #previews are binary data
-  return
+  for message in events:
+    data = message.get('data') or {}
+    if data.get('prompt_id') not in (None, prompt_id):
+        continue
+    if on_event is not None:
+        on_event(message)
+    if message['type'] == 'progress':
+        current_step = data['value']
+        logger.debug(f"In K-Sampler -> Step: {current_step} of: {data['max']}")
+    if message['type'] == 'execution_cached':
+        for itm in data['nodes']:
+            if itm not in finished_nodes:
+                finished_nodes.append(itm)
+                logger.debug(f'Progress: {len(finished_nodes)} / {len(node_ids)} Tasks done')
+    if message['type'] == 'execution_error':
+        return "Execution failed at node {}: {}".format(data.get('node_id'), data.get('exception_message', '').strip())
+    if message['type'] == 'execution_interrupted':
+        return "Execution interrupted at node {}".format(data.get('node_id'))
+    if message['type'] == 'executing':
+        if data['node'] not in finished_nodes:
+            finished_nodes.append(data['node'])
+            logger.debug(f'Progress: {len(finished_nodes)} / {len(node_ids)} Tasks done')
 
-def get_images(prompt_id, server_address, output_id, allow_preview = False):
-  output_images = []
 
-  history = get_history(prompt_id, server_address)[prompt_id]
-  for node_id in history['outputs']:
-      if node_id == output_id:
-        node_output = history['outputs'][node_id]
-        output_data = {}
-        if 'images' in node_output:
-            for image in node_output['images']:
-                if allow_preview and image['type'] == 'temp':
-                    preview_data = get_image(image['filename'], image['subfolder'], image['type'], server_address)
-                    output_data['image_data'] = preview_data
-                if image['type'] == 'output':
-                    image_data = get_image(image['filename'], image['subfolder'], image['type'], server_address)
-                    output_data['image_data'] = image_data
-        output_data['file_name'] = image['filename']
-        output_data['type'] = image['type']
-        output_images.append(output_data)
+        if data['node'] is None and data['prompt_id'] == prompt_id:
+            break #Execution is done
+  return None
 
+def collect_node_images(history, output_id, allow_preview=False):
+  """List every image one output node wrote, taken from an already fetched /history entry (nothing is downloaded yet)."""
+  output_images = []
+  node_output = history.get('outputs', {}).get(output_id, {})
+  for image in node_output.get('images', []):
+      if image['type'] == 'output' or (allow_preview and image['type'] == 'temp'):
+          output_images.append({
+              'file_name': image['filename'],
+              'subfolder': image['subfolder'],
+              'type': image['type']
+          })
   return output_images
 
+def get_images(prompt_id, server_address, output_id, allow_preview = False):
+  client = get_client(server_address)
+  history = client.get_history(prompt_id)[prompt_id]
+  return [dict(itm, image_data=client.get_image(itm['file_name'], itm['subfolder'], itm['type']))
+          for itm in collect_node_images(history, output_id, allow_preview)]
+
 
 def clear():
   clear_comfy_cache()
\ No newline at end of file
@@ -0,0 +1,336 @@
+"""进程内共享的 ComfyUI 客户端
+
+每个 ComfyUI 服务地址对应一个 ComfyUIClient（见 get_client）：
+- 固定的 client_id 与一条常驻 WebSocket，由后台线程接收消息，断线后按指数退避重连；
+  执行事件按 data.prompt_id 分发给正在等待该提示词的调用方，多个并发生成共用同一条连接。
+- /prompt、/history、/view 等 HTTP 请求走 requests.Session 的长连接池，不再每次新建连接。
+
+提示词提交后、调用方开始等待前到达的事件暂存在 backlog 中，开始等待时一并取出；
+等待期间长时间收不到事件（例如断线重连期间丢失）时改为查询 /history 判断是否已执行完成，
+既不在 /history 也不在 /queue 中（例如 ComfyUI 在执行期间重启）时判定提示词已丢失。
+"""
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, Iterator, Optional, Tuple
+
+import requests
+import websocket  # NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+
+from app.utils.logger import logger
+from conf import (COMFYUI_SERVER_ADDRESS, COMFYUI_HTTP_POOL_SIZE, COMFYUI_HTTP_TIMEOUT,
+                  COMFYUI_WS_RECONNECT_MAX_DELAY, COMFYUI_EVENT_POLL_INTERVAL)
+
+# 尚无调用方等待的提示词最多暂存多少个，每个最多暂存多少条事件
+_BACKLOG_PROMPTS = 256
+_BACKLOG_EVENTS = 1024
+# 接收超时后发送 ping，用于及时发现已断开的连接
+_WS_PING_INTERVAL = 30
+# 流式下载输出图片时每次读取的字节数
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class PromptLost(RuntimeError):
+    pass
+
+
+def _reserve_path(dest: str) -> str:
+    """以独占方式创建 dest（已存在时依次尝试 stem_1.ext、stem_2.ext…）作为占位，返回占到的路径
+
+    O_EXCL 创建是原子的，并发下载到同一目录的线程或进程不会分到同一个文件名。
+    """
+    stem, ext = os.path.splitext(dest)
+    candidate = dest
+    n = 0
+    while True:
+        try:
+            os.close(os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+            return candidate
+        except FileExistsError:
+            n += 1
+            candidate = f'{stem}_{n}{ext}'
+
+
+def is_final_event(message: dict, prompt_id: str) -> bool:
+    """执行完成（executing 的 node 为 None）、出错或被中断"""
+    data = message.get('data') or {}
+    if message.get('type') in ('execution_error', 'execution_interrupted'):
+        return True
+    return message.get('type') == 'executing' and data.get('node') is None and data.get('prompt_id') == prompt_id
+
+
+class ComfyUIClient:
+    def __init__(self, server_address: str, pool_size: int = COMFYUI_HTTP_POOL_SIZE,
+                 timeout: float = COMFYUI_HTTP_TIMEOUT):
+        self.server_address = server_address
+        self.client_id = str(uuid.uuid4())
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.last_error: Optional[str] = None
+        # 最近一次 status 消息中的队列状态，如 {'exec_info': {'queue_remaining': 0}}
+        self.last_status: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._watchers: Dict[str, queue.Queue] = {}
+        self._backlog: 'OrderedDict[str, deque]' = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._ws: Optional[websocket.WebSocket] = None
+        self._connected = threading.Event()
+        self._closed = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.server_address}'
+
+    # ---- HTTP ----
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, f'{self.base_url}{path}', **kwargs)
+        if response.status_code >= 400:
+            raise requests.HTTPError(
+                f'ComfyUI {method} {path} failed with {response.status_code}: {response.text[:500]}',
+                response=response)
+        return response
+
+    def queue_prompt(self, prompt: dict) -> dict:
+        self.ensure_listening()
+        return self._request('POST', '/prompt', json={'prompt': prompt, 'client_id': self.client_id}).json()
+
+    def get_history(self, prompt_id: str) -> dict:
+        return self._request('GET', f'/history/{prompt_id}').json()
+
+    def get_image(self, filename: str, subfolder: str, folder_type: str) -> bytes:
+        params = {'filename': filename, 'subfolder': subfolder, 'type': folder_type}
+        return self._request('GET', '/view', params=params).content
+
+    def download_image(self, filename: str, subfolder: str, folder_type: str, dest: str) -> Tuple[str, str, int]:
+        """把 /view 的响应分块写入 dest 同目录的临时文件，边写边计算 SHA-256，fsync 后移动到 dest
+
+        内容按原样保存（不解码、不重新编码，保留 PNG 中的工作流等元数据），内存中只保留一个分块。
+        dest 已存在时（如两台后端各自输出 ComfyUI_00001_.png）改用 _1、_2… 后缀，不覆盖已有文件。
+
+        Returns:
+            (实际保存路径, content_hash, 字节数)
+        """
+        params = {'filename': filename, 'subfolder': subfolder, 'type': folder_type}
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = f'{dest}.{uuid.uuid4().hex}.tmp'
+        try:
+            with self._request('GET', '/view', params=params, stream=True) as response:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(_DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+            target = _reserve_path(dest)
+            # 只替换刚刚独占创建的占位文件
+            try:
+                os.replace(tmp_path, target)
+            except OSError:
+                os.remove(target)
+                raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return target, digest.hexdigest(), size
+
+    def upload_image(self, input_path: str, name: str, image_type: str = 'input', overwrite: bool = False) -> bytes:
+        with open(input_path, 'rb') as file:
+            multipart_data = MultipartEncoder(fields={
+                'image': (name, file, 'image/png'),
+                'type': image_type,
+                'overwrite': str(overwrite).lower()
+            })
+            return self._request('POST', '/upload/image', data=multipart_data,
+                                 headers={'Content-Type': multipart_data.content_type}).content
+
+    def interrupt(self) -> bytes:
+        return self._request('POST', '/interrupt').content
+
+    def get_object_info(self, node_class: str) -> dict:
+        return self._request('GET', f'/object_info/{node_class}').json()
+
+    def get_all_object_info(self) -> dict:
+        """服务器上全部节点类型的定义（含下拉选项，如可用的模型文件）"""
+        return self._request('GET', '/object_info').json()
+
+    def get_queue(self, timeout: Optional[float] = None) -> dict:
+        return self._request('GET', '/queue', timeout=timeout or self.timeout).json()
+
+    def get_system_stats(self, timeout: Optional[float] = None) -> dict:
+        return self._request('GET', '/system_stats', timeout=timeout or self.timeout).json()
+
+    def free(self, unload_models: bool = False, free_memory: bool = False) -> bytes:
+        return self._request('POST', '/free', json={'unload_models': unload_models,
+                                                    'free_memory': free_memory}).content
+
+    # ---- WebSocket ----
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def ensure_listening(self):
+        """启动（或在线程意外退出后重启）接收 WebSocket 消息的后台线程"""
+        with self._lock:
+            if self._closed.is_set() or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._listen, name=f'comfyui-ws-{self.server_address}',
+                                            daemon=True)
+            self._thread.start()
+
+    def wait_connected(self, timeout: float) -> bool:
+        self.ensure_listening()
+        return self._connected.wait(timeout)
+
+    def _listen(self):
+        delay = 1.0
+        url = f'ws://{self.server_address}/ws?clientId={self.client_id}'
+        while not self._closed.is_set():
+            ws = websocket.WebSocket()
+            try:
+                ws.connect(url, timeout=self.timeout)
+                ws.settimeout(_WS_PING_INTERVAL)
+                self._ws = ws
+                self._connected.set()
+                self.last_error = None
+                delay = 1.0
+                logger.info(f'Connected to ComfyUI websocket at {self.server_address}')
+                while not self._closed.is_set():
+                    try:
+                        out = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        ws.ping()
+                        continue
+                    if isinstance(out, str) and out:
+                        self._dispatch(json.loads(out))
+                    # 二进制消息为采样预览图，忽略
+            except Exception as e:
+                self.last_error = str(e)
+                if not self._closed.is_set():
+                    logger.warning(f'ComfyUI websocket at {self.server_address} disconnected: {str(e)}, '
+                                   f'reconnecting in {delay:.0f}s')
+            finally:
+                self._connected.clear()
+                self._ws = None
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+            if self._closed.wait(delay):
+                break
+            delay = min(delay * 2, COMFYUI_WS_RECONNECT_MAX_DELAY)
+
+    def _dispatch(self, message: dict):
+        data = message.get('data') or {}
+        if message.get('type') == 'status':
+            self.last_status = data.get('status')
+            return
+        prompt_id = data.get('prompt_id')
+        if not prompt_id:
+            return
+        with self._lock:
+            watcher = self._watchers.get(prompt_id)
+            if watcher is None:
+                backlog = self._backlog.get(prompt_id)
+                if backlog is None:
+                    backlog = self._backlog[prompt_id] = deque(maxlen=_BACKLOG_EVENTS)
+                    while len(self._backlog) > _BACKLOG_PROMPTS:
+                        self._backlog.popitem(last=False)
+                backlog.append(message)
+                return
+        watcher.put(message)
+
+    def _final_event_from_history(self, prompt_id: str) -> Optional[dict]:
+        """提示词已出现在 /history 中时，按其状态构造结束事件；尚未执行完成或查询失败时返回 None"""
+        try:
+            entry = self.get_history(prompt_id).get(prompt_id)
+        except Exception as e:
+            logger.warning(f'Failed to poll ComfyUI history for prompt {prompt_id}: {str(e)}')
+            return None
+        if not entry:
+            return None
+        for name, data in (entry.get('status') or {}).get('messages', []):
+            if name in ('execution_error', 'execution_interrupted'):
+                return {'type': name, 'data': data}
+        return {'type': 'executing', 'data': {'node': None, 'prompt_id': prompt_id}}
+
+    def _is_queued(self, prompt_id: str) -> Optional[bool]:
+        """提示词是否仍在 /queue 中（执行中或等待中），查询失败时返回 None"""
+        try:
+            queue_info = self.get_queue()
+        except Exception as e:
+            logger.warning(f'Failed to poll ComfyUI queue for prompt {prompt_id}: {str(e)}')
+            return None
+        entries = (queue_info.get('queue_running') or []) + (queue_info.get('queue_pending') or [])
+        return any(isinstance(entry, (list, tuple)) and len(entry) > 1 and entry[1] == prompt_id for entry in entries)
+
+    def events(self, prompt_id: str, timeout: Optional[float] = None) -> Iterator[dict]:
+        """按到达顺序产出某个提示词的执行事件（progress/executing/executed/...），结束事件产出后停止
+
+        Raises:
+            TimeoutError: 超过 timeout 秒仍未执行完成
+            PromptLost: 提示词既不在 /history 也不在 /queue 中（如 ComfyUI 在执行期间重启）
+        """
+        events: queue.Queue = queue.Queue()
+        with self._lock:
+            for message in self._backlog.pop(prompt_id, ()):
+                events.put(message)
+            self._watchers[prompt_id] = events
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            while True:
+                try:
+                    message = events.get(timeout=COMFYUI_EVENT_POLL_INTERVAL)
+                except queue.Empty:
+                    message = self._final_event_from_history(prompt_id)
+                    if message is None and self._is_queued(prompt_id) is False:
+                        # 查询 /queue 期间可能刚好执行完成，再确认一次 /history
+                        message = self._final_event_from_history(prompt_id)
+                        if message is None:
+                            raise PromptLost(f'ComfyUI prompt {prompt_id} is neither queued nor in history, '
+                                             f'the server may have restarted')
+                    if message is None:
+                        if deadline is not None and time.monotonic() > deadline:
+                            raise TimeoutError(f'ComfyUI prompt {prompt_id} did not finish within {timeout:.0f}s')
+                        continue
+                yield message
+                if is_final_event(message, prompt_id):
+                    return
+        finally:
+            with self._lock:
+                self._watchers.pop(prompt_id, None)
+
+    def close(self):
+        self._closed.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        self.session.close()
+
+
+_clients: Dict[str, ComfyUIClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(server_address: str = COMFYUI_SERVER_ADDRESS) -> ComfyUIClient:
+    """返回该服务地址的进程内共享客户端"""
+    with _clients_lock:
+        client = _clients.get(server_address)
+        if client is None:
+            client = _clients[server_address] = ComfyUIClient(server_address)
+        return client
@@ -0,0 +1,209 @@
+"""多台 ComfyUI 后端的注册表与路由
+
+COMFYUI_BACKENDS 列出所有后端（地址、权重、能力标签）。提交提示词前路由器：
+1. 探测每个后端的 /queue 与 /system_stats（结果缓存 COMFYUI_PROBE_TTL 秒），连接失败的后端
+   在 COMFYUI_BACKEND_COOLDOWN 秒内不再分配任务；
+2. 按 /object_info（缓存 COMFYUI_OBJECT_INFO_TTL 秒）检查后端是否具备工作流用到的节点类型，
+   以及下拉选项类输入（如 ckpt_name 选择的模型文件）是否在该后端可用；
+3. 在满足标签要求的可用后端中选择 (排队数 + 本进程探测后已分配数) / 权重 最小者，
+   提交时遇到连接错误则标记该后端失败并依次尝试下一个。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from app.utils.logger import logger
+from comfyui_api.api.client import ComfyUIClient, get_client
+from conf import COMFYUI_BACKENDS, COMFYUI_PROBE_TTL, COMFYUI_OBJECT_INFO_TTL, COMFYUI_BACKEND_COOLDOWN
+
+# 探测请求的超时时间（秒），避免一台无响应的后端拖慢每次分配
+PROBE_TIMEOUT = 5
+_CONNECTION_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+def _combo_options(spec) -> Optional[list]:
+    """输入定义为下拉选项时返回可选值；允许上传文件的输入（如 LoadImage.image）不做检查"""
+    if not isinstance(spec, (list, tuple)) or not spec:
+        return None
+    options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    if options.get('image_upload'):
+        return None
+    if isinstance(spec[0], list):
+        return spec[0]
+    if spec[0] == 'COMBO' and isinstance(options.get('options'), list):
+        return options['options']
+    return None
+
+
+class ComfyUIBackend:
+    def __init__(self, address: str, weight: float = 1.0, tags: Iterable[str] = ()):
+        self.address = address
+        self.weight = max(float(weight), 0.01)
+        self.tags = frozenset(tags)
+        self.client: ComfyUIClient = get_client(address)
+        self.healthy: Optional[bool] = None
+        self.error: Optional[str] = None
+        self.queue_depth = 0
+        self.vram_free: Optional[int] = None
+        # 上次探测之后本进程分配到该后端的提示词数（尚未反映在 /queue 结果中）
+        self.dispatched = 0
+        self._probed_at = 0.0
+        self._failed_until = 0.0
+        self._object_info: Optional[dict] = None
+        self._object_info_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def load(self) -> float:
+        return (self.queue_depth + self.dispatched) / self.weight
+
+    def mark_failed(self, error):
+        with self._lock:
+            self.healthy = False
+            self.error = str(error)
+            self._failed_until = time.monotonic() + COMFYUI_BACKEND_COOLDOWN
+
+    def probe(self, force: bool = False) -> bool:
+        now = time.monotonic()
+        if not force and now < self._failed_until:
+            return False
+        if not force and self.healthy and now - self._probed_at < COMFYUI_PROBE_TTL:
+            return True
+        try:
+            queue_info = self.client.get_queue(PROBE_TIMEOUT)
+            stats = self.client.get_system_stats(PROBE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f'ComfyUI backend {self.address} is unavailable: {str(e)}')
+            self.mark_failed(e)
+            return False
+        devices = stats.get('devices') or []
+        with self._lock:
+            self.queue_depth = len(queue_info.get('queue_running') or []) + len(queue_info.get('queue_pending') or [])
+            self.dispatched = 0
+            self.vram_free = sum(d.get('vram_free') or 0 for d in devices) if devices else None
+            self.healthy = True
+            self.error = None
+            self._probed_at = now
+            self._failed_until = 0.0
+        # 后端可用时保持 WebSocket 常驻，提交后即可接收事件
+        self.client.ensure_listening()
+        return True
+
+    def object_info(self) -> dict:
+        now = time.monotonic()
+        if self._object_info is None or now - self._object_info_at > COMFYUI_OBJECT_INFO_TTL:
+            self._object_info = self.client.get_all_object_info()
+            self._object_info_at = now
+        return self._object_info
+
+    def unsupported_reason(self, prompt: dict) -> Optional[str]:
+        """该后端无法执行 prompt 的原因（缺少节点类型或下拉选项值），可以执行时返回 None"""
+        try:
+            info = self.object_info()
+        except Exception as e:
+            self.mark_failed(e)
+            return f'failed to read object_info: {str(e)}'
+        for node in prompt.values():
+            class_type = node.get('class_type')
+            spec = info.get(class_type)
+            if spec is None:
+                return f'missing node class {class_type}'
+            declared = {**(spec.get('input') or {}).get('required', {}), **(spec.get('input') or {}).get('optional', {})}
+            for name, value in (node.get('inputs') or {}).items():
+                if not isinstance(value, str):
+                    continue
+                options = _combo_options(declared.get(name))
+                if options is not None and value not in options:
+                    return f'{class_type}.{name} has no option {value}'
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            'address': self.address,
+            'weight': self.weight,
+            'tags': sorted(self.tags),
+            'healthy': bool(self.healthy),
+            'connected': self.client.connected,
+            'queue_depth': self.queue_depth,
+            'dispatched': self.dispatched,
+            'vram_free': self.vram_free,
+            'error': self.error
+        }
+
+
+class ComfyUIRouter:
+    def __init__(self, backends: List[ComfyUIBackend]):
+        self.backends = backends
+
+    @classmethod
+    def from_config(cls, config: Iterable[dict] = COMFYUI_BACKENDS) -> 'ComfyUIRouter':
+        return cls([ComfyUIBackend(item['address'], item.get('weight', 1), item.get('tags') or ())
+                    for item in config])
+
+    def probe_all(self, force: bool = False) -> List[ComfyUIBackend]:
+        """并行探测所有后端，返回可用的后端"""
+        if len(self.backends) == 1:
+            return [b for b in self.backends if b.probe(force)]
+        with ThreadPoolExecutor(max_workers=len(self.backends)) as executor:
+            results = list(executor.map(lambda b: b.probe(force), self.backends))
+        return [b for b, ok in zip(self.backends, results) if ok]
+
+    def candidates(self, prompt: Optional[dict] = None, tags: Iterable[str] = ()) -> Tuple[List[ComfyUIBackend], Dict[str, str]]:
+        """可执行 prompt 的后端（按负载从低到高排序），以及其余后端被排除的原因"""
+        required = frozenset(tags)
+        healthy = self.probe_all()
+        rejected = {b.address: b.error or 'unavailable' for b in self.backends if b not in healthy}
+        selected = []
+        for backend in healthy:
+            if not required <= backend.tags:
+                rejected[backend.address] = f"missing tags {', '.join(sorted(required - backend.tags))}"
+                continue
+            reason = backend.unsupported_reason(prompt) if prompt else None
+            if reason:
+                rejected[backend.address] = reason
+                continue
+            selected.append(backend)
+        selected.sort(key=lambda b: (b.load, -(b.vram_free or 0)))
+        return selected, rejected
+
+    def submit(self, prompt: dict, tags: Iterable[str] = (),
+               prepare: Optional[Callable[[ComfyUIClient], None]] = None) -> Tuple[ComfyUIBackend, str]:
+        """把 prompt 提交到负载最低的可用后端，返回 (后端, prompt_id)
+
+        prepare(client) 在提交前于所选后端上执行（如上传输入图片）。提交或 prepare 遇到连接错误时
+        标记该后端失败并改用下一个后端。
+
+        Raises:
+            NoBackendAvailable: 没有可执行该 prompt 的后端
+        """
+        backends, rejected = self.candidates(prompt, tags)
+        for backend in backends:
+            try:
+                if prepare is not None:
+                    prepare(backend.client)
+                prompt_id = backend.client.queue_prompt(prompt)['prompt_id']
+            except _CONNECTION_ERRORS as e:
+                logger.warning(f'Failed to submit prompt to ComfyUI backend {backend.address}, failing over: {str(e)}')
+                backend.mark_failed(e)
+                rejected[backend.address] = str(e)
+                continue
+            with backend._lock:
+                backend.dispatched += 1
+            logger.info(f'Prompt {prompt_id} dispatched to ComfyUI backend {backend.address} (load {backend.load:.2f})')
+            return backend, prompt_id
+        details = '; '.join(f'{address}: {reason}' for address, reason in rejected.items())
+        raise NoBackendAvailable(f'No ComfyUI backend can run this workflow ({details})')
+
+    def status(self) -> List[dict]:
+        self.probe_all()
+        return [backend.to_dict() for backend in self.backends]
+
+
+comfyui_router = ComfyUIRouter.from_config()
@@ -1,9 +1,9 @@
-from comfyui_api.api.api_helpers import generate_image_by_prompt
+from comfyui_api.api.api_helpers import generate_images_by_prompt
 from comfyui_api.utils.helpers.randomize_seed import generate_random_15_digit_number
-from comfyui_api.api.open_websocket import open_websocket_connection
 from conf import OUTPUT_FOLDER
+from app.utils.storage_layout import dated_directory
 import os
-from typing import List, Dict, Union
+from typing import Callable, List, Dict, Optional, Sequence, Union
 import json
 import copy
 import logging
@@ -13,7 +13,10 @@ def prompt_to_image(
     workflow: Union[dict, str],
     variable_values: Dict[str, Dict[str, any]],
     output_node_ids: list,
-    save_previews: bool = True
+    save_previews: bool = True,
+    on_event: Optional[Callable[[dict], None]] = None,
+    backend_tags: Sequence[str] = (),
+    content_hashes: Optional[Dict[str, str]] = None
 ) -> list:
     """
     根据提供的变量值生成图片
@@ -23,9 +26,12 @@ def prompt_to_image(
         variable_values: 变量值映射字典，格式为 {node_id: {value_path: value}}
         output_node_ids: 输出节点ID列表
         save_previews: 是否保存预览图
+        on_event: 可选，接收该次执行的每条 ComfyUI 事件（executing/progress/executed 等），用于上报进度
+        backend_tags: 执行该工作流的 ComfyUI 后端须具备的标签（见 COMFYUI_BACKENDS）
+        content_hashes: 可选，传入 dict 时写入 {返回的文件路径: SHA-256}（下载时计算，无需再读文件）
     
     Returns:
-        list: 生成的图片文件路径列表
+        list: 生成的图片文件路径列表（相对 OUTPUT_FOLDER，如 2026/10/17/ComfyUI_00001_.png）
         
     Raises:
         ValueError: 当输入参数无效时
@@ -72,25 +78,40 @@ def prompt_to_image(
         # 使用指定的输出节点
         output_files = []
         generation_errors = []
+        # 按日期分目录保存，避免输出目录平铺大量文件
+        output_dir = dated_directory(OUTPUT_FOLDER)
+        output_prefix = os.path.relpath(output_dir, OUTPUT_FOLDER).replace(os.sep, '/')
         
+        selected_ids = []
         for output_id in output_node_ids:
             if output_id not in prompt:
                 logger.error(f"Output node ID {output_id} not found in workflow")
                 generation_errors.append(f"Output node {output_id} not found")
-                continue
-                
+            elif output_id not in selected_ids:
+                selected_ids.append(output_id)
+
+        # 整个工作流只提交一次，所有输出节点的结果从同一条 history 记录中读取
+        if selected_ids:
+            saved_hashes = {}
             try:
-                result = generate_image_by_prompt(prompt, OUTPUT_FOLDER, output_id, save_previews)
-                if not result:
-                    logger.error(f"Failed to generate image for output node {output_id}")
-                    generation_errors.append(f"Failed to generate image for output node {output_id}")
-                    continue
-                output_files.extend(result)
+                files_by_node, errors_by_node = generate_images_by_prompt(prompt, output_dir, selected_ids, save_previews,
+                                                                          on_event, backend_tags, saved_hashes)
             except Exception as e:
-                error_msg = f"Failed to generate image for output node {output_id}: {str(e)}"
+                error_msg = f"Failed to generate images for output nodes {', '.join(selected_ids)}: {str(e)}"
                 logger.error(error_msg, exc_info=True)
+                files_by_node, errors_by_node = {}, {}
                 generation_errors.append(error_msg)
-        
+
+            for output_id in selected_ids:
+                if output_id in errors_by_node:
+                    logger.error(f"Failed to generate image for output node {output_id}: {errors_by_node[output_id]}")
+                    generation_errors.append(errors_by_node[output_id])
+                for name in files_by_node.get(output_id, []):
+                    path = name if output_prefix == '.' else f'{output_prefix}/{name}'
+                    output_files.append(path)
+                    if content_hashes is not None and name in saved_hashes:
+                        content_hashes[path] = saved_hashes[name]
+
         if not output_files and generation_errors:
             # 如果没有成功生成任何图片，抛出异常
             raise RuntimeError(f"Image generation failed: {'; '.join(generation_errors)}")
@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 from urllib.parse import quote_plus
@@ -13,11 +14,92 @@ BASE_PATH = Path(__file__).parent.resolve()
 COMFYUI_HOST = os.getenv('COMFYUI_HOST', '127.0.0.1')
 COMFYUI_PORT = os.getenv('COMFYUI_PORT', '8188')
 COMFYUI_SERVER_ADDRESS = f"{COMFYUI_HOST}:{COMFYUI_PORT}"
+# 进程内共用的 ComfyUI 客户端：HTTP 长连接池大小、请求超时（秒）
+COMFYUI_HTTP_POOL_SIZE = int(os.getenv('COMFYUI_HTTP_POOL_SIZE', '16'))
+COMFYUI_HTTP_TIMEOUT = float(os.getenv('COMFYUI_HTTP_TIMEOUT', '60'))
+# WebSocket 断线重连的最大退避间隔（秒）
+COMFYUI_WS_RECONNECT_MAX_DELAY = float(os.getenv('COMFYUI_WS_RECONNECT_MAX_DELAY', '30'))
+# 等待执行事件超过该时长（秒）未收到消息时改为查询 /history，弥补断线期间丢失的事件
+COMFYUI_EVENT_POLL_INTERVAL = float(os.getenv('COMFYUI_EVENT_POLL_INTERVAL', '10'))
+# 单个提示词从提交到执行完成的最长等待时间（秒），0 表示不限制
+COMFYUI_PROMPT_TIMEOUT = float(os.getenv('COMFYUI_PROMPT_TIMEOUT', '1800'))
+# 多台 ComfyUI 后端（JSON 列表），weight 为处理能力权重，tags 为能力标签，例如
+# [{"address": "10.0.0.2:8188", "weight": 2, "tags": ["sdxl"]}, {"address": "10.0.0.3:8188"}]；
+# 未配置时只使用 COMFYUI_SERVER_ADDRESS
+COMFYUI_BACKENDS = json.loads(os.getenv('COMFYUI_BACKENDS') or '[]') or [{'address': COMFYUI_SERVER_ADDRESS}]
+# 路由时 /queue 与 /system_stats 探测结果的缓存时间（秒）、/object_info 的缓存时间（秒），
+# 以及连接失败的后端暂停分配任务的时间（秒）
+COMFYUI_PROBE_TTL = float(os.getenv('COMFYUI_PROBE_TTL', '2'))
+COMFYUI_OBJECT_INFO_TTL = float(os.getenv('COMFYUI_OBJECT_INFO_TTL', '600'))
+COMFYUI_BACKEND_COOLDOWN = float(os.getenv('COMFYUI_BACKEND_COOLDOWN', '30'))
 
 # 图片相关配置
 ALLOWED_EXTENSIONS = set(os.getenv('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif,webp').split(','))
 UPLOAD_FOLDER = os.path.join(BASE_PATH, os.getenv('UPLOAD_FOLDER', 'upload/images'))
 OUTPUT_FOLDER = os.path.join(BASE_PATH, os.getenv('OUTPUT_FOLDER', 'output/images'))
+# 按内容哈希去重存储的目录（位于上传/输出目录内，保证与原文件处于同一文件系统以便硬链接）
+UPLOAD_BLOB_DIR = os.path.join(UPLOAD_FOLDER, 'blobs')
+OUTPUT_BLOB_DIR = os.path.join(OUTPUT_FOLDER, 'blobs')
+# 新生成的图片按 YYYY/MM/DD 分目录保存（上传文件按内容哈希分目录，见 UPLOAD_BLOB_DIR）
+DATE_SHARDED_STORAGE = os.getenv('DATE_SHARDED_STORAGE', 'true').lower() in ('1', 'true', 'yes')
+# 分片上传：未完成的上传会话保留时长（秒）
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', str(24 * 3600)))
+# 目录扫描时并行遍历子目录的线程数
+SCAN_WORKERS = int(os.getenv('SCAN_WORKERS', '8'))
+# 默认目录实时同步：事件合并间隔（秒），以及无 inotify 时的轮询扫描间隔（秒）
+IMAGE_WATCH_ENABLED = os.getenv('IMAGE_WATCH_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+IMAGE_WATCH_DEBOUNCE_SECONDS = float(os.getenv('IMAGE_WATCH_DEBOUNCE_SECONDS', '2'))
+IMAGE_WATCH_POLL_INTERVAL = int(os.getenv('IMAGE_WATCH_POLL_INTERVAL', '300'))
+# 图片列表总数缓存的有效期（秒），用于游标分页时避免每页执行 COUNT(*)
+IMAGE_COUNT_CACHE_TTL = int(os.getenv('IMAGE_COUNT_CACHE_TTL', '60'))
+# 图片 id -> 文件路径的进程内缓存条数
+IMAGE_PATH_CACHE_SIZE = int(os.getenv('IMAGE_PATH_CACHE_SIZE', '10000'))
+# 图片属性提取（EXIF 方向、主色调、颜色直方图等）的工作线程数，0 表示在后台线程中直接执行
+IMAGE_ANALYSIS_WORKERS = int(os.getenv('IMAGE_ANALYSIS_WORKERS', str(min(4, os.cpu_count() or 1))))
+# 图片元数据回填任务每批处理的记录数
+METADATA_BACKFILL_BATCH_SIZE = int(os.getenv('METADATA_BACKFILL_BATCH_SIZE', '500'))
+# 清空图片、清理脏数据等维护任务每批处理的记录数
+IMAGE_MAINTENANCE_BATCH_SIZE = int(os.getenv('IMAGE_MAINTENANCE_BATCH_SIZE', '1000'))
+
+# 缩略图配置：缓存目录、缓存字节上限、可用宽度档位、预生成的宽度（默认为图库网格视图 512 与列表视图 128）、
+# 输出格式与质量
+THUMBNAIL_CACHE_DIR = os.path.join(BASE_PATH, os.getenv('THUMBNAIL_CACHE_DIR', 'cache/thumbnails'))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+THUMBNAIL_WIDTHS = [int(w) for w in os.getenv('THUMBNAIL_WIDTHS', '128,256,512,1024').split(',')]
+THUMBNAIL_PREWARM_WIDTHS = [int(w) for w in os.getenv('THUMBNAIL_PREWARM_WIDTHS', '128,512').split(',')]
+THUMBNAIL_FORMAT = os.getenv('THUMBNAIL_FORMAT', 'webp').lower()
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '80'))
+
+# 图库拼图：缓存目录与字节上限、单张拼图最多包含的图片数、每行格子数
+SPRITE_CACHE_DIR = os.path.join(BASE_PATH, os.getenv('SPRITE_CACHE_DIR', 'cache/sprites'))
+SPRITE_CACHE_MAX_BYTES = int(os.getenv('SPRITE_CACHE_MAX_BYTES', str(1024 ** 3)))
+SPRITE_MAX_IMAGES = int(os.getenv('SPRITE_MAX_IMAGES', '100'))
+SPRITE_COLUMNS = int(os.getenv('SPRITE_COLUMNS', '10'))
+# 有格子加载失败的拼图，其偏移表只缓存该秒数，过期后重新拼接以重试失败的格子
+SPRITE_PARTIAL_TTL = int(os.getenv('SPRITE_PARTIAL_TTL', '60'))
+
+# 原图格式协商：按优先顺序尝试的衍生格式（留空则关闭；AVIF 编码很慢，首次请求大图时需数秒，默认只用 webp，
+# 可设为 avif,webp 启用）、编码质量、缓存目录与字节上限，以及小于该字节数的原图不转换
+IMAGE_DERIVATIVE_FORMATS = [f.strip().lower() for f in os.getenv('IMAGE_DERIVATIVE_FORMATS', 'webp').split(',') if f.strip()]
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv('IMAGE_DERIVATIVE_QUALITY', '82'))
+IMAGE_DERIVATIVE_CACHE_DIR = os.path.join(BASE_PATH, os.getenv('IMAGE_DERIVATIVE_CACHE_DIR', 'cache/derivatives'))
+IMAGE_DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_DERIVATIVE_CACHE_MAX_BYTES', str(4 * 1024 ** 3)))
+IMAGE_DERIVATIVE_MIN_BYTES = int(os.getenv('IMAGE_DERIVATIVE_MIN_BYTES', str(64 * 1024)))
+
+# 冷存储：超过 ARCHIVE_AFTER_DAYS 天未被访问的生成图片压缩打包到归档目录（按创建日期每天一个打包文件），
+# 请求原图时解压回原路径；ARCHIVE_INTERVAL_HOURS 为自动执行间隔（0 表示只通过接口手动执行）
+ARCHIVE_FOLDER = os.path.join(BASE_PATH, os.getenv('ARCHIVE_FOLDER', 'archive/images'))
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv('ARCHIVE_COMPRESSION_LEVEL', '6'))
+ARCHIVE_INTERVAL_HOURS = int(os.getenv('ARCHIVE_INTERVAL_HOURS', '24'))
+
+# 异步生成任务：同时执行的任务数（工作线程数）与排队任务数上限（超出时拒绝提交）
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '2'))
+GENERATION_QUEUE_MAX = int(os.getenv('GENERATION_QUEUE_MAX', '50'))
+# 生成进度写入数据库的最小间隔（秒）；SSE 推送不受此限制
+GENERATION_PROGRESS_FLUSH_SECONDS = float(os.getenv('GENERATION_PROGRESS_FLUSH_SECONDS', '1'))
+# 执行中的任务刷新心跳的间隔（秒）；心跳超过 4 个间隔未刷新的任务视为所在进程已退出，标记为失败
+GENERATION_HEARTBEAT_SECONDS = float(os.getenv('GENERATION_HEARTBEAT_SECONDS', '15'))
 
 # 提示词增强系统消息
 PROMPT_ENHANCE_SYSTEM_MESSAGE = os.getenv('PROMPT_ENHANCE_SYSTEM_MESSAGE')
@@ -76,4 +158,7 @@ IMAGE_DIR = os.path.join(BASE_DIR, os.getenv('IMAGE_DIR', 'spider/images'))
 # 确保必要的目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-os.makedirs(IMAGE_DIR, exist_ok=True)
\ No newline at end of file
+os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+os.makedirs(IMAGE_DIR, exist_ok=True)
+os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+os.makedirs(IMAGE_DERIVATIVE_CACHE_DIR, exist_ok=True)
\ No newline at end of file
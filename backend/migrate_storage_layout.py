@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+
+# Add the backend directory to the Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app
+from app.image_jobs import shard_flat_files_job
+from app.utils.job_progress import job_registry
+from app.utils.storage_layout import STORAGE_ROOTS
+from conf import IMAGE_MAINTENANCE_BATCH_SIZE
+
+
+def main():
+    """把上传/输出目录根下平铺的文件迁移到 YYYY/MM/DD 分片目录
+
+    可在服务运行时执行：每批先建立新路径、提交记录后才删除旧路径；中断后重新执行会继续处理剩余文件。
+    """
+    parser = argparse.ArgumentParser(description='Move flat upload/output files into YYYY/MM/DD shards')
+    parser.add_argument('--folder', choices=[*STORAGE_ROOTS, 'all'], default='all')
+    parser.add_argument('--batch-size', type=int, default=IMAGE_MAINTENANCE_BATCH_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='only count the files that would be moved')
+    args = parser.parse_args()
+
+    roots = tuple(STORAGE_ROOTS) if args.folder == 'all' else (args.folder,)
+    job = job_registry.create('storage_shard')
+    shard_flat_files_job(create_app(), job, roots, args.dry_run, args.batch_size)
+
+    if job.status == 'failed':
+        print(f"Migration failed after {job.processed} files: {job.error}")
+        sys.exit(1)
+    print(job.result['message'])
+    for root_key, count in job.result['moved'].items():
+        print(f"  {root_key}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""Add heartbeat_at to generation_jobs table
+
+Revision ID: add_generation_job_heartbeat
+Revises: add_image_metadata_probe_column
+Create Date: 2026-10-17 23:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_generation_job_heartbeat'
+down_revision = 'add_image_metadata_probe_column'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Refreshed by the process running the job; running jobs with a stale heartbeat are marked failed
+    with op.batch_alter_table('generation_jobs') as batch_op:
+        batch_op.add_column(sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('generation_jobs') as batch_op:
+        batch_op.drop_column('heartbeat_at')
@@ -0,0 +1,50 @@
+"""Add generation_jobs table for asynchronous image generation
+
+Revision ID: add_generation_jobs_table
+Revises: add_image_archive_columns
+Create Date: 2026-10-17 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_generation_jobs_table'
+down_revision = 'add_image_archive_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'generation_jobs',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('workflow_id', sa.Integer(), nullable=True),
+        sa.Column('workflow_name', sa.String(length=255), nullable=True),
+        sa.Column('variables', sa.JSON(), nullable=True),
+        sa.Column('output_nodes', sa.JSON(), nullable=True),
+        sa.Column('status', sa.Enum('queued', 'running', 'done', 'failed', name='generationjobstatus',
+                                    native_enum=False), nullable=False),
+        sa.Column('prompt_id', sa.String(length=64), nullable=True),
+        sa.Column('current_node', sa.String(length=64), nullable=True),
+        sa.Column('nodes_done', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('nodes_total', sa.Integer(), nullable=True),
+        sa.Column('step', sa.Integer(), nullable=True),
+        sa.Column('max_steps', sa.Integer(), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('image_ids', sa.JSON(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['workflow_id'], ['workflows.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_generation_jobs_status', 'generation_jobs', ['status'], unique=False)
+    op.create_index('ix_generation_jobs_created_at', 'generation_jobs', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_generation_jobs_created_at', table_name='generation_jobs')
+    op.drop_index('ix_generation_jobs_status', table_name='generation_jobs')
+    op.drop_table('generation_jobs')
@@ -0,0 +1,32 @@
+"""Add extracted image properties (EXIF orientation, colors) to images table
+
+Revision ID: add_image_analysis_columns
+Revises: add_image_participation_columns
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_analysis_columns'
+down_revision = 'add_image_participation_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in by the background metadata backfill (rows with analyzed_at IS NULL)
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.add_column(sa.Column('exif_orientation', sa.SmallInteger(), nullable=True))
+        batch_op.add_column(sa.Column('dominant_colors', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('color_histogram', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('analyzed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_column('analyzed_at')
+        batch_op.drop_column('color_histogram')
+        batch_op.drop_column('dominant_colors')
+        batch_op.drop_column('exif_orientation')
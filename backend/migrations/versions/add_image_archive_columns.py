@@ -0,0 +1,33 @@
+"""Add cold-storage archive location and last access time to images table
+
+Revision ID: add_image_archive_columns
+Revises: add_image_analysis_columns
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_archive_columns'
+down_revision = 'add_image_analysis_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.add_column(sa.Column('archive_pack', sa.String(length=32), nullable=True))
+        batch_op.add_column(sa.Column('archive_offset', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('archived_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_accessed_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_images_archive_pack', ['archive_pack'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_index('ix_images_archive_pack')
+        batch_op.drop_column('last_accessed_at')
+        batch_op.drop_column('archived_at')
+        batch_op.drop_column('archive_offset')
+        batch_op.drop_column('archive_pack')
@@ -0,0 +1,27 @@
+"""Add content_hash column and index to images table
+
+Revision ID: add_image_content_hash
+Revises: add_image_file_metadata
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_content_hash'
+down_revision = 'add_image_file_metadata'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_images_content_hash', ['content_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_index('ix_images_content_hash')
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,32 @@
+"""Add image_directory_manifests table for incremental directory scans
+
+Revision ID: add_image_directory_manifests_table
+Revises: add_generation_job_heartbeat
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_directory_manifests_table'
+down_revision = 'add_generation_job_heartbeat'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'image_directory_manifests',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('directory', sa.String(length=500), nullable=False),
+        sa.Column('mtime_ns', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('entries', sa.JSON(), nullable=True),
+        sa.Column('scanned_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('directory')
+    )
+
+
+def downgrade():
+    op.drop_table('image_directory_manifests')
@@ -0,0 +1,34 @@
+"""Add file metadata columns (size, dimensions, format, mtime) to images table
+
+Revision ID: add_image_file_metadata
+Revises: 1234567890ab
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_file_metadata'
+down_revision = '1234567890ab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are filled in by the background metadata backfill job
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.add_column(sa.Column('file_size', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('width', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('height', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('format', sa.String(length=16), nullable=True))
+        batch_op.add_column(sa.Column('file_mtime', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_column('file_mtime')
+        batch_op.drop_column('format')
+        batch_op.drop_column('height')
+        batch_op.drop_column('width')
+        batch_op.drop_column('file_size')
@@ -0,0 +1,25 @@
+"""Add composite indexes for keyset pagination of the image list
+
+Revision ID: add_image_list_indexes
+Revises: add_image_phash
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_list_indexes'
+down_revision = 'add_image_phash'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_images_source_type_created', 'images',
+                    ['source', 'image_type', 'created_at', 'id'], unique=False)
+    op.create_index('ix_images_created_id', 'images', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_images_created_id', table_name='images')
+    op.drop_index('ix_images_source_type_created', table_name='images')
@@ -0,0 +1,26 @@
+"""Add metadata_probed_at to images table
+
+Revision ID: add_image_metadata_probe_column
+Revises: add_generation_jobs_table
+Create Date: 2026-10-17 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_metadata_probe_column'
+down_revision = 'add_generation_jobs_table'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Set by the metadata backfill when the file could not be found, so the row is not probed again
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.add_column(sa.Column('metadata_probed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_column('metadata_probed_at')
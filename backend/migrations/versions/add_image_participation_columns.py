@@ -0,0 +1,66 @@
+"""Promote participated/used flags from images.variables JSON to columns
+
+Revision ID: add_image_participation_columns
+Revises: add_image_resolved_path
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_participation_columns'
+down_revision = 'add_image_resolved_path'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def _flag(variables, key):
+    if isinstance(variables, str):
+        try:
+            variables = json.loads(variables)
+        except ValueError:
+            return False
+    return isinstance(variables, dict) and bool(variables.get(key))
+
+
+def upgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.add_column(sa.Column('participated', sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column('participated_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('used', sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column('used_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_images_type_participated_used', ['image_type', 'participated', 'used'],
+                              unique=False)
+
+    # Backfill from the JSON blob in id-ordered chunks; the JSON keys are left in place for downgrade
+    conn = op.get_bind()
+    images = sa.table('images', sa.column('id', sa.Integer), sa.column('variables', sa.Text),
+                      sa.column('participated', sa.Boolean), sa.column('used', sa.Boolean))
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(images.c.id, images.c.variables)
+            .where(images.c.id > last_id, images.c.variables.isnot(None))
+            .order_by(images.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for key in ('participated', 'used'):
+            ids = [row[0] for row in rows if _flag(row[1], key)]
+            if ids:
+                conn.execute(images.update().where(images.c.id.in_(ids)).values({key: True}))
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_index('ix_images_type_participated_used')
+        batch_op.drop_column('used_at')
+        batch_op.drop_column('used')
+        batch_op.drop_column('participated_at')
+        batch_op.drop_column('participated')
@@ -0,0 +1,26 @@
+"""Add perceptual hash column to images table
+
+Revision ID: add_image_phash
+Revises: add_image_content_hash
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_phash'
+down_revision = 'add_image_content_hash'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are hashed by the background metadata backfill job
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.add_column(sa.Column('phash', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_column('phash')
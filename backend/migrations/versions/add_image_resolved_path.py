@@ -0,0 +1,26 @@
+"""Add resolved_path column to images table
+
+Revision ID: add_image_resolved_path
+Revises: add_image_list_indexes
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_image_resolved_path'
+down_revision = 'add_image_list_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled in lazily the first time each image is resolved
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.add_column(sa.Column('resolved_path', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_column('resolved_path')
@@ -5,7 +5,6 @@ import requests
 from xhs import XhsClient
 from conf import BASE_PATH
 import os
-import glob
 from typing import Union, List
 import json
 import random
@@ -13,13 +12,13 @@ import openai
 from conf import OPENAI_API_KEY, OPENAI_API_BASE, OPENAI_ENHANCE_MODEL, PROMPT_ENHANCE_SYSTEM_MESSAGE, OPENAI_CAPTION_MODEL, PROMPT_CAPTION_SYSTEM_MESSAGE
 import asyncio
 from app.models.user import User
-from app.extensions import db
 from app.models.workflow import Workflow
 from app.models.workflow_variable import WorkflowVariable
 from app.models.variable_definitions import VariableDefinitions
 from comfyui_api.utils.actions.prompt_to_image import prompt_to_image
 from comfyui_api.utils.actions.load_workflow import load_workflow
-from app.models.image import Image
+from app.utils.image_walker import iter_image_files
+from app.utils.image_analysis import stored_formats_by_path
 
 
 class XhsUploader:
@@ -48,11 +47,8 @@ class XhsUploader:
         if not os.path.isdir(directory):
             raise Exception(f"Directory not found: {directory}")
             
-        # Get all jpg and png files (case insensitive, but avoid duplicates)
-        image_files = set()  # 使用 set 来避免重复
-        for ext in ('*.jpg', '*.jpeg', '*.png'):
-            # Windows 是大小写不敏感的，所以不需要重复的大写模式
-            image_files.update(glob.glob(os.path.join(directory, ext)))
+        # Get all jpg and png files in a single scandir pass (case insensitive)
+        image_files = {entry.path for entry in iter_image_files(directory, ('jpg', 'jpeg', 'png'), recursive=False)}
             
         if not image_files:
             raise Exception(f"No jpg or png images found in directory: {directory}")
@@ -86,7 +82,12 @@ class XhsUploader:
         if not isinstance(images, (list, tuple)):
             raise Exception(f"Invalid images format. Expected string or list, got {type(images)}")
             
-        # Validate all images
+        # Validate all images; the real format recorded at ingest time wins over the extension
+        try:
+            stored_formats = stored_formats_by_path(i for i in images if isinstance(i, str))
+        except Exception as e:
+            logger.warning("Stored image formats unavailable, validating by extension: %s", str(e))
+            stored_formats = {}
         processed_images = []
         for image in images:
             if not isinstance(image, str):
@@ -100,8 +101,12 @@ class XhsUploader:
                 if not os.path.exists(image):
                     raise Exception(f"Image file not found: {image}")
                 
-                ext = os.path.splitext(image)[1].lower()
-                if ext not in ('.jpg', '.jpeg', '.png'):
+                stored_format = stored_formats.get(image)
+                if stored_format is not None:
+                    supported = stored_format in ('jpeg', 'png')
+                else:
+                    supported = os.path.splitext(image)[1].lower() in ('.jpg', '.jpeg', '.png')
+                if not supported:
                     raise Exception(f"Unsupported image format: {image}. Only jpg and png are supported.")
                     
                 processed_images.append(image)
@@ -238,6 +243,9 @@ def _generate_images(workflow_data: dict, prompt_var: WorkflowVariable, seed_var
                     output_var: WorkflowVariable, prompts: List[str], workflow: Workflow, 
                     image_style: str, topic: str) -> List[str]:
     """Generate images using the workflow"""
+    # app.scheduler 导入本模块，而 generation_jobs 经由 image_jobs 依赖 app.scheduler，在此处导入避免循环
+    from app.generation_jobs import save_generated_images
+
     logger.info('Starting image generation for %d prompts', len(prompts))
     generated_images = []
     
@@ -256,33 +264,26 @@ def _generate_images(workflow_data: dict, prompt_var: WorkflowVariable, seed_var
             }
         logger.debug('Variable mapping: %s', variable_mapping)
 
+        content_hashes = {}
         result = prompt_to_image(
             workflow=workflow_data,
             variable_values=variable_mapping,
             output_node_ids=[output_var.node_id],
-            save_previews=True
+            save_previews=True,
+            content_hashes=content_hashes
         )
         logger.debug('Generation result: %s', result)
 
         if result:
-            image_path = os.path.join(BASE_PATH, 'output', 'images', result[0])
-            generated_images.append(image_path)
-            logger.info('Generated image: %s', image_path)
-
-            image = Image(
-                filename=result[0],
-                workflow_name=workflow.name,
-                file_path=os.path.join('output', 'images', result[0]),
-                workflow_id=workflow.id,
-                variables={
-                    'prompt': prompt,
-                    'seed': seed_value,
-                    'style': image_style,
-                    'topic': topic
-                }
-            )
-            db.session.add(image)
-            db.session.commit()
+            # 与生成任务相同：纳入输出 blob 存储、写入文件元数据并预热缩略图
+            [image] = save_generated_images(result[:1], workflow, {
+                'prompt': prompt,
+                'seed': seed_value,
+                'style': image_style,
+                'topic': topic
+            }, content_hashes)
+            generated_images.append(image.file_path)
+            logger.info('Generated image: %s', image.file_path)
             logger.info('Saved image record to database: %d', image.id)
 
     return generated_images
@@ -0,0 +1,76 @@
+import hashlib
+import io
+import os
+import sys
+import time
+
+import pytest
+
+# Add the backend directory to the Python path
+backend_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'backend')
+sys.path.insert(0, os.path.abspath(backend_dir))
+
+from app.utils.blob_store import BlobStore
+from app.utils.chunked_upload import ChunkedUploadStore, UploadSessionError
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChunkedUploadStore(BlobStore(str(tmp_path / 'blobs')), ttl=60)
+
+
+def test_resume_from_reported_offset(store):
+    data = os.urandom(3000)
+    session = store.create('a.png', len(data), hashlib.sha256(data).hexdigest())
+
+    assert store.write_chunk(session['id'], 0, io.BytesIO(data[:1000]), 1000) == 1000
+
+    # 重复发送已接收的分片：409，并告知服务端的 offset
+    with pytest.raises(UploadSessionError) as exc:
+        store.write_chunk(session['id'], 0, io.BytesIO(data[:1000]), 1000)
+    assert exc.value.status_code == 409
+    assert exc.value.offset == 1000
+
+    # 服务重启后没有进程内的增量哈希，offset 由 .part 大小得出，完成时重新计算哈希
+    resumed = ChunkedUploadStore(store.blob_store, ttl=60)
+    offset = resumed.get(session['id'])['offset']
+    assert offset == 1000
+    assert resumed.write_chunk(session['id'], offset, io.BytesIO(data[offset:]), len(data) - offset) == len(data)
+
+    meta, content_hash, blob_path, created = resumed.complete(session['id'])
+    assert content_hash == hashlib.sha256(data).hexdigest()
+    assert created
+    with open(blob_path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_bad_chunk_is_discarded(store):
+    data = b'x' * 100
+    session = store.create('a.png', len(data))
+    store.write_chunk(session['id'], 0, io.BytesIO(data[:40]), 40)
+
+    with pytest.raises(UploadSessionError) as exc:
+        store.write_chunk(session['id'], 40, io.BytesIO(data[40:]), 60, chunk_sha256='0' * 64)
+    assert exc.value.status_code == 422
+    assert store.get(session['id'])['offset'] == 40
+
+    with pytest.raises(UploadSessionError) as exc:
+        store.complete(session['id'])
+    assert exc.value.status_code == 409
+
+
+def test_purge_keeps_sessions_with_recent_chunks(store):
+    idle = store.create('idle.png', 100)
+    active = store.create('active.png', 100)
+    old = time.time() - 3600
+    for session in (idle, active):
+        os.utime(store._meta_path(session['id']), (old, old))
+        os.utime(store._part_path(session['id']), (old, old))
+
+    # 会话创建已久，但刚收到过分片
+    store.write_chunk(active['id'], 0, io.BytesIO(b'y' * 10), 10)
+
+    assert store.purge_expired() == 1
+    with pytest.raises(UploadSessionError):
+        store.get(idle['id'])
+    assert store.get(active['id'])['offset'] == 10
@@ -0,0 +1,95 @@
+import os
+import sys
+import zlib
+from datetime import datetime
+
+import pytest
+
+# Add the backend directory to the Python path
+backend_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'backend')
+sys.path.insert(0, os.path.abspath(backend_dir))
+
+from app.utils.image_archive import ImageArchive, ArchiveError, _HEADER
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return ImageArchive(root=str(tmp_path / 'archive'), level=6)
+
+
+def _write(path, data: bytes) -> str:
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_append_read_restore_round_trip(archive, tmp_path):
+    compressible = b'\x00' * 4096 + b'png-ish payload' * 100
+    incompressible = os.urandom(2048)
+    members = [
+        (1, _write(tmp_path / 'a.png', compressible), 'hash-a'),
+        (2, _write(tmp_path / 'b.png', incompressible), None),
+        (3, str(tmp_path / 'missing.png'), None),
+    ]
+    name = archive.pack_name(datetime(2020, 5, 1).date())
+
+    written = archive.append(name, members)
+
+    # 读取失败的文件被跳过，其余按顺序返回偏移与原始大小
+    assert [(image_id, size) for image_id, _, size in written] == [(1, len(compressible)), (2, len(incompressible))]
+    offsets = {image_id: offset for image_id, offset, _ in written}
+    assert offsets[1] == 0
+    assert archive.read(name, offsets[1]) == compressible
+    assert archive.read(name, offsets[2]) == incompressible
+    with open(archive.index_path(name), encoding='utf-8') as f:
+        assert len(f.readlines()) == 2
+
+    # 追加到已有打包文件时偏移接着文件末尾
+    more = archive.append(name, [(4, _write(tmp_path / 'c.png', b'later'), None)])
+    assert more[0][1] == os.path.getsize(archive.pack_path(name)) - _HEADER.size - len(b'later')
+    assert archive.read(name, more[0][1]) == b'later'
+
+    mtime = datetime(2020, 5, 1, 12)
+    dest = str(tmp_path / 'hot' / '2020' / 'a.png')
+    assert archive.restore(name, offsets[1], dest, mtime) == dest
+    with open(dest, 'rb') as f:
+        assert f.read() == compressible
+    assert os.stat(dest).st_mtime == mtime.timestamp()
+    assert not [n for n in os.listdir(os.path.dirname(dest)) if n.endswith('.tmp')]
+
+
+def test_corrupt_member_fails_crc_check(archive, tmp_path):
+    data = os.urandom(1024)
+    name = archive.pack_name(datetime(2020, 5, 2).date())
+    [(_, offset, _)] = archive.append(name, [(1, _write(tmp_path / 'a.png', data), None)])
+
+    # 改写一个内容字节：长度不变，CRC32 校验失败
+    with open(archive.pack_path(name), 'r+b') as pack:
+        pack.seek(offset + _HEADER.size + 10)
+        byte = pack.read(1)
+        pack.seek(-1, os.SEEK_CUR)
+        pack.write(bytes([byte[0] ^ 0xFF]))
+    assert zlib.crc32(data) != zlib.crc32(data[:10] + bytes([data[10] ^ 0xFF]) + data[11:])
+    with pytest.raises(ArchiveError):
+        archive.read(name, offset)
+    with pytest.raises(ArchiveError):
+        archive.restore(name, offset, str(tmp_path / 'out.png'))
+    assert not os.path.exists(tmp_path / 'out.png')
+
+
+def test_bad_offset_and_pack_name(archive, tmp_path):
+    name = archive.pack_name(datetime(2020, 5, 3).date())
+    [(_, offset, _)] = archive.append(name, [(1, _write(tmp_path / 'a.png', b'abc'), None)])
+    with pytest.raises(ArchiveError):
+        archive.read(name, offset + 1)
+    with pytest.raises(ArchiveError):
+        archive.read(name, os.path.getsize(archive.pack_path(name)))
+    with pytest.raises(ArchiveError):
+        archive.pack_path('../escape.pack')
+
+
+def test_remove_pack(archive, tmp_path):
+    name = archive.pack_name(datetime(2020, 5, 4).date())
+    archive.append(name, [(1, _write(tmp_path / 'a.png', b'abc'), None)])
+    assert archive.pack_names() == [name]
+    assert archive.remove_pack(name) > 0
+    assert archive.pack_names() == []
@@ -0,0 +1,151 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+# Add the backend directory to the Python path
+backend_dir = os.path.join(os.path.dirname(__file__), '..', '..', 'backend')
+sys.path.insert(0, os.path.abspath(backend_dir))
+
+from app.extensions import db
+from app.models import variable_definitions  # noqa: F401  WorkflowVariable 关系引用的模型
+from app.models.image import DeletedImagePath, Image, ImageDirectoryManifest, ImageSource, ImageType
+from app.utils.image_ingest import ImageIngestor, IngestIndex, group_upload_duplicates, sync_directory
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def library(tmp_path):
+    directory = tmp_path / 'library'
+    (directory / 'sub').mkdir(parents=True)
+    for name in ('a.png', 'b.jpg', os.path.join('sub', 'c.png')):
+        (directory / name).write_bytes(b'image')
+    (directory / 'notes.txt').write_text('not an image')
+    return str(directory)
+
+
+def _local_paths():
+    return sorted(os.path.basename(p) for (p,) in db.session.query(Image.local_path)
+                  .filter(Image.source == ImageSource.local_dir))
+
+
+def test_rescan_restores_rows_deleted_without_files(app, library):
+    _, result = sync_directory(library)
+    db.session.commit()
+    assert result.added == 3
+
+    # 与 /images/clear-local 相同：只删除记录，文件与目录清单都还在
+    Image.query.filter_by(source=ImageSource.local_dir).delete()
+    db.session.commit()
+    assert ImageDirectoryManifest.query.count() == 2
+
+    scan, result = sync_directory(library)
+    db.session.commit()
+    assert len(scan.unchanged) == 3
+    assert result.added == 3
+    assert _local_paths() == ['a.png', 'b.jpg', 'c.png']
+
+
+def test_force_rescan_skips_manifest_comparison(app, library):
+    sync_directory(library)
+    db.session.commit()
+    Image.query.filter_by(source=ImageSource.local_dir).delete()
+    db.session.commit()
+
+    scan, result = sync_directory(library, ImageType.advertising, force=True)
+    db.session.commit()
+    assert scan.unchanged == []
+    assert len(scan.modified) == 3
+    assert result.added == 3
+    assert {t for (t,) in db.session.query(Image.image_type)} == {ImageType.advertising}
+
+
+def test_add_skips_deleted_paths_and_duplicate_filenames(app, library):
+    db.session.add(DeletedImagePath(local_path=os.path.join(library, 'b.jpg')))
+    db.session.commit()
+    with open(os.path.join(library, 'sub', 'a.png'), 'wb') as f:
+        f.write(b'same name in another directory')
+
+    scan, result = sync_directory(library, ImageType.advertising_rule)
+    db.session.commit()
+    assert len(scan.added) == 4
+    # b.jpg 被用户删除过，sub/a.png 与已入库的 a.png 同名
+    assert (result.added, result.skipped) == (2, 2)
+    assert _local_paths() == ['a.png', 'c.png']
+    row = Image.query.filter_by(filename='c.png').one()
+    assert row.image_type == ImageType.advertising_rule
+    assert row.file_size == len(b'image')
+
+
+def test_unchanged_files_are_retyped(app, library):
+    sync_directory(library)
+    db.session.commit()
+
+    scan, result = sync_directory(library)
+    db.session.commit()
+    assert scan.reused_dirs == 2
+    assert (result.added, result.updated, result.skipped) == (0, 0, 3)
+
+    scan, result = sync_directory(library, ImageType.advertising)
+    db.session.commit()
+    assert len(scan.unchanged) == 3
+    assert (result.added, result.updated) == (0, 3)
+    assert {t for (t,) in db.session.query(Image.image_type)} == {ImageType.advertising}
+
+
+def test_removed_files_delete_their_rows(app, library):
+    sync_directory(library)
+    db.session.commit()
+    os.remove(os.path.join(library, 'a.png'))
+    os.remove(os.path.join(library, 'sub', 'c.png'))
+    os.rmdir(os.path.join(library, 'sub'))
+
+    scan, result = sync_directory(library)
+    db.session.commit()
+    assert sorted(os.path.basename(p) for p in scan.removed) == ['a.png', 'c.png']
+    assert result.removed == 2
+    assert _local_paths() == ['b.jpg']
+    assert ImageDirectoryManifest.query.count() == 1
+
+
+def test_reclassify_merges_upload_duplicates(app, library):
+    # 与 /images/reclassify 相同的流程：按目录下的文件名合并并纠正上传记录
+    uploads = [
+        Image(filename='a.png', file_path='/uploads/a.png', source=ImageSource.upload),
+        Image(filename='a.png', file_path='/uploads/a.png', source=ImageSource.upload,
+              image_type=ImageType.advertising),
+        Image(filename='b.jpg', file_path='/uploads/b.jpg', source=ImageSource.upload),
+        Image(filename='b.jpg', file_path='/uploads/b.jpg', source=ImageSource.upload),
+        Image(filename='other.png', file_path='/uploads/other.png', source=ImageSource.upload),
+    ]
+    db.session.add_all(uploads)
+    db.session.commit()
+    ids = [image.id for image in uploads]
+
+    filenames = {'a.png', 'b.jpg'}
+    index = IngestIndex.load_uploads(filenames)
+    assert 'other.png' not in index.upload_by_filename
+    ingestor = ImageIngestor(index)
+    delete_ids, targets, total = group_upload_duplicates(index, filenames, ImageType.advertising)
+    ingestor.delete_rows(delete_ids)
+    ingestor.retype_rows([t for t in targets if t.image_type != ImageType.advertising], ImageType.advertising)
+    ingestor.flush()
+    db.session.commit()
+
+    assert total == 4
+    # a.png 保留已是目标类型的记录，b.jpg 保留 id 最大的记录
+    assert sorted(delete_ids) == [ids[0], ids[2]]
+    remaining = {image.id: image.image_type for image in Image.query.all()}
+    assert remaining == {ids[1]: ImageType.advertising, ids[3]: ImageType.advertising,
+                         ids[4]: ImageType.general}